@@ -374,44 +374,73 @@ def plot_validation_curves(scores_dfs, best_params_, title, rowsize=(12,4), ncol
     return fig
 
 
-def plot_learning_curves(X, y, estimators, cv, ncols=3, fig_width=17, rowsize=5):
+def plot_learning_curves(X, y, estimators, cv, ncols=3, fig_width=17, rowsize=5, curves=None, scoring='roc_auc', n_jobs=-1, cache_folder=None):
+    """
+    Plot the learning curves of the estimators ({name: estimator}) on one figure.
+    The curves are computed by `model.validating.learning_curves` (in parallel, cached in `cache_folder` if it is given)
+    unless they are passed as `curves` (its result), so the figure can be restyled without computing them again.
+    """
     from sklearn.model_selection import LearningCurveDisplay
-    count_params = {
-        "X": X,
-        "y": y,
-        "train_sizes": np.linspace(0.1, 1.0, 5),  #it is the default value
-        "cv": cv,
-        "scoring": "roc_auc",
-        "n_jobs": -1,
-    }
+    if curves is None:
+        from model.validating import learning_curves
+        curves = learning_curves(X, y, estimators, cv, scoring=scoring, n_jobs=n_jobs, cache_folder=cache_folder)
     plot_params = {
         "line_kw": {"marker": "o"},
         #default=”fill_between” -The style used to display the score standard deviation around the mean score. If None, no representation of the standard deviation is displayed.
         "std_display_style": "fill_between",
         # The name of the score used to decorate the y-axis of the plot. It will override the name inferred from the scoring parameter.
-        "score_name": "Score: ROC_AUC",
+        "score_name": f"Score: {scoring.upper()}",
     }
 
-    def plot(estimator, est_name, ax=None):
+    def plot(est_name, ax=None):
         # score_type is the type of score to plot. Can be one of "test", "train", or "both".
-        LearningCurveDisplay.from_estimator(estimator, **count_params, score_type="both", **plot_params, ax=ax)
+        LearningCurveDisplay(**curves[est_name]).plot(ax=ax, score_type="both", **plot_params)
         if ax is None:
             plt.title(f'Learning curve of {est_name}')
         else:
             ax.set_title(f'Learning curve of {est_name}')
     
-    if len(estimators.keys()) == 1:
+    if len(curves.keys()) == 1:
         fig, ax = plt.subplots(figsize=(fig_width, rowsize), sharey=True)
-        est_name = list(estimators.keys())[0]
-        plot(estimators[est_name], est_name, ax=ax)
+        est_name = list(curves.keys())[0]
+        plot(est_name, ax=ax)
     else:
-        nrows = math.ceil(len(estimators.keys()) / ncols)
+        nrows = math.ceil(len(curves.keys()) / ncols)
         fig, axs = plt.subplots(nrows=nrows, ncols=ncols, figsize=(fig_width, rowsize * nrows), sharey=True)
         axs = axs.flatten()
 
-        for i, (estimator, est_name) in enumerate(estimators.items()):
-            plot(estimator, est_name, ax=ax[i])
+        for i, est_name in enumerate(curves.keys()):
+            plot(est_name, ax=axs[i])
     plt.tight_layout()
     plt.close()
     return fig
 
+
+
+def plot_partial_dependence(pipeline, X, features, ncols=3, fig_width=17, rowsize=4, pdp=None, **kwargs):
+    """
+    Plot the partial dependence of the fitted pipeline on each of the features, a panel per feature.
+    The partial dependence is computed by `model.explaining.partial_dependence` (`kwargs` are passed to it)
+    unless it is passed as `pdp` (its result), so the figure can be restyled without computing it again.
+    """
+    if pdp is None:
+        from model.explaining import partial_dependence
+        pdp = partial_dependence(pipeline, X, features, **kwargs)
+    ncols = min(ncols, len(features))
+    nrows = math.ceil(len(features) / ncols)
+    fig, axs = plt.subplots(nrows, ncols, figsize=(fig_width, nrows * rowsize), squeeze=False)
+    axs = axs.flatten()
+    for ax, feature in zip(axs, features):
+        dependence = pdp[feature]
+        if pd.api.types.is_numeric_dtype(dependence.index):
+            ax.plot(dependence.index, dependence.to_numpy(), marker='.')
+        else:
+            ax.bar(dependence.index.astype(str), dependence.to_numpy())
+            ax.tick_params(axis='x', labelrotation=90)
+        ax.set_xlabel(feature)
+        ax.set_ylabel('Partial dependence')
+    for ax in axs[len(features):]:
+        fig.delaxes(ax)
+    plt.tight_layout()
+    plt.close()
+    return fig
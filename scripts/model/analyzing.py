@@ -7,6 +7,7 @@ from consts import format
 from input_output_plot.printing import output_formatting as paint
 from input_output_plot.plotting import lineplot
 from helpers import flatten_list_of_dicts
+from model.profiling import summarize_profile
 
 KEY_BEST_ESTIMATOR_SCORES = 'best_estimator_scores'
 
@@ -55,6 +56,20 @@ def add_grid_search_key_results(grid_search_results:list[dict], stage:str, file_
     print(f'--- data is saved to {file_path} ---')
 
 
+def add_profile_of_stage_to_file(grid_search_results:list[dict], stage:str, file_path:str, by=None):
+    """
+    Save the profile of the searches of a stage run with `profile=True` to a markdown file:
+    the total time of each pipeline step for each search, or the mean per fit for each value of the parameters `by`
+    (e.g. 'transformer' or 'reduce_dim'), see `model.profiling.summarize_profile`.
+    """
+    with open(file_path, 'a', encoding='utf-8') as f: 
+        f.write(f'\n\n## Stage: {stage} (profile)\n')
+    profiles_dfs = {f"{grid_search_result['name']}\ntime: {grid_search_result['search_time']/60} min\n":
+                    summarize_profile(grid_search_result['profile'], by=by)
+                    for grid_search_result in grid_search_results if 'profile' in grid_search_result}
+    add_data_frames_to_file(file_path, profiles_dfs)
+
+
 def concatenate_estimators_scores(grid_search_results, score_key=KEY_BEST_ESTIMATOR_SCORES):
     """
     Concatenate the scores DataFrames from multiple grid search results into a single DataFrame.
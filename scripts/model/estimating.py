@@ -117,29 +117,121 @@ class WrapModelTrainSizeParam:
         return self.model_instance.score(X, y)  
 
 
-def run_classifier_grid_search(estimator, Xtrain, ytrain, Xtest=None, ytest=None, scoring='roc_auc',cv=5, refit='roc_auc', return_train_score=True, **kwargs):
+def run_classifier_grid_search(estimator, Xtrain, ytrain, Xtest=None, ytest=None, scoring='roc_auc',cv=5, refit='roc_auc', return_train_score=True, n_jobs=-1, cpu_budget=None, shared_data=False, search='grid', search_params=None, profile=False, memory_budget=None, memory_calibration=1.0, **kwargs):
+    """
+    Runs a search (GridSearchCV by default) on the pipeline created by `make_pipeline` and returns a dictionary with results:
+
+    {
+        'search_time': execution time in sec,
+        'grid_search': fitted search object (GridSearchCV or one of SEARCH_MODES),
+        'cpu_budget': (only if `cpu_budget` is given) the plan of the budget's splitting and the achieved utilisation,
+        'profile': (only if `profile` is True) the profile table, see `model.profiling.profile_table`,
+        'memory': (only if `memory_budget` is given) the budget, the records of the estimated and actual peak memory
+                  of each fit (a list of dicts, so they are saved with the stage) and the calibration factor of the estimations,
+        predictions and scores on the test set if `Xtest` and `ytest` are given
+    }
+
+    If `cpu_budget` is None, the search runs `n_jobs` parallel fits and each estimator uses its own default number of threads.
+    Otherwise the budget (number of CPUs, -1 for all of them) is split between parallel fits and the threads of each fit
+    (the estimators' `n_jobs`, OpenMP and BLAS thread pools), see `model.resources.plan_cpu_budget`. The `n_jobs`
+    of the estimators are set on clones, the given pipeline and grid are left unchanged.
+
+    If `shared_data` is True, the train set, its labels and the folds are published once into memory-mapped files
+    and the workers attach to them instead of receiving their own copies (see `model.resources.SharedDataset`).
+
+    `search` chooses the search class from SEARCH_MODES, e.g. 'halving' for successive halving over companies
+    or train lengths (see `model.searching.TimeSeriesHalvingSearchCV`), 'prefix' to fit the largest ensemble of
+    an n_estimators/max_iter grid once per fold and score the smaller ones on its first trees
+    (see `model.searching.PrefixEnsembleSearchCV`), 'path' to walk the C/alpha grid of a linear model with warm starts
+    (see `model.searching.RegularisationPathSearchCV`), 'window' to transform each fold once and train on windows of
+    whole dates for every train length (see `model.searching.TrainWindowSearchCV`), 'budget' to sample the candidates
+    at random and then by a surrogate model until a wall-clock or CPU time budget is spent
+    (see `model.searching.BudgetedSearchCV`); `search_params` are passed to its constructor.
+
+    If `profile` is True, the pipeline is run as a ProfiledPipeline and the scorer adds to cv_results_ the fit time
+    of each step, the transform and score times, the peak RSS and the rows/features seen for each candidate and fold
+    (see `model.profiling.ProfilingScorer`).
+
+    If `memory_budget` is given (bytes, a share of the total memory or a string like '16G'), each fit reserves its
+    estimated memory (multiplied by `memory_calibration`) and waits until the fits running in parallel leave room
+    for it in the budget (see `model.resources.MemoryAdmission`). The calibration factor of the results can be passed
+    as `memory_calibration` of the next runs.
+    """
+    import tempfile
     import time
-    from sklearn.model_selection import GridSearchCV  
-    from sklearn.metrics import accuracy_score, average_precision_score, roc_auc_score, f1_score, recall_score, log_loss, confusion_matrix 
+    from contextlib import ExitStack
+    from joblib import parallel_config
+    from sklearn.base import is_classifier
+    from sklearn.model_selection import check_cv
+    from sklearn.metrics import recall_score, confusion_matrix
+    from model.resources import AdmittedPipeline, CpuUtilisationMonitor, MemoryAdmission, SharedDataset, clone_grid_estimator, plan_cpu_budget, set_inner_n_jobs
+    from model.profiling import AdmittedProfiledPipeline, ProfiledPipeline, ProfilingScorer, profile_table
+    from model.scoring import SCORES, predict_once, scores_from_predictions
+    from model.searching import SEARCH_MODES
 
     #print(f'Grid search for {color}{estimator["model"]}{del_format}')
     #print(f'Parameters: {estimator["params"]}')
     #print(f'{scoring=}')
     #print('=========================')
-    grid_search = GridSearchCV(
-        estimator=estimator['model'],
+    cpu_plan = None
+    if cpu_budget is not None:
+        cpu_plan = plan_cpu_budget(estimator, check_cv(cv).get_n_splits(Xtrain, ytrain), cpu_budget)
+        n_jobs = cpu_plan['outer_jobs']
+        estimator = clone_grid_estimator(estimator)
+        set_inner_n_jobs(estimator, cpu_plan['inner_threads'])
+
+    admission = None
+    if memory_budget is not None:
+        admission_folder = tempfile.TemporaryDirectory()
+        admission = MemoryAdmission(memory_budget, admission_folder.name, calibration=memory_calibration)
+
+    pipeline = estimator['model']
+    if admission is not None:
+        pipeline_class = AdmittedProfiledPipeline if profile else AdmittedPipeline
+        pipeline = pipeline_class(pipeline.steps, memory=pipeline.memory, verbose=pipeline.verbose, admission=admission)
+    elif profile:
+        pipeline = ProfiledPipeline(pipeline.steps, memory=pipeline.memory, verbose=pipeline.verbose)
+    if profile:
+        scoring = ProfilingScorer(scoring, steps=[name for name, _ in pipeline.steps[:-1]])
+
+    grid_search = SEARCH_MODES[search](
+        estimator=pipeline,
         param_grid=estimator['params'],
         cv=cv, 
         scoring=scoring, 
         refit=refit,
-        n_jobs=-1,
+        n_jobs=n_jobs,
         return_train_score=return_train_score, #set it to False reduces fitting time, but we lose the train scores in cv_results_ 
         verbose=1,
+        **(search_params or {}),
         **kwargs
     )
 
     start_time = time.perf_counter()
-    grid_search.fit(Xtrain, ytrain)
+    try:
+        with ExitStack() as stack:
+            X_fit, y_fit = Xtrain, ytrain
+            if shared_data:
+                shared = stack.enter_context(SharedDataset(Xtrain, ytrain, check_cv(cv, ytrain, classifier=is_classifier(estimator['model']))))
+                X_fit, y_fit, grid_search.cv = shared.X, shared.y, shared.cv
+            if cpu_plan is not None:
+                # inner_max_num_threads limits OpenMP and BLAS thread pools in the workers
+                stack.enter_context(parallel_config(backend='loky', inner_max_num_threads=cpu_plan['inner_threads']))
+                monitor = stack.enter_context(CpuUtilisationMonitor(cpu_plan['cpu_budget']))
+            grid_search.fit(X_fit, y_fit)
+        if admission is not None:
+            memory = {'budget_mb': admission.budget / 2**20, 'records': admission.records().to_dict(orient='records'),
+                      'calibration_factor': admission.calibration_factor()}
+    finally:
+        grid_search.cv = cv
+        if admission is not None:
+            admission_folder.cleanup()
+            # the ledger is removed (also if a fit fails), the pipelines must not use it any more
+            grid_search.estimator.set_params(admission=None)
+            if hasattr(grid_search, 'best_estimator_'):
+                grid_search.best_estimator_.set_params(admission=None)
+    if cpu_plan is not None:
+        cpu_plan.update(monitor.results())
 
     end_time = time.perf_counter()
 
@@ -147,17 +239,21 @@ def run_classifier_grid_search(estimator, Xtrain, ytrain, Xtest=None, ytest=None
         'search_time': end_time - start_time,   
         'grid_search': grid_search,
     }
+    if cpu_plan is not None:
+        res['cpu_budget'] = cpu_plan
+    if profile:
+        res['profile'] = profile_table(grid_search)
+    if admission is not None:
+        res['memory'] = memory
  
     if Xtest is not None and ytest is not None:
-        res['predict'] = grid_search.predict(Xtest),
-        res['predict_prob'] = grid_search.predict_proba(Xtest),
-        res['accuracy'] = accuracy_score(ytest,res['predict'])
-        res['average_precision'] = average_precision_score(ytest,res['predict_prob'])
-        res['f1'] = f1_score(ytest,res['predict'], average='binary')
+        # one inference on the test set, the labels and all the scores are derived from the probabilities
+        best_estimator = grid_search.best_estimator_
+        y_score, res['predict'], response_method = predict_once(best_estimator, Xtest)
+        res['predict_prob'] = y_score
+        res.update(scores_from_predictions(ytest, y_score, res['predict'], positive_label=best_estimator.classes_[-1],
+                                           scores=SCORES, confusion_matrix_cells=[], response_method=response_method))
         res['recall'] = recall_score(ytest,res['predict'], average='binary')
-        res['roc_auc'] = roc_auc_score(ytest,res['predict_prob'])
-        res['log_loss'] = log_loss(ytest,res['predict_prob'])
         res['confusion_matrix'] = confusion_matrix(ytest,res['predict'])
     
     return res
-
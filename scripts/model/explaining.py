@@ -0,0 +1,327 @@
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+from sklearn.utils import _safe_indexing
+
+from consts import format
+from input_output_plot.printing import output_formatting as paint
+
+
+# z of the two-sided 95% confidence intervals of the importances
+CI_Z = 1.96
+# number of periods of the dates the rows are stratified by with stratify='label_period'
+N_PERIODS = 10
+# transformers which transform each column on its own, so the partial dependence substitutes the transformed grid values
+# of a feature into the transformed rows, see `_is_columnwise`
+COLUMNWISE_TRANSFORMERS = {'StandardScaler', 'MinMaxScaler', 'MaxAbsScaler', 'RobustScaler', 'QuantileTransformer',
+                           'PowerTransformer', 'KBinsDiscretizer', 'OneHotEncoder', 'OrdinalEncoder', 'TargetEncoder',
+                           'SimpleImputer', 'QuantileBinner'}
+
+
+def stratified_sample(strata, n_samples: int | None, random_state=0) -> np.ndarray:
+    """
+    Return sorted positions of a sample of `n_samples` rows keeping the shares of the strata
+    (proportional allocation, at least one row of each stratum). All the rows if `n_samples` is None or not smaller.
+    """
+    strata = np.asarray(strata)
+    if n_samples is None or n_samples >= len(strata):
+        return np.arange(len(strata))
+    rng = np.random.default_rng(random_state)
+    _, inverse, counts = np.unique(strata, return_inverse=True, return_counts=True)
+    allocation = np.minimum(counts, np.maximum(1, np.floor(counts * n_samples / len(strata)).astype(int)))
+    rows = [rng.choice(np.flatnonzero(inverse == stratum), size, replace=False) for stratum, size in enumerate(allocation)]
+    return np.sort(np.concatenate(rows))
+
+
+def _strata(X, y, stratify):
+    """Return the strata of the rows: the labels ('label'), the labels and the periods of the dates ('label_period') or given values."""
+    if isinstance(stratify, str):
+        labels = np.zeros(len(X), dtype=int) if y is None else np.asarray(y)
+        if stratify == 'label':
+            return labels
+        if stratify == 'label_period':
+            periods = pd.qcut(pd.Series(X.index).rank(method='first'), N_PERIODS, labels=False).to_numpy()
+            return labels * N_PERIODS + periods
+        raise ValueError(f"stratify must be 'label', 'label_period' or the strata of the rows, got {stratify!r}")
+    return np.asarray(stratify)
+
+
+def transform_for_explanation(pipeline, X):
+    """
+    Transform X once by the fitted steps of the pipeline before its final estimator.
+    Return the transformed data (as the final estimator sees it), the names of its features
+    and the final estimator (the model of WrapModelTrainSizeParam).
+    """
+    if isinstance(pipeline, Pipeline):
+        transformers, estimator = pipeline[:-1], pipeline.steps[-1][1]
+        Xt = transformers.transform(X)
+    else:
+        transformers, estimator, Xt = None, pipeline, X
+    if hasattr(Xt, 'columns'):
+        feature_names = np.asarray(Xt.columns, dtype=str)
+    else:
+        try:
+            feature_names = np.asarray(transformers.get_feature_names_out(), dtype=str)
+        except (AttributeError, TypeError, ValueError):
+            feature_names = np.asarray([f'x{i}' for i in range(Xt.shape[1])])
+    model_instance = getattr(estimator, 'model_instance', None)
+    return Xt, feature_names, estimator if model_instance is None else model_instance
+
+
+def model_fingerprint(pipeline) -> str:
+    """
+    Return a hash identifying a fitted model: the folder and the index of the forest artifact for pipelines
+    loaded by `model.storing.load_forest_artifact`, the hash of the pickled pipeline otherwise. Hashing a pickled
+    forest takes seconds, so compute it once per pipeline and pass it as `fingerprint` to the explaining functions.
+    """
+    import joblib
+    from model.storing import MappedForestClassifier
+
+    estimator = pipeline.steps[-1][1] if isinstance(pipeline, Pipeline) else pipeline
+    if isinstance(estimator, MappedForestClassifier):
+        return joblib.hash((os.path.abspath(estimator.folder), estimator.meta_))
+    return joblib.hash(pipeline)
+
+
+def _cache_path(cache_folder: str | None, kind: str, pipeline, fingerprint: str | None, X, y, params: dict) -> str | None:
+    import joblib
+    if cache_folder is None:
+        return None
+    if fingerprint is None:
+        fingerprint = model_fingerprint(pipeline)
+    os.makedirs(cache_folder, exist_ok=True)
+    data = (pd.util.hash_pandas_object(X, index=True).to_numpy(), None if y is None else np.asarray(y), list(X.columns))
+    return os.path.join(cache_folder, f'{kind}_{joblib.hash((fingerprint, data, params))}.npz')
+
+
+def _load_cached(path: str | None, verbose: bool) -> dict | None:
+    if path is None or not os.path.exists(path):
+        return None
+    if verbose:
+        print(f'load cached results from {paint(path, format)}')
+    with np.load(path) as cached:
+        return {key: cached[key] for key in cached.files}
+
+
+def _positive_class(values):
+    """Return the SHAP values (or the expected value) of the positive class of a binary classifier."""
+    if isinstance(values, list):
+        return np.asarray(values[-1])
+    values = np.asarray(values)
+    return values[..., -1] if values.ndim == 3 or (values.ndim == 1 and values.size == 2) else values
+
+
+def _shap_values(estimator, X) -> tuple[np.ndarray, float]:
+    import shap
+    explainer = shap.TreeExplainer(estimator)
+    values = explainer.shap_values(X, check_additivity=False)
+    return _positive_class(values), float(np.ravel(_positive_class(explainer.expected_value))[0])
+
+
+def _importance_table(feature_names, mean, std, n, population=None, **columns) -> pd.DataFrame:
+    """Return the importances with their 95% confidence intervals (with the finite population correction) sorted by the mean."""
+    se = std / np.sqrt(n)
+    if population is not None and population > 1:
+        se = se * np.sqrt(max(0.0, (population - n) / (population - 1)))
+    table = pd.DataFrame({'importance': mean, 'std': std, 'ci_low': mean - CI_Z * se, 'ci_high': mean + CI_Z * se, **columns},
+                         index=pd.Index(feature_names, name='feature'))
+    return table.sort_values('importance', ascending=False)
+
+
+def shap_importance(pipeline, X: pd.DataFrame, y=None, n_samples: int | None = 5000, stratify='label',
+                    n_jobs: int | None = -1, n_chunks: int | None = None, cache_folder: str | None = None,
+                    fingerprint: str | None = None, random_state=0, verbose: bool = True) -> dict:
+    """
+    Compute TreeSHAP values of the positive class of a fitted pipeline with a tree model (e.g. the chosen random forest)
+    on a stratified sample of the rows and the mean absolute SHAP value of each feature with its 95% confidence interval.
+
+    The sample keeps the shares of the labels ('label'), of the labels and the periods of the dates ('label_period')
+    or of given strata. The rows are transformed once by the steps of the pipeline and the SHAP values of chunks
+    of the rows are computed by `n_jobs` processes. If `cache_folder` is given, the values are cached in it by the model
+    (`fingerprint`, computed by `model_fingerprint` if not given), the data and the parameters. `shap` must be installed.
+
+    Returns:
+        dict: {'importance': table of the features sorted by the mean absolute SHAP value (with 'mean_shap'),
+               'shap_values': (rows x features) array, 'expected_value': the base value,
+               'X': the transformed sample (for shap plots), 'rows': positions of the sample in X}
+    """
+    from model.storing import MappedForestClassifier
+
+    rows = stratified_sample(_strata(X, y, stratify), n_samples, random_state)
+    Xt, feature_names, estimator = transform_for_explanation(pipeline, X.iloc[rows])
+    if isinstance(estimator, MappedForestClassifier):
+        raise TypeError('TreeSHAP needs the node sample weights which a forest artifact does not store, explain the original pipeline')
+
+    path = _cache_path(cache_folder, 'shap', pipeline, fingerprint, X, y, {'rows': rows})
+    cached = _load_cached(path, verbose)
+    if cached is None:
+        from joblib import Parallel, delayed, effective_n_jobs
+        n_chunks = n_chunks or min(len(rows), 4 * effective_n_jobs(n_jobs))
+        chunks = np.array_split(np.arange(len(rows)), n_chunks)
+        out = Parallel(n_jobs=n_jobs)(delayed(_shap_values)(estimator, _safe_indexing(Xt, chunk)) for chunk in chunks)
+        cached = {'shap_values': np.concatenate([values for values, _ in out]), 'expected_value': np.asarray(out[0][1])}
+        if path is not None:
+            np.savez(path, **cached)
+
+    shap_values = cached['shap_values']
+    abs_values = np.abs(shap_values)
+    importance = _importance_table(feature_names, abs_values.mean(axis=0), abs_values.std(axis=0, ddof=1), len(rows),
+                                   population=len(X), mean_shap=shap_values.mean(axis=0))
+    return {'importance': importance, 'shap_values': shap_values, 'expected_value': float(cached['expected_value']),
+            'X': pd.DataFrame(np.asarray(Xt), columns=feature_names), 'rows': rows}
+
+
+def _permuted_scores(estimator, Xt, y, column: int, score: str, n_repeats: int, random_state) -> np.ndarray:
+    """Return the scores of the estimator with the values of a column of the transformed data shuffled `n_repeats` times."""
+    from model.scoring import predict_once, scores_from_predictions
+
+    rng = np.random.default_rng([random_state, column])
+    Xp = Xt.copy()
+    values = np.asarray(_safe_indexing(Xt, column, axis=1))
+    scores = np.empty(n_repeats)
+    for repeat in range(n_repeats):
+        if hasattr(Xp, 'iloc'):
+            Xp.iloc[:, column] = rng.permutation(values)
+        else:
+            Xp[:, column] = rng.permutation(values)
+        y_score, y_pred, response_method = predict_once(estimator, Xp)
+        scores[repeat] = scores_from_predictions(y, y_score, y_pred, positive_label=estimator.classes_[-1], scores=[score],
+                                                 confusion_matrix_cells=[], response_method=response_method)[score]
+    return scores
+
+
+def permutation_importance_transformed(pipeline, X: pd.DataFrame, y, score: str = 'roc_auc', n_repeats: int = 5,
+                                       n_samples: int | None = None, stratify='label', n_jobs: int | None = -1,
+                                       cache_folder: str | None = None, fingerprint: str | None = None, random_state=0,
+                                       verbose: bool = True) -> pd.DataFrame:
+    """
+    Compute the permutation importance of the features the final estimator of a fitted pipeline sees:
+    the (optionally sampled, see `shap_importance`) rows are transformed once and the columns of the transformed
+    matrix are shuffled, instead of running the pipeline for each shuffled column. The columns are permuted
+    by `n_jobs` processes and each permutation is scored from one inference (`score` from model.scoring.SCORES).
+    The importances are cached in `cache_folder` like the SHAP values of `shap_importance`.
+    Works with pipelines of forest artifacts as well (see `model.storing.load_forest_artifact`).
+
+    Returns:
+        pd.DataFrame: the mean decrease of the score of each feature ('importance', the increase for log_loss),
+        its std for the repeats and its 95% confidence interval, sorted by the importance.
+    """
+    from joblib import Parallel, delayed
+    from model.scoring import predict_once, scores_from_predictions
+
+    rows = stratified_sample(_strata(X, y, stratify), n_samples, random_state)
+    path = _cache_path(cache_folder, 'permutation', pipeline, fingerprint, X, y,
+                       {'rows': rows, 'score': score, 'n_repeats': n_repeats, 'random_state': random_state})
+    Xt, feature_names, estimator = transform_for_explanation(pipeline, X.iloc[rows])
+    cached = _load_cached(path, verbose)
+    if cached is None:
+        y_sample = np.asarray(y)[rows]
+        y_score, y_pred, response_method = predict_once(estimator, Xt)
+        baseline = scores_from_predictions(y_sample, y_score, y_pred, positive_label=estimator.classes_[-1], scores=[score],
+                                           confusion_matrix_cells=[], response_method=response_method)[score]
+        permuted = Parallel(n_jobs=n_jobs)(delayed(_permuted_scores)(estimator, Xt, y_sample, column, score, n_repeats, random_state)
+                                           for column in range(len(feature_names)))
+        cached = {'importances': (np.asarray(permuted) - baseline) * (1 if score == 'log_loss' else -1)}
+        if path is not None:
+            np.savez(path, **cached)
+    importances = cached['importances']
+    return _importance_table(feature_names, importances.mean(axis=1), importances.std(axis=1, ddof=1), n_repeats)
+
+
+def feature_grid(values, grid_resolution: int = 50, percentiles=(0.05, 0.95)) -> np.ndarray:
+    """
+    Return the grid of values of a feature for partial dependence: its unique values if there are at most
+    `grid_resolution` of them or it is not numeric, evenly spaced values between its `percentiles` otherwise.
+    """
+    values = pd.Series(values).dropna()
+    unique = np.sort(values.unique())
+    if len(unique) <= grid_resolution or not pd.api.types.is_numeric_dtype(values):
+        return unique
+    low, high = np.quantile(values, percentiles)
+    return np.linspace(low, high, grid_resolution)
+
+
+def _is_columnwise(step) -> bool:
+    """
+    Check if a fitted step transforms each input column on its own: one of COLUMNWISE_TRANSFORMERS, 'passthrough',
+    'drop', or a ColumnTransformer (e.g. EncoderNameScalerDigitCols), Pipeline or NamedTransformer made of them.
+    """
+    from sklearn.compose import ColumnTransformer
+
+    if step is None or isinstance(step, str):
+        return True
+    if isinstance(step, Pipeline):
+        return all(_is_columnwise(inner_step) for _, inner_step in step.steps)
+    if isinstance(step, ColumnTransformer):
+        return all(_is_columnwise(transformer) for _, transformer, _ in step.transformers_)
+    if step.__class__.__name__ == 'NamedTransformer':
+        return _is_columnwise(step.transformer)
+    return step.__class__.__name__ in COLUMNWISE_TRANSFORMERS
+
+
+def _transformed_grid(transform, X: pd.DataFrame, Xt: np.ndarray, feature: str, grid: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the positions of the transformed columns which depend on the feature and their values for each grid value
+    (grid values x columns), for a column-wise transformation (see `_is_columnwise`): the columns which change
+    when the feature of all the rows is set to the first grid value or which differ between the grid values.
+    """
+    first = np.asarray(transform(X.assign(**{feature: grid[0]})), dtype=float)
+    changed = ~np.isclose(first, Xt, equal_nan=True).all(axis=0)
+    probe = X.iloc[np.zeros(len(grid), dtype=int)].assign(**{feature: grid})
+    values = np.asarray(transform(probe), dtype=float)
+    changed |= ~np.isclose(values, values[:1], equal_nan=True).all(axis=0)
+    return np.flatnonzero(changed), values[:, changed]
+
+
+def partial_dependence(pipeline, X: pd.DataFrame, features: list[str], grid_resolution: int = 50, percentiles=(0.05, 0.95),
+                       n_samples: int | None = None, y=None, stratify='label', batch_rows: int = 2**18,
+                       random_state=0) -> dict[str, pd.Series]:
+    """
+    Compute the partial dependence of the score of the positive class of a fitted pipeline (the mean of the scores
+    with the feature set to each value of its grid, see `feature_grid`) on each of the `features`.
+
+    The (optionally sampled, see `shap_importance`) rows are transformed once by the steps of the pipeline. If all the steps
+    transform each column on its own (see `_is_columnwise`), only the grid values of a feature are transformed and
+    substituted into its columns of the transformed rows (see `_transformed_grid`), otherwise the rows are transformed
+    again for each grid value.
+    The perturbed rows of all the (feature, grid value) pairs are stacked into batches of about `batch_rows` rows,
+    each predicted by one call of the final estimator.
+
+    Returns:
+        dict: {feature: pd.Series of the partial dependence indexed by the grid values of the feature}
+    """
+    from model.scoring import predict_scores
+
+    X = X.iloc[stratified_sample(_strata(X, y, stratify), n_samples, random_state)]
+    Xt, _, estimator = transform_for_explanation(pipeline, X)
+    transform = pipeline[:-1].transform if isinstance(pipeline, Pipeline) else (lambda data: data)
+    columns = getattr(Xt, 'columns', None)
+    Xt = np.asarray(Xt, dtype=float)
+
+    grids = {feature: feature_grid(X[feature], grid_resolution, percentiles) for feature in features}
+    columnwise = not isinstance(pipeline, Pipeline) or _is_columnwise(pipeline[:-1])
+    perturbations = []
+    for feature, grid in grids.items():
+        separable = _transformed_grid(transform, X, Xt, feature, grid) if columnwise else None
+        for idx, value in enumerate(grid):
+            perturbations.append((feature, idx, value, None if separable is None else (separable[0], separable[1][idx])))
+
+    def perturbed_rows(feature, value, substitution):
+        if substitution is None:
+            return np.asarray(transform(X.assign(**{feature: value})), dtype=float)
+        rows = Xt.copy()
+        rows[:, substitution[0]] = substitution[1]
+        return rows
+
+    averages = {feature: np.empty(len(grid)) for feature, grid in grids.items()}
+    batch_size = max(1, batch_rows // len(X))
+    for start in range(0, len(perturbations), batch_size):
+        batch = perturbations[start:start + batch_size]
+        stacked = np.concatenate([perturbed_rows(feature, value, substitution) for feature, _, value, substitution in batch])
+        y_score, _ = predict_scores(estimator, stacked if columns is None else pd.DataFrame(stacked, columns=columns))
+        for (feature, idx, _, _), average in zip(batch, y_score.reshape(len(batch), len(X)).mean(axis=1)):
+            averages[feature][idx] = average
+    return {feature: pd.Series(averages[feature], index=pd.Index(grid, name=feature), name='partial_dependence')
+            for feature, grid in grids.items()}
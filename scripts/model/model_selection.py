@@ -1,7 +1,8 @@
-from os.path import isfile as path_isfile
+from os.path import basename, isfile as path_isfile, normpath, splitext
 from pickle import load as pkl_load, dump as pkl_dump
 from typing import Protocol, Iterable
 
+import numpy as np
 import pandas as pd
 
 from sklearn.base import BaseEstimator, TransformerMixin
@@ -13,6 +14,14 @@ from sklearn.pipeline import Pipeline
 from consts import format
 from input_output_plot.printing import output_formatting as paint
 from model.estimating import WrapModelTrainSizeParam, run_classifier_grid_search
+from model.profiling import summarize_profile
+from model.searching import print_halving_schedule
+from model.storing import is_stage_store, load_stage, save_stage
+
+
+# models which are trained on the binned features if `binner` of train_classifiers is given
+BINNED_MODELS = {'decisiontreeclassifier', 'randomforestclassifier', 'extratreesclassifier',
+                 'gradientboostingclassifier', 'histgradientboostingclassifier'}
 
 
 class MultiTimeSeriesSplit(TimeSeriesSplit):  
@@ -141,6 +150,130 @@ class MultiTimeSeriesSplit(TimeSeriesSplit):
                 )
 
 
+class TickerSampler:
+    """
+    Draws reproducible nested subsets of companies (tickers) of a data set with a 'Name' column, e.g. for fast stages
+    of the model selection: the tickers are ordered once and a subset of size n is the first n tickers of the order,
+    so 40 ⊂ 100 ⊂ 250 ⊂ all. The rows of each subset are found once (as an int32 array of positions) and the
+    subsets are materialised once, the next calls return the cached data.
+
+    If `stratify` is given, the order interleaves the strata of the tickers so that every prefix keeps
+    the proportions of the strata (each next ticker is taken from the stratum which is the most behind its share).
+
+    Parameters
+    ----------
+    sizes : list of int or None, default=(40, 100, 250, None)
+        The sizes of the subsets of the stages, None means all the tickers.
+    random_state : int, default=0
+        Seed of the order of the tickers (inside each stratum).
+    stratify : str, pd.Series or None, default=None
+        A column of X (a numeric column is aggregated for each ticker by `aggregate` and cut into `n_strata` quantiles,
+        e.g. the standard deviation of daily returns gives volatility strata, other columns, e.g. a sector, are used
+        as is), or a Series of the strata indexed by the tickers.
+    aggregate : str, default='mean'
+        The aggregation of a numeric `stratify` column for each ticker, e.g. 'std' for volatility.
+    n_strata : int, default=4
+        The number of quantile strata of a numeric `stratify`.
+    complete_history : bool, default=False
+        Sample only the tickers which have rows on all the dates.
+
+    Usage
+    -----
+    >>> sampler = TickerSampler(sizes=[40, 100, None], stratify='Return', aggregate='std').fit(X_train, y_train)
+    >>> X_train_small, y_train_small = sampler.sample(40)
+    >>> sampler.describe()
+    """
+    def __init__(self, sizes=(40, 100, 250, None), random_state=0, stratify=None, aggregate='mean', n_strata=4, complete_history=False):
+        self.sizes = sizes
+        self.random_state = random_state
+        self.stratify = stratify
+        self.aggregate = aggregate
+        self.n_strata = n_strata
+        self.complete_history = complete_history
+
+    def _strata(self, X, tickers) -> pd.Series | None:
+        """Return the stratum of each ticker or None if the sampling is not stratified."""
+        if self.stratify is None:
+            return None
+        if isinstance(self.stratify, pd.Series):
+            return self.stratify.reindex(tickers)
+        values = X.groupby('Name', sort=False)[self.stratify]
+        if pd.api.types.is_numeric_dtype(X[self.stratify]):
+            values = values.agg(self.aggregate).reindex(tickers)
+            return pd.qcut(values.rank(method='first'), self.n_strata, labels=False)
+        return values.agg(lambda x: x.mode().iloc[0]).reindex(tickers)
+
+    def fit(self, X: pd.DataFrame, y: pd.Series | None = None):
+        """Order the tickers of X and remember the data set to sample from."""
+        self._X, self._y = X, y
+        self._codes, tickers = pd.factorize(X['Name'])
+        self._all_tickers = tickers
+        tickers = np.asarray(tickers)
+        if self.complete_history:
+            dates = X.index.get_level_values('date')
+            n_dates = pd.Series(dates).groupby(self._codes).nunique()
+            tickers = tickers[n_dates.reindex(range(len(tickers))).to_numpy() == dates.nunique()]
+
+        rng = np.random.default_rng(self.random_state)
+        strata = self._strata(X, tickers)
+        if strata is None:
+            self.tickers_order_ = rng.permutation(tickers)
+        else:
+            strata = strata.fillna('-').to_numpy()
+            groups = [rng.permutation(tickers[strata == stratum]) for stratum in pd.unique(strata)]
+            taken = np.zeros(len(groups))
+            order = []
+            for _ in range(len(tickers)):
+                # the stratum with the smallest taken share among the not exhausted ones
+                shares = [taken[i] / len(group) if taken[i] < len(group) else np.inf for i, group in enumerate(groups)]
+                i = int(np.argmin(shares))
+                order.append(groups[i][int(taken[i])])
+                taken[i] += 1
+            self.tickers_order_ = np.asarray(order)
+        self.strata_ = None if strata is None else pd.Series(strata, index=tickers).reindex(self.tickers_order_)
+        self._rows, self._samples = {}, {}
+        return self
+
+    def tickers(self, size: int | None = None) -> np.ndarray:
+        """Return the tickers of the subset of the given size (all the tickers if `size` is None)."""
+        return self.tickers_order_[:size]
+
+    def rows(self, size: int | None = None) -> np.ndarray:
+        """Return the positions of the rows of the subset in the data set (computed once)."""
+        if size not in self._rows:
+            tickers_codes = self._all_tickers.get_indexer(self.tickers(size))
+            self._rows[size] = np.flatnonzero(np.isin(self._codes, tickers_codes)).astype(np.int32)
+        return self._rows[size]
+
+    def sample(self, size: int | None = None) -> tuple[pd.DataFrame, pd.Series | None]:
+        """Return the rows of the subset of the given size of X and y (materialised once)."""
+        if size not in self._samples:
+            rows = self.rows(size)
+            self._samples[size] = (self._X.iloc[rows], None if self._y is None else self._y.iloc[rows])
+        return self._samples[size]
+
+    def samples(self):
+        """Yield (size, X, y) for the sizes of the stages."""
+        for size in self.sizes:
+            yield (size, *self.sample(size))
+
+    def clear_cache(self) -> None:
+        self._samples = {}
+
+    def describe(self) -> pd.DataFrame:
+        """Return the number of tickers and rows, the share of positive labels and of each stratum for each size."""
+        res = {}
+        for size in self.sizes:
+            rows = self.rows(size)
+            row = {'tickers': len(self.tickers(size)), 'rows': len(rows)}
+            if self._y is not None:
+                row['positive'] = float(np.mean(self._y.to_numpy()[rows] == 1))
+            if self.strata_ is not None:
+                row.update(self.strata_.iloc[:size].value_counts(normalize=True).rename(lambda stratum: f'stratum {stratum}'))
+            res['all' if size is None else size] = row
+        return pd.DataFrame(res).T
+
+
 def is_train_test_folds_have_common_dates(cv: TimeSeriesSplit, X: pd.DataFrame) -> bool:
     """
     Check if there are any overlapping dates between the train and test folds
@@ -161,15 +294,20 @@ def is_train_test_folds_have_common_dates(cv: TimeSeriesSplit, X: pd.DataFrame)
     return False
 
 
-def make_pipeline(configed_model, column_transformers, configed_dim_reducers=None, train_set_lengths=None):
+def make_pipeline(configed_model, column_transformers, configed_dim_reducers=None, train_set_lengths=None, binner=None, memory=None):
     """
         Creates a pipline for a model which consists of
         - a column transformer layer
+        - a dim reducer layer
+        - a binner layer if `binner` is given (e.g. QuantileBinner for tree models)
         - a model layer, which is a model wrapped by WrapTrainSizeParam class. WrapTrainSizeParam adds the size of train set to the model's parameters.
+        `memory` (a joblib.Memory or a folder) caches the fitted layers before the model, so they are fitted once
+        per fold and their parameters and reused by all the model's candidates.
     """
     # TODO add support for transformers parameters, like for dim_redusers; use itertools.product to simplify the code
     STEP_NAME_REDUCER = "reduce_dim"
     STEP_NAME_TRANSFORMER = "transformer"
+    STEP_NAME_BINNER = "binner"
 
     params = configed_model['params']
     model_name = configed_model['model'].__name__.lower()
@@ -206,25 +344,39 @@ def make_pipeline(configed_model, column_transformers, configed_dim_reducers=Non
         for param_name, param_values in configed_dim_reducers['params'].items():
             param_grid[f"{STEP_NAME_REDUCER}__{param_name}"] = param_values
 
-    pipeline = Pipeline([
+    steps = [
         (STEP_NAME_TRANSFORMER, transformer),
         (STEP_NAME_REDUCER, reducer_dim), 
         (model_name, model)
-        ])
+        ]
+    if binner is not None:
+        steps.insert(-1, (STEP_NAME_BINNER, binner))
+    pipeline = Pipeline(steps, memory=memory)
     return {
         'model': pipeline,
         'params':param_grid,
         }
 
 
-def train_classifiers(results_file, classifiers, X, y, scoring, cv, column_transformers, configed_dim_reducers=None, train_set_lengths=None, return_train_score=True, refit='roc_auc',**kwargs):
+def train_classifiers(results_file, classifiers, X, y, scoring, cv, column_transformers, configed_dim_reducers=None, train_set_lengths=None, return_train_score=True, refit='roc_auc', results_format='pickle', save_estimators=False, binner=None, cache_folder=None, stage_index=None, stage=None, **kwargs):
     """
     runs grid search on chosen classifiers and reruns a dictionary with results:  
 
     {  
         'search_time': execution time in sec,  
-        'grid_search': fitted GridSearchCV object,  
+        'grid_search': fitted GridSearchCV object (or another search object if `search` is given, see `run_classifier_grid_search`),  
     }
+
+    The results are saved to `results_file` and loaded from it if it exists.
+    `results_format` is 'pickle' (the whole fitted search objects) or 'columnar': `results_file` is a folder with
+    cv_results_ columns and key results, the best estimators are saved only if `save_estimators` is True,
+    and 'grid_search' of the loaded results is a `model.storing.StoredSearch` (see `model.storing.save_stage`).
+
+    If `binner` is given (e.g. QuantileBinner()), the features of BINNED_MODELS are binned after the dim reducer.
+    If `cache_folder` is given, the fitted transformers, dim reducers and binners are cached in it
+    (see `memory` of `make_pipeline`), so each fold is transformed and binned once for all the candidates of a model.
+    If `stage_index` (a `model.storing.StageIndex`) is given, the key results are added to it as `stage`
+    (the name of `results_file` by default), so the stages can be compared without loading them.
 """
     
     grid_search_results = []
@@ -241,13 +393,14 @@ def train_classifiers(results_file, classifiers, X, y, scoring, cv, column_trans
         configed_dim_reducers = {configed_model['model'].__name__.lower() : configed_dim_reducers for configed_model in classifiers}
 
 
-    if not path_isfile(results_file):
+    if not path_isfile(results_file) and not is_stage_store(results_file):
         for configed_model in classifiers:
             model_name = configed_model['model'].__name__.lower()
             print(f'Run grid search on {paint(model_name, format)} classifier')
             print('With', paint('parameters:',format), configed_model['params'])
             print('For', paint('train set lengths:', format), train_set_lengths)
-            pipeline = make_pipeline(configed_model, column_transformers[model_name], configed_dim_reducers[model_name], train_set_lengths)
+            pipeline = make_pipeline(configed_model, column_transformers[model_name], configed_dim_reducers[model_name], train_set_lengths,
+                                     binner=binner if model_name in BINNED_MODELS else None, memory=cache_folder)
             #print('Pipeline:', pipeline)
             grid_search_result = run_classifier_grid_search( 
                 pipeline,
@@ -263,16 +416,37 @@ def train_classifiers(results_file, classifiers, X, y, scoring, cv, column_trans
         
             print('-----------------------------------------------------')
             print(f"Grid search took {paint(grid_search_result['search_time']/60, format)} minutes")
+            if 'cpu_budget' in grid_search_result:
+                cpu_plan = grid_search_result['cpu_budget']
+                print(f"CPU budget {cpu_plan['cpu_budget']}: {cpu_plan['outer_jobs']} parallel fits x {cpu_plan['inner_threads']} threads, "
+                      f"utilisation {paint(f'{cpu_plan['utilisation']:.0%}', format)}")
+            if 'profile' in grid_search_result:
+                print(paint('Search time by steps:', format))
+                print(summarize_profile(grid_search_result['profile']))
+            if 'memory' in grid_search_result:
+                memory = grid_search_result['memory']
+                records = pd.DataFrame(memory['records'])
+                print(f"Memory budget {memory['budget_mb']:.0f} MB: peak of a fit estimated {records['estimated_mb'].max():.0f} MB, "
+                      f"actual {records['actual_mb'].max():.0f} MB, waiting {records['waiting_time'].sum():.1f} sec, "
+                      f"calibration factor {paint(f'{memory['calibration_factor']:.2f}', format)}")
+            if hasattr(grid_search_result['grid_search'], 'halving_schedule_'):
+                print_halving_schedule(grid_search_result['grid_search'])
             print(paint('Best parameters:',format), grid_search_result['grid_search'].best_params_)
             print(paint('Best scores:',format), grid_search_result['grid_search'].best_score_)
             print('===================================================================================================================')
         
-        with open(results_file, 'wb') as f:
-            pkl_dump(grid_search_results, f)
+        if results_format == 'columnar':
+            save_stage(grid_search_results, results_file, save_estimators=save_estimators)
+        else:
+            with open(results_file, 'wb') as f:
+                pkl_dump(grid_search_results, f)
     else:
         print(f'load trained models from {results_file}')
-        with open(results_file, 'rb') as f:
-            grid_search_results = pkl_load(f)
+        if is_stage_store(results_file):
+            grid_search_results = load_stage(results_file)
+        else:
+            with open(results_file, 'rb') as f:
+                grid_search_results = pkl_load(f)
         for grid_search_result in grid_search_results:
             print(f"Model {paint(grid_search_result['name'], format)}:")
             print('With', paint('parameters:',format), grid_search_result['grid_search'].param_grid)
@@ -281,6 +455,8 @@ def train_classifiers(results_file, classifiers, X, y, scoring, cv, column_trans
             print(f"Search time: {paint(grid_search_result['search_time']/60, format)} minutes")
             print('===================================================================================================================')
 
+    if stage_index is not None:
+        stage_index.add(stage or splitext(basename(normpath(results_file)))[0], results_file, grid_search_results)
     return grid_search_results
 
 
@@ -392,4 +568,70 @@ class NamedTransformer(BaseEstimator, TransformerMixin):
     def describe(self):
         return self.__str__()
     def get_feature_names_out(self):
-        return self.transformer.get_feature_names_out()
\ No newline at end of file
+        return self.transformer.get_feature_names_out()
+
+
+class QuantileBinner(BaseEstimator, TransformerMixin):
+    """
+    Transformer which bins each feature by its quantiles into a uint8 matrix (8 times smaller than float64),
+    with the semantics of KBinsDiscretizer(encode='ordinal', strategy='quantile'): the edges are the percentiles
+    of the feature, edges closer than 1e-8 are merged and values on an edge go to the right bin.
+    Missing values are put to the bin `n_bins`, after all the other bins, so tree models send them to the side
+    of the largest values (the bins are plain numbers, the models do not see them as missing).
+
+    Tree models split the bins the same way as the float features up to the quantile resolution.
+    HistGradientBoostingClassifier (max_bins=255) keeps each bin apart in its own bins if there are at most
+    255 distinct bins, i.e. `n_bins` < 255 or no missing values; the missing bin is one of its value bins.
+    With `memory` of the pipeline the binned matrix of a fold is computed once and reused by all the model candidates.
+
+    Parameters
+    ----------
+    n_bins : int, default=255
+        The maximal number of bins of a feature, from 2 to 255.
+    subsample : int or None, default=200_000
+        The maximal number of rows the quantiles are computed on, None for all the rows.
+    random_state : int, default=0
+        The seed of the subsampling.
+    """
+    def __init__(self, n_bins=255, subsample=200_000, random_state=0):
+        self.n_bins = n_bins
+        self.subsample = subsample
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        if not 2 <= self.n_bins <= 255:
+            raise ValueError(f'n_bins must be from 2 to 255, got {self.n_bins}')
+        if hasattr(X, 'columns'):
+            self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+        X = np.asarray(X, dtype=np.float64)
+        self.n_features_in_ = X.shape[1]
+        if self.subsample is not None and X.shape[0] > self.subsample:
+            rows = np.random.default_rng(self.random_state).choice(X.shape[0], self.subsample, replace=False)
+            X = X[rows]
+        percentiles = np.linspace(0, 100, self.n_bins + 1)
+        self.bin_edges_ = []
+        for column in X.T:
+            column = column[~np.isnan(column)]
+            if column.size == 0:
+                self.bin_edges_.append(np.array([-np.inf, np.inf]))
+                continue
+            edges = np.percentile(column, percentiles)
+            self.bin_edges_.append(edges[np.ediff1d(edges, to_begin=np.inf) > 1e-8])
+        self.n_bins_ = np.array([max(1, edges.size - 1) for edges in self.bin_edges_])
+        return self
+
+    def transform(self, X):
+        from sklearn.utils.validation import check_is_fitted
+        check_is_fitted(self, 'bin_edges_')
+        X = np.asarray(X, dtype=np.float64)
+        Xt = np.empty(X.shape, dtype=np.uint8)
+        for idx, edges in enumerate(self.bin_edges_):
+            column = X[:, idx]
+            binned = np.searchsorted(edges[1:-1], column, side='right')
+            binned[np.isnan(column)] = self.n_bins
+            Xt[:, idx] = binned
+        return Xt
+
+    def get_feature_names_out(self, input_features=None):
+        from sklearn.utils.validation import _check_feature_names_in
+        return _check_feature_names_in(self, input_features)
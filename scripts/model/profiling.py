@@ -0,0 +1,159 @@
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import get_scorer
+from sklearn.pipeline import Pipeline
+from sklearn.utils.metaestimators import available_if
+
+from model.resources import MemoryAdmissionMixin, peak_rss, reset_peak_rss
+
+
+PROFILE_PREFIX = 'profile_'
+# the key of the final estimator's fit time, the keys of the other steps are 'fit_<step name>'
+FIT_ESTIMATOR = 'fit_estimator'
+# measures of a (candidate, fold) besides the fit time of each step
+PROFILE_MEASURES = ['transform', 'score', 'peak_rss_mb', 'n_rows', 'n_features']
+
+
+def _final_estimator_has(attr):
+    return lambda self: hasattr(self._final_estimator, attr)
+
+
+class ProfiledPipeline(Pipeline):
+    """
+    Pipeline which records in `profile_` the fit time of each step, the peak RSS of the process during the fit,
+    the number of rows and features passed to the final estimator and the time the steps spend transforming data
+    for predictions (accumulated until `reset_transform_time` is called).
+
+    Steps are fitted one by one without caching (the `memory` of the pipeline is not used for the fit).
+    """
+    def fit(self, X, y=None, **params):
+        self._validate_steps()
+        # 'step__param' parameters are routed to their steps as Pipeline.fit does it
+        routed_params = self._check_method_params(method='fit', props=params)
+        self.profile_ = {}
+        reset_peak_rss()
+        Xt = X
+        for name, step in self.steps[:-1]:
+            if step is None or step == 'passthrough':
+                continue
+            start_time = time.perf_counter()
+            if hasattr(step, 'fit_transform'):
+                Xt = step.fit_transform(Xt, y, **routed_params[name].get('fit_transform', {}))
+            else:
+                Xt = step.fit(Xt, y, **routed_params[name].get('fit', {})).transform(Xt)
+            self.profile_[f'fit_{name}'] = time.perf_counter() - start_time
+        self.profile_['n_rows'], self.profile_['n_features'] = np.shape(Xt)[0], np.shape(Xt)[1]
+        start_time = time.perf_counter()
+        if self._final_estimator != 'passthrough':
+            self._final_estimator.fit(Xt, y, **routed_params[self.steps[-1][0]]['fit'])
+        self.profile_[FIT_ESTIMATOR] = time.perf_counter() - start_time
+        self.profile_['peak_rss_mb'] = peak_rss() / 2**20
+        self.profile_['transform'] = 0.0
+        return self
+
+    def reset_transform_time(self) -> None:
+        self.profile_['transform'] = 0.0
+
+    def _transform_for_prediction(self, X):
+        start_time = time.perf_counter()
+        for _, _, transformer in self._iter(with_final=False):
+            X = transformer.transform(X)
+        self.profile_['transform'] += time.perf_counter() - start_time
+        return X
+
+    @available_if(_final_estimator_has('predict'))
+    def predict(self, X, **params):
+        return self.steps[-1][1].predict(self._transform_for_prediction(X), **params)
+
+    @available_if(_final_estimator_has('predict_proba'))
+    def predict_proba(self, X, **params):
+        return self.steps[-1][1].predict_proba(self._transform_for_prediction(X), **params)
+
+    @available_if(_final_estimator_has('decision_function'))
+    def decision_function(self, X, **params):
+        return self.steps[-1][1].decision_function(self._transform_for_prediction(X), **params)
+
+
+class AdmittedProfiledPipeline(MemoryAdmissionMixin, ProfiledPipeline):
+    """ProfiledPipeline whose fits are admitted by a memory budget, see model.resources.MemoryAdmissionMixin."""
+
+
+class ProfilingScorer:
+    """
+    Scorer for a search over a ProfiledPipeline which adds the profile of the fitted pipeline to the scores,
+    so the search stores it in cv_results_ for each candidate and fold ('split<i>_test_profile_<measure>').
+
+    The measures are the fit time of each step ('fit_<step name>', 'fit_estimator'), the time of transforming
+    the scored set ('transform'), the rest of the scoring time ('score'), the peak RSS during the fit in MB
+    and the number of rows and features passed to the final estimator. The measures which are unknown
+    (e.g. the search fitted the steps itself) are NaN.
+
+    Parameters
+    ----------
+    scoring : str, list of str or callable returning a dict
+        The scores, as `scoring` of GridSearchCV.
+    steps : list of str
+        Names of the steps of the pipeline before the final estimator.
+    """
+    def __init__(self, scoring, steps: list[str]):
+        self.scoring = scoring
+        self.steps = steps
+
+    def _scores(self, clf, X, y) -> dict:
+        if callable(self.scoring):
+            return self.scoring(clf, X, y)
+        scoring = [self.scoring] if isinstance(self.scoring, str) else self.scoring
+        return {name: get_scorer(name)(clf, X, y) for name in scoring}
+
+    def __call__(self, clf, X, y) -> dict:
+        profile = getattr(clf, 'profile_', {})
+        if profile:
+            clf.reset_transform_time()
+        start_time = time.perf_counter()
+        res = self._scores(clf, X, y)
+        score_time = time.perf_counter() - start_time
+        measures = [*(f'fit_{step}' for step in self.steps), FIT_ESTIMATOR, *PROFILE_MEASURES]
+        for measure in measures:
+            res[f'{PROFILE_PREFIX}{measure}'] = profile.get(measure, np.nan)
+        if profile:
+            res[f'{PROFILE_PREFIX}score'] = score_time - profile['transform']
+        return res
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(scoring={self.scoring!r}, steps={self.steps})'
+
+
+def profile_table(grid_search) -> pd.DataFrame:
+    """
+    Return the profile of a search with ProfilingScorer as a table with a row for each candidate and fold:
+    the candidate's parameters (as strings) and the measures on the test fold (see ProfilingScorer).
+    """
+    cv_results = grid_search.cv_results_
+    n_splits = grid_search.n_splits_
+    measures = [key[len(f'split0_test_{PROFILE_PREFIX}'):] for key in cv_results
+                if key.startswith(f'split0_test_{PROFILE_PREFIX}')]
+    rows = []
+    for idx, candidate in enumerate(cv_results['params']):
+        params = {name: value if isinstance(value, (str, int, float)) or value is None else str(value)
+                  for name, value in candidate.items()}
+        for split in range(n_splits):
+            row = {'candidate': idx, 'split': split, **params}
+            row.update({measure: cv_results[f'split{split}_test_{PROFILE_PREFIX}{measure}'][idx] for measure in measures})
+            rows.append(row)
+    return pd.DataFrame(rows).set_index(['candidate', 'split'])
+
+
+def summarize_profile(table: pd.DataFrame, by: str | list[str] | None = None) -> pd.DataFrame:
+    """
+    Summarise a profile table: the total time of each measure (sum for all candidates and folds) and its share,
+    or, if `by` (parameter names, e.g. 'transformer' or 'reduce_dim') is given, the mean of each measure
+    per fit for each value of the parameters, so the steps which dominate the search cost can be compared.
+    """
+    time_columns = [column for column in table.columns if column.startswith('fit_') or column in ('transform', 'score')]
+    if by is None:
+        total = table[time_columns].sum()
+        return pd.DataFrame({'time': total, 'share': total / total.sum()}).sort_values('time', ascending=False)
+    measures = [*time_columns, 'peak_rss_mb', 'n_rows', 'n_features']
+    return table.groupby(by)[[measure for measure in measures if measure in table.columns]].mean()
@@ -0,0 +1,666 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, clone
+from sklearn.model_selection import ParameterGrid
+from sklearn.pipeline import Pipeline
+
+
+# How an estimator parallelises its own work:
+#   'n_jobs' - through its `n_jobs` parameter (joblib threads inside the estimator),
+#   'native' - through native thread pools (OpenMP, BLAS), which are limited by threadpoolctl,
+#   None     - it runs in one thread.
+# Estimators which are not listed are considered as 'native', because most of them call BLAS via numpy.
+INNER_PARALLELISM = {
+    'RandomForestClassifier': 'n_jobs',
+    'ExtraTreesClassifier': 'n_jobs',
+    'HistGradientBoostingClassifier': 'native',
+    'GradientBoostingClassifier': None,
+    'LogisticRegression': 'native',
+    'SGDClassifier': None,
+    'GaussianNB': None,
+    'SVC': None,
+    'FastICA': 'native',
+    'PCA': 'native',
+    # wrappers, their own work is negligible
+    'WrapModelTrainSizeParam': None,
+    'NamedTransformer': None,
+    'EncoderNameScalerDigitCols': None,
+    'ColumnTransformer': None,
+}
+
+
+def _unwrap_estimators(obj) -> list:
+    """
+    Return the list of estimators hidden in `obj`: steps of a pipeline, the model wrapped by WrapModelTrainSizeParam,
+    transformers of a ColumnTransformer or of a NamedTransformer.
+    """
+    if obj is None or isinstance(obj, str):
+        return []
+    if isinstance(obj, Pipeline):
+        return [est for _, step in obj.steps for est in _unwrap_estimators(step)]
+    res = [obj]
+    if getattr(obj, 'model_instance', None) is not None:  # WrapModelTrainSizeParam
+        res += _unwrap_estimators(obj.model_instance)
+    if getattr(obj, 'transformer', None) is not None:  # NamedTransformer
+        res += _unwrap_estimators(obj.transformer)
+    for _, transformer, _ in getattr(obj, 'transformers', []):  # ColumnTransformer
+        res += _unwrap_estimators(transformer)
+    return res
+
+
+def _grid_estimators(param_grid) -> list:
+    """Return the estimators which are used as values in the parameters grid (e.g. transformers or dimension reducers)."""
+    grids = [param_grid] if isinstance(param_grid, dict) else param_grid
+    res = []
+    for grid in grids:
+        for values in grid.values():
+            for value in values:
+                if isinstance(value, BaseEstimator) or hasattr(value, 'fit'):
+                    res += _unwrap_estimators(value)
+    return res
+
+
+def inner_parallelism(estimator) -> str | None:
+    """Return the way the estimator parallelises its own work (see INNER_PARALLELISM)."""
+    return INNER_PARALLELISM.get(estimator.__class__.__name__, 'native')
+
+
+def plan_cpu_budget(estimator: dict, n_splits: int, cpu_budget: int | None = None) -> dict:
+    """
+    Split a CPU budget between the outer parallelism of a grid search (candidates x folds fitted in parallel processes)
+    and the inner parallelism of the estimators (their own threads, OpenMP and BLAS thread pools).
+
+    The outer level gets as many processes as there are tasks to run (up to the budget), because independent fits scale
+    better than threads inside one fit. The rest of the budget is given to each fit, if the pipeline contains estimators
+    which are able to use it.
+
+    Args:
+        estimator (dict): A dictionary with keys 'model' (a pipeline) and 'params' (its parameters grid), see `make_pipeline`.
+        n_splits (int): The number of cross validation splits.
+        cpu_budget (int, optional): The number of CPUs the search can use. None or -1 means all CPUs of the machine.
+
+    Returns:
+        dict: The plan with keys
+            'cpu_budget' - the number of CPUs,
+            'n_tasks' - the number of fits (candidates x splits),
+            'outer_jobs' - n_jobs for the grid search,
+            'inner_threads' - the number of threads for each fit,
+            'inner_parallelism' - dictionary {estimator's class name: the way it parallelises its work}.
+    """
+    if cpu_budget is None or cpu_budget == -1:
+        cpu_budget = os.cpu_count()
+    elif cpu_budget < 1:
+        raise ValueError('cpu_budget must be a positive integer, -1 or None')
+
+    n_tasks = len(ParameterGrid(estimator['params'])) * n_splits
+    estimators = _unwrap_estimators(estimator['model']) + _grid_estimators(estimator['params'])
+    parallelism = {est.__class__.__name__: inner_parallelism(est) for est in estimators}
+
+    outer_jobs = max(1, min(cpu_budget, n_tasks))
+    if any(parallelism.values()):
+        inner_threads = max(1, cpu_budget // outer_jobs)
+    else:
+        inner_threads = 1
+    return {
+        'cpu_budget': cpu_budget,
+        'n_tasks': n_tasks,
+        'outer_jobs': outer_jobs,
+        'inner_threads': inner_threads,
+        'inner_parallelism': parallelism,
+    }
+
+
+def clone_grid_estimator(estimator: dict) -> dict:
+    """Return a copy of the estimator dict ({'model': pipeline, 'params': grid}) with clones of the pipeline and of the estimators in the grid."""
+    def clone_values(grid):
+        return {name: [clone(value, safe=False) if isinstance(value, BaseEstimator) or hasattr(value, 'fit') else value
+                       for value in values]
+                for name, values in grid.items()}
+
+    param_grid = estimator['params']
+    params = clone_values(param_grid) if isinstance(param_grid, dict) else [clone_values(grid) for grid in param_grid]
+    return {**estimator, 'model': clone(estimator['model']), 'params': params}
+
+
+def set_inner_n_jobs(estimator: dict, n_jobs: int) -> None:
+    """
+    Set `n_jobs` of the estimators which parallelise their work through this parameter,
+    both in the pipeline and in the estimators used as values of the parameters grid.
+    The estimators are changed in place, so pass a copy from `clone_grid_estimator` to keep the caller's ones.
+    """
+    pipeline = estimator['model']
+    for step_name, step in pipeline.steps:
+        step_estimators = _unwrap_estimators(step)
+        if any(inner_parallelism(est) == 'n_jobs' for est in step_estimators):
+            pipeline.set_params(**{f'{step_name}__n_jobs': n_jobs})
+    for est in _grid_estimators(estimator['params']):
+        if inner_parallelism(est) == 'n_jobs':
+            est.set_params(n_jobs=n_jobs)
+
+
+class CpuUtilisationMonitor:
+    """
+    Context manager which measures CPU time consumed by the current process and all its children
+    (e.g. loky workers of joblib) and the achieved utilisation of the given CPU budget.
+
+    The children are sampled by a background thread every `interval` seconds, because the workers outlive the search
+    and their CPU time is not accounted by the operating system for the parent process.
+
+    Attributes (set on exit):
+        wall_time (float): Elapsed time in seconds.
+        cpu_time (float): CPU seconds (user + system) spent by the process tree.
+        utilisation (float): cpu_time / (wall_time * cpu_budget).
+
+    Usage:
+        with CpuUtilisationMonitor(cpu_budget=8) as monitor:
+            grid_search.fit(X, y)
+        print(monitor.utilisation)
+    """
+
+    def __init__(self, cpu_budget: int, interval: float = 0.5):
+        self.cpu_budget = cpu_budget
+        self.interval = interval
+        self.wall_time = None
+        self.cpu_time = None
+        self.utilisation = None
+        self._cpu_by_pid = {}
+        self._stop = threading.Event()
+
+    def _sample(self):
+        import psutil
+        processes = [self._process] + self._process.children(recursive=True)
+        for process in processes:
+            try:
+                times = process.cpu_times()
+            except psutil.Error:  # the process has finished
+                continue
+            # children's CPU time is taken into account separately, so only own time of each process is summed
+            self._cpu_by_pid[process.pid] = times.user + times.system
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        import psutil
+        self._process = psutil.Process()
+        self._sample()
+        self._start_cpu = dict(self._cpu_by_pid)
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        self.wall_time = time.perf_counter() - self._start_time
+        self.cpu_time = sum(cpu - self._start_cpu.get(pid, 0) for pid, cpu in self._cpu_by_pid.items())
+        self.utilisation = self.cpu_time / (self.wall_time * self.cpu_budget) if self.wall_time > 0 else float('nan')
+        return False
+
+    def results(self) -> dict:
+        return {
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'utilisation': self.utilisation,
+        }
+
+
+# shared datasets attached in the current process, by their names
+_attached = {}
+
+
+def _shared_folder() -> str:
+    """Return the folder for shared files: RAM backed /dev/shm if it exists, the temporary folder otherwise."""
+    import tempfile
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def _publish_array(folder: str, name: str, array) -> dict:
+    path = os.path.join(folder, f'{name}.npy')
+    np.save(path, np.ascontiguousarray(array), allow_pickle=False)
+    return {'path': path}
+
+
+def _attach_array(handle: dict):
+    return np.load(handle['path'], mmap_mode='r')
+
+
+def _publish_index(folder: str, name: str, index) -> dict:
+    """
+    Save the index into .npy files, since object arrays cannot be memory-mapped: a MultiIndex level by level
+    (the integer codes of the rows and the values of each level), numbers and dates as they are,
+    other values (e.g. ticker names) as integer codes and their categories.
+    """
+    if isinstance(index, pd.MultiIndex):
+        return {'names': list(index.names),
+                'levels': [_publish_index(folder, f'{name}_level_{i}', level) for i, level in enumerate(index.levels)],
+                'codes': [_publish_array(folder, f'{name}_codes_{i}', codes) for i, codes in enumerate(index.codes)]}
+    handle = {'index_name': index.name, 'index_dtype': str(index.dtype), 'tz': None}
+    if getattr(index.dtype, 'kind', 'O') in 'biufmM':
+        handle.update(_publish_array(folder, name, index.values))
+        handle['tz'] = str(index.tz) if getattr(index, 'tz', None) is not None else None
+    else:
+        codes, categories = pd.factorize(index)
+        handle.update(_publish_array(folder, name, codes))
+        handle['categories'] = categories.tolist()
+    return handle
+
+
+def _attach_index(handle: dict):
+    """Rebuild the index saved by `_publish_index`, numbers and dates on top of memory-mapped arrays."""
+    if 'levels' in handle:
+        return pd.MultiIndex(levels=[_attach_index(level) for level in handle['levels']],
+                             codes=[_attach_array(codes) for codes in handle['codes']],
+                             names=handle['names'], verify_integrity=False)
+    if 'categories' in handle:
+        values = np.asarray(handle['categories'], dtype=object)[_attach_array(handle)]
+        return pd.Index(values, name=handle['index_name'], dtype=handle['index_dtype'])
+    if handle['tz'] is not None:
+        # the values of a time zone aware index are saved in UTC
+        return pd.DatetimeIndex(_attach_array(handle), name=handle['index_name']).tz_localize('UTC').tz_convert(handle['tz'])
+    return pd.Index(_attach_array(handle), name=handle['index_name'], dtype=handle['index_dtype'], copy=False)
+
+
+def _publish_frame(folder: str, name: str, df) -> dict:
+    """
+    Save columns of the DataFrame into .npy files: numeric columns grouped by dtype as 2D arrays,
+    other columns (e.g. 'Name') as categorical codes. The index is saved by `_publish_index`.
+    """
+    handle = {'name': name, 'columns': list(df.columns), 'blocks': [], 'categoricals': []}
+    numeric_cols = df.select_dtypes(include='number').columns
+    for dtype, cols in pd.Series(numeric_cols, index=numeric_cols).groupby(df.dtypes[numeric_cols].astype(str)):
+        block = _publish_array(folder, f'{name}_block_{dtype}', df[list(cols)].to_numpy(dtype=dtype))
+        block['columns'] = list(cols)
+        handle['blocks'].append(block)
+    for col in df.columns.difference(numeric_cols, sort=False):
+        categorical = pd.Categorical(df[col])
+        codes = _publish_array(folder, f'{name}_codes_{len(handle["categoricals"])}', categorical.codes)
+        codes.update(column=col, categories=list(categorical.categories), dtype=str(df[col].dtype))
+        handle['categoricals'].append(codes)
+    handle['index'] = _publish_index(folder, f'{name}_index', df.index)
+    return handle
+
+
+def _attach_frame(handle: dict):
+    """Rebuild the DataFrame saved by `_publish_frame` on top of memory-mapped arrays."""
+    key = ('frame', handle['name'])
+    if key not in _attached:
+        index = _attach_index(handle['index'])
+        parts = {}
+        for block in handle['blocks']:
+            values = _attach_array(block)
+            for i, col in enumerate(block['columns']):
+                parts[col] = values[:, i]
+        for codes in handle['categoricals']:
+            categorical = pd.Categorical.from_codes(_attach_array(codes), categories=codes['categories'])
+            if codes['dtype'] != 'category':
+                # the pipelines are fitted on string columns, so the encoders must see the same values
+                categorical = categorical.astype(codes['dtype'])
+            parts[codes['column']] = categorical
+        df = pd.DataFrame({col: parts[col] for col in handle['columns']}, index=index, copy=False)
+        df = SharedDataFrame(df, copy=False)
+        df._shared_handle = handle
+        _attached[key] = df
+    return _attached[key]
+
+
+def _attach_series(handle: dict):
+    key = ('series', handle['name'])
+    if key not in _attached:
+        index = _attach_index(handle['index'])
+        series = pd.Series(_attach_array(handle['values']), index=index, name=handle['series_name'], copy=False)
+        series = SharedSeries(series, copy=False)
+        series._shared_handle = handle
+        _attached[key] = series
+    return _attached[key]
+
+
+class SharedDataFrame(pd.DataFrame):
+    """
+    DataFrame backed by shared memory-mapped files.
+    It is pickled as a small handle (paths to the files), so a worker process receives the handle instead of a copy
+    of the data and attaches to the files by their names. Slices of the DataFrame are ordinary DataFrames.
+    """
+    _metadata = ['_shared_handle']
+
+    @property
+    def _constructor(self):
+        return pd.DataFrame
+
+    def __reduce_ex__(self, protocol):
+        return _attach_frame, (self._shared_handle,)
+
+
+class SharedSeries(pd.Series):
+    """Series backed by shared memory-mapped files, see `SharedDataFrame`."""
+    _metadata = ['_shared_handle']
+
+    @property
+    def _constructor(self):
+        return pd.Series
+
+    def __reduce_ex__(self, protocol):
+        return _attach_series, (self._shared_handle,)
+
+
+def _original_splitter(cv):
+    return cv
+
+
+class SharedSplits:
+    """
+    Cross-validation splitter which yields the train and test indices published once into a memory-mapped file.
+    Joblib sends slices of memory-mapped arrays to the workers as references to the file.
+
+    It is pickled as the original splitter, so saved search results do not refer to the temporary files.
+    """
+    def __init__(self, cv, handle: dict):
+        self.cv = cv
+        self.handle = handle
+        self.n_splits = len(handle['bounds'])
+
+    def get_n_splits(self, X=None, y=None, groups=None):
+        return self.n_splits
+
+    def split(self, X=None, y=None, groups=None):
+        indices = _attach_array(self.handle)
+        for train_start, test_start, test_end in self.handle['bounds']:
+            yield indices[train_start:test_start], indices[test_start:test_end]
+
+    def __getattr__(self, name):
+        # e.g. get_test_ranges() of MultiTimeSeriesSplit
+        if name in ('cv', 'handle'):
+            raise AttributeError(name)
+        return getattr(self.cv, name)
+
+    def __reduce_ex__(self, protocol):
+        return _original_splitter, (self.cv,)
+
+
+class SharedDataset:
+    """
+    Context manager which publishes a feature matrix, a label vector and the folds of a cross-validation splitter
+    once into memory-mapped files (in RAM backed /dev/shm if it exists), so that worker processes of a grid search
+    attach to the same pages instead of receiving their own pickled copies of the data.
+
+    Non numeric columns (like 'Name') are stored as categorical codes and restored with their original dtype in the workers,
+    a MultiIndex (e.g. date and ticker) level by level.
+    The files are removed on exit.
+
+    Attributes:
+        X (SharedDataFrame): The feature matrix backed by the files.
+        y (SharedSeries): The labels backed by the files.
+        cv (SharedSplits): The splitter yielding the published folds; None if `cv` is not given.
+
+    Usage:
+        with SharedDataset(X_train, y_train, tscv) as shared:
+            GridSearchCV(..., cv=shared.cv).fit(shared.X, shared.y)
+    """
+
+    def __init__(self, X: pd.DataFrame, y: pd.Series, cv=None, folder: str | None = None):
+        self._X = X
+        self._y = y
+        self._cv = cv
+        self.folder = folder
+        self.X = None
+        self.y = None
+        self.cv = None
+
+    def __enter__(self):
+        import tempfile
+        import uuid
+        self.folder = tempfile.mkdtemp(prefix='shared_dataset_', dir=self.folder or _shared_folder())
+        name = uuid.uuid4().hex
+        self.X = _attach_frame(_publish_frame(self.folder, f'X_{name}', self._X))
+
+        y_handle = {
+            'name': f'y_{name}',
+            'values': _publish_array(self.folder, f'y_{name}', self._y.to_numpy()),
+            'series_name': self._y.name,
+        }
+        if self._y.index.equals(self._X.index):
+            y_handle['index'] = self.X._shared_handle['index']
+        else:
+            y_handle['index'] = _publish_index(self.folder, f'y_{name}_index', self._y.index)
+        self.y = _attach_series(y_handle)
+
+        if self._cv is not None:
+            indices, bounds, start = [], [], 0
+            for train, test in self._cv.split(self._X, self._y):
+                indices += [train, test]
+                bounds.append((start, start + len(train), start + len(train) + len(test)))
+                start += len(train) + len(test)
+            folds_handle = _publish_array(self.folder, f'folds_{name}', np.concatenate(indices).astype(np.int64))
+            folds_handle['bounds'] = bounds
+            self.cv = SharedSplits(self._cv, folds_handle)
+        return self
+
+    def __exit__(self, *exc_info):
+        import shutil
+        for key in [key for key, value in _attached.items() if value is self.X or value is self.y]:
+            del _attached[key]
+        # workers may still keep the files mapped, it is fine for POSIX systems; on Windows the files stay in the temporary folder
+        shutil.rmtree(self.folder, ignore_errors=True)
+        return False
+
+
+def reset_peak_rss() -> None:
+    """Reset the peak resident set size of the process (Linux only, ignored elsewhere)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss() -> float:
+    """Return the peak resident set size of the process since the last reset in bytes (the current RSS if it is unknown)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 2**10
+    except OSError:
+        pass
+    import psutil
+    return psutil.Process().memory_info().rss
+
+
+# memory of a node of a sklearn tree: the node struct and the values of 2 classes
+TREE_NODE_BYTES = 64 + 2 * 8
+# copies of the fold's data held during a fit besides the fold itself: the transformed data, float32 copy of the model
+DATA_COPIES = 3
+
+
+def parse_memory(memory: int | float | str) -> int:
+    """
+    Return the number of bytes of a memory size: an int (bytes), a float in (0, 1] (share of the total memory)
+    or a string with a unit, e.g. '512M', '16G'.
+    """
+    if isinstance(memory, str):
+        units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+        memory = memory.strip().upper().rstrip('B')
+        return int(float(memory[:-1]) * units[memory[-1]]) if memory[-1] in units else int(memory)
+    if isinstance(memory, float) and 0 < memory <= 1:
+        import psutil
+        return int(psutil.virtual_memory().total * memory)
+    return int(memory)
+
+
+def estimate_fit_memory(pipeline, X) -> int:
+    """
+    Estimate the peak memory (bytes) of fitting the pipeline on X above the memory of the process before the fit:
+    DATA_COPIES copies of the data (as float64) plus the trees of a forest or of gradient boosting.
+    The trees are estimated by their maximal number of nodes, limited by the depth and by the number of rows
+    (a leaf has at least `min_samples_leaf` rows), the train length of WrapModelTrainSizeParam limits the rows.
+    """
+    n_rows, n_features = np.shape(X)[0], np.shape(X)[1]
+    memory = DATA_COPIES * n_rows * n_features * 8
+    model = pipeline.steps[-1][1] if isinstance(pipeline, Pipeline) else pipeline
+    if getattr(model, 'train_length', None) is not None:
+        n_rows = min(n_rows, model.train_length)
+    model = getattr(model, 'model_instance', model)
+    params = model.get_params() if hasattr(model, 'get_params') else {}
+    name = model.__class__.__name__
+
+    if name in ('RandomForestClassifier', 'ExtraTreesClassifier', 'GradientBoostingClassifier'):
+        n_samples = n_rows
+        max_samples = params.get('max_samples')
+        if max_samples is not None:
+            n_samples = max_samples if isinstance(max_samples, int) else int(max_samples * n_rows)
+        if params.get('bootstrap', False):
+            # the share of distinct rows in a bootstrap sample
+            n_samples = int(n_samples * (1 - np.exp(-1)))
+        min_samples_leaf = params.get('min_samples_leaf', 1)
+        if isinstance(min_samples_leaf, float):
+            min_samples_leaf = max(1, int(min_samples_leaf * n_samples))
+        n_leaves = max(1, n_samples // min_samples_leaf)
+        if params.get('max_depth') is not None:
+            n_leaves = min(n_leaves, 2 ** params['max_depth'])
+        if params.get('max_leaf_nodes') is not None:
+            n_leaves = min(n_leaves, params['max_leaf_nodes'])
+        memory += params.get('n_estimators', 100) * (2 * n_leaves - 1) * TREE_NODE_BYTES
+        # the buffers of the trees being built, one per thread
+        memory += (params.get('n_jobs') or 1) * n_rows * 32
+    elif name == 'HistGradientBoostingClassifier':
+        # binned data and the histograms
+        memory += n_rows * n_features + params.get('max_iter', 100) * params.get('max_leaf_nodes', 31) * n_features * 256 * 20
+    return int(memory)
+
+
+class MemoryAdmission:
+    """
+    Admission control of fits by a memory budget shared by all the processes of a search (the loky workers and
+    the parent): a fit waits until the sum of the estimated memory of the running fits and of its own estimation
+    fits into the budget. A fit is always admitted if no other fit is running, even if its estimation exceeds the budget.
+
+    The reservations are kept in a ledger file guarded by a file lock (fcntl, POSIX only), so the object is pickled
+    as the path to the folder and works in any process on the same machine. Each fit appends its estimated and actual
+    peak memory to a records file, see `records` and `calibration_factor`.
+
+    Parameters
+    ----------
+    budget : int, float or str
+        The memory budget, see `parse_memory`.
+    folder : str
+        The folder of the ledger and the records files, it must exist.
+    calibration : float, default=1.0
+        The multiplier of the estimations, e.g. `calibration_factor()` of a previous run.
+    poll_interval : float, default=0.2
+        The interval (seconds) of checking whether a waiting fit can be admitted.
+    """
+    LEDGER_FILE = 'ledger'
+    LOCK_FILE = 'ledger.lock'
+    RECORDS_FILE = 'records.jsonl'
+
+    def __init__(self, budget, folder: str, calibration: float = 1.0, poll_interval: float = 0.2):
+        self.budget = parse_memory(budget)
+        self.folder = folder
+        self.calibration = calibration
+        self.poll_interval = poll_interval
+
+    def _locked(self):
+        import contextlib
+        import fcntl
+
+        @contextlib.contextmanager
+        def lock():
+            with open(os.path.join(self.folder, self.LOCK_FILE), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        return lock()
+
+    def _update_ledger(self, change: int) -> int:
+        path = os.path.join(self.folder, self.LEDGER_FILE)
+        used = int(open(path).read() or 0) if os.path.exists(path) else 0
+        used = max(0, used + change)
+        with open(path, 'w') as f:
+            f.write(str(used))
+        return used
+
+    def acquire(self, memory: int) -> float:
+        """Wait until `memory` bytes can be reserved in the budget, reserve them and return the waiting time."""
+        start_time = time.perf_counter()
+        while True:
+            with self._locked():
+                used = self._update_ledger(0)
+                if used == 0 or used + memory <= self.budget:
+                    self._update_ledger(memory)
+                    return time.perf_counter() - start_time
+            time.sleep(self.poll_interval)
+
+    def release(self, memory: int) -> None:
+        with self._locked():
+            self._update_ledger(-memory)
+
+    def record(self, record: dict) -> None:
+        import json
+        with self._locked():
+            with open(os.path.join(self.folder, self.RECORDS_FILE), 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def records(self) -> pd.DataFrame:
+        """Return the records of the admitted fits: estimated and actual peak memory (MB), the waiting time, the data shape."""
+        path = os.path.join(self.folder, self.RECORDS_FILE)
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        return pd.read_json(path, lines=True)
+
+    def calibration_factor(self, quantile: float = 0.9) -> float:
+        """
+        Return the quantile of the ratios of the actual peak memory to the (uncalibrated) estimation of the recorded fits.
+        Fits whose actual peak is 0 (they reused memory freed by the previous fits of the process) are ignored.
+        """
+        records = self.records()
+        if not records.empty:
+            records = records[records['actual_mb'] > 0]
+        if records.empty:
+            return self.calibration
+        return float((records['actual_mb'] / (records['estimated_mb'] / self.calibration)).quantile(quantile))
+
+
+class MemoryAdmissionMixin:
+    """
+    Mixin of a pipeline which reserves the estimated memory of its fit in `admission` (a MemoryAdmission)
+    before the fit, releases it after the fit and records the estimated and actual peak memory of the fit.
+    """
+    def __init__(self, steps, *, memory=None, verbose=False, admission=None):
+        super().__init__(steps, memory=memory, verbose=verbose)
+        self.admission = admission
+
+    def fit(self, X, y=None, **params):
+        if self.admission is None:
+            return super().fit(X, y, **params)
+        estimated = int(estimate_fit_memory(self, X) * self.admission.calibration)
+        waiting_time = self.admission.acquire(estimated)
+        try:
+            reset_peak_rss()
+            rss_before = peak_rss()
+            start_time = time.perf_counter()
+            super().fit(X, y, **params)
+            fit_time = time.perf_counter() - start_time
+            actual = max(0, peak_rss() - rss_before)
+        finally:
+            self.admission.release(estimated)
+        model = self.steps[-1][1]
+        self.admission.record({'pid': os.getpid(), 'model': getattr(model, 'model_instance', model).__class__.__name__,
+                               'n_rows': int(np.shape(X)[0]), 'n_features': int(np.shape(X)[1]),
+                               'estimated_mb': estimated / 2**20, 'actual_mb': actual / 2**20,
+                               'waiting_time': waiting_time, 'fit_time': fit_time})
+        return self
+
+
+class AdmittedPipeline(MemoryAdmissionMixin, Pipeline):
+    """Pipeline whose fits are admitted by a memory budget, see MemoryAdmissionMixin."""
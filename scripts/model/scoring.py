@@ -0,0 +1,251 @@
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+
+
+SCORES = ['accuracy', 'average_precision', 'f1', 'roc_auc', 'log_loss']
+CONFUSION_MATRIX_CELLS = ['tn', 'fp', 'fn', 'tp']
+
+# estimators whose `predict` is not derived from `predict_proba` (e.g. SVC uses Platt scaling for probabilities),
+# the labels for them are obtained by calling `predict`
+PREDICT_NOT_FROM_PROBA = {'SVC', 'NuSVC'}
+
+
+def _final_estimator(clf):
+    """Return the last step of a pipeline, unwrapping WrapModelTrainSizeParam and threshold classifiers."""
+    while True:
+        if isinstance(clf, Pipeline):
+            clf = clf.steps[-1][1]
+        elif getattr(clf, 'model_instance', None) is not None:  # WrapModelTrainSizeParam
+            clf = clf.model_instance
+        elif hasattr(clf, 'estimator_'):  # FixedThresholdClassifier, TunedThresholdClassifierCV
+            clf = clf.estimator_
+        else:
+            return clf
+
+
+def decision_threshold(clf) -> float | None:
+    """Return the decision threshold of a FixedThresholdClassifier or TunedThresholdClassifierCV, None for other classifiers."""
+    if hasattr(clf, 'best_threshold_'):
+        return clf.best_threshold_
+    threshold = getattr(clf, 'threshold', None)
+    if threshold is None or threshold == 'auto':
+        return None
+    return threshold
+
+
+def predict_scores(clf, X) -> tuple[np.ndarray, str]:
+    """
+    Run inference once and return the score of the positive class and the response method used:
+    probabilities of `predict_proba` if it is available, `decision_function` values otherwise.
+    """
+    if hasattr(clf, 'predict_proba'):
+        y_score = clf.predict_proba(X)[:, 1]
+        if not np.isnan(y_score).any():
+            return y_score, 'predict_proba'
+    if hasattr(clf, 'decision_function'):
+        return clf.decision_function(X), 'decision_function'
+    raise AttributeError(f'{clf.__class__.__name__} has neither predict_proba nor decision_function')
+
+
+def labels_from_scores(clf, y_score: np.ndarray, response_method: str = 'predict_proba') -> np.ndarray:
+    """
+    Derive predicted labels from the scores of the positive class the same way as `clf.predict` does:
+    with the threshold of threshold classifiers, the largest probability (> 0.5) or the positive decision function otherwise.
+    """
+    classes = clf.classes_
+    threshold = decision_threshold(clf)
+    if threshold is not None:
+        return classes[(y_score >= threshold).astype(int)]
+    if response_method == 'predict_proba':
+        # argmax of [1-p, p] picks the negative class on ties
+        return classes[(y_score > 0.5).astype(int)]
+    return classes[(y_score > 0).astype(int)]
+
+
+def predict_once(clf, X) -> tuple[np.ndarray, np.ndarray, str]:
+    """
+    Return the scores of the positive class, the predicted labels and the response method,
+    running inference once if the labels can be derived from the scores.
+    """
+    y_score, response_method = predict_scores(clf, X)
+    if _final_estimator(clf).__class__.__name__ in PREDICT_NOT_FROM_PROBA and decision_threshold(clf) is None:
+        y_pred = clf.predict(X)
+    else:
+        y_pred = labels_from_scores(clf, y_score, response_method)
+    return y_score, y_pred, response_method
+
+
+def _binary_curve(y_true: np.ndarray, y_score: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Cumulative numbers of true and false positives for each distinct threshold (descending), like sklearn's _binary_clf_curve."""
+    order = np.argsort(y_score, kind='mergesort')[::-1]
+    y_score = y_score[order]
+    y_true = y_true[order]
+    threshold_idxs = np.r_[np.flatnonzero(np.diff(y_score)), y_true.size - 1]
+    tps = np.cumsum(y_true)[threshold_idxs]
+    fps = 1 + threshold_idxs - tps
+    return tps, fps
+
+
+def scores_from_predictions(y_true, y_score, y_pred, positive_label=1,
+                            scores: list[str] = SCORES,
+                            confusion_matrix_cells: list[str] = CONFUSION_MATRIX_CELLS,
+                            response_method: str = 'predict_proba') -> dict:
+    """
+    Calculate all the scores and confusion matrix cells of a binary classification from already computed
+    scores of the positive class and predicted labels.
+
+    Ranking scores (roc_auc, average_precision) share one sorting of the scores, accuracy and f1 are derived from
+    the confusion matrix. log_loss is calculated only if `y_score` are probabilities.
+    Scores which are not defined (e.g. roc_auc when `y_true` contains one class) are NaN.
+
+    Args:
+        y_true (array-like): True labels.
+        y_score (array-like): Probabilities (or decision function values) of the positive class.
+        y_pred (array-like): Predicted labels.
+        positive_label: The label of the positive class. Defaults to 1.
+        scores (list of str): Names of the scores, subset of SCORES.
+        confusion_matrix_cells (list of str): Names of the confusion matrix cells, subset of CONFUSION_MATRIX_CELLS.
+        response_method (str): 'predict_proba' or 'decision_function', the method `y_score` were obtained with.
+
+    Returns:
+        dict: {score name: value} for all `scores` and `confusion_matrix_cells`.
+    """
+    y_true = (np.asarray(y_true) == positive_label).astype(np.int64)
+    y_pred = (np.asarray(y_pred) == positive_label).astype(np.int64)
+    y_score = np.asarray(y_score, dtype=np.float64)
+
+    tn, fp, fn, tp = np.bincount(2 * y_true + y_pred, minlength=4)
+    cells = {'tn': tn, 'fp': fp, 'fn': fn, 'tp': tp}
+    res = {}
+    if 'accuracy' in scores:
+        res['accuracy'] = (tp + tn) / y_true.size
+    if 'f1' in scores:
+        res['f1'] = 2 * tp / (2 * tp + fp + fn) if tp + fp + fn > 0 else 0.0
+
+    if 'roc_auc' in scores or 'average_precision' in scores:
+        if 0 < y_true.sum() < y_true.size:
+            tps, fps = _binary_curve(y_true, y_score)
+            if 'roc_auc' in scores:
+                tpr = np.r_[0, tps] / tps[-1]
+                fpr = np.r_[0, fps] / fps[-1]
+                res['roc_auc'] = np.trapezoid(tpr, fpr)
+            if 'average_precision' in scores:
+                precision = tps / (tps + fps)
+                recall = tps / tps[-1]
+                res['average_precision'] = np.sum(np.diff(np.r_[0, recall]) * precision)
+        else:
+            res['roc_auc'] = np.nan
+            res['average_precision'] = np.nan
+    if 'log_loss' in scores:
+        if response_method == 'predict_proba':
+            eps = np.finfo(y_score.dtype).eps
+            y_prob = np.clip(y_score, eps, 1 - eps)
+            res['log_loss'] = -np.mean(y_true * np.log(y_prob) + (1 - y_true) * np.log(1 - y_prob))
+        else:
+            res['log_loss'] = np.nan
+
+    res.update({cell: cells[cell] for cell in confusion_matrix_cells})
+    return {name: res[name] for name in [*scores, *confusion_matrix_cells]}
+
+
+class MultiMetricScorer:
+    """
+    Scorer for GridSearchCV which runs inference once per (candidate, fold, set) and derives all the scores
+    and the confusion matrix cells from the cached probabilities.
+
+    The predicted labels are obtained from the probabilities the same way the classifier's `predict` does it,
+    so a pipeline transforms the data and the estimator predicts only once instead of once per metric.
+
+    Parameters
+    ----------
+    scores : list of str, default=SCORES
+        Names of the scores to calculate.
+    confusion_matrix_cells : list of str, default=CONFUSION_MATRIX_CELLS
+        Names of the confusion matrix cells to return.
+
+    Usage
+    -----
+    >>> scorer = MultiMetricScorer()
+    >>> GridSearchCV(pipeline, param_grid, scoring=scorer, refit='roc_auc')
+    """
+    def __init__(self, scores: list[str] = SCORES, confusion_matrix_cells: list[str] = CONFUSION_MATRIX_CELLS):
+        self.scores = scores
+        self.confusion_matrix_cells = confusion_matrix_cells
+
+    def __call__(self, clf, X, y) -> dict:
+        y_score, y_pred, response_method = predict_once(clf, X)
+        return scores_from_predictions(y, y_score, y_pred, positive_label=clf.classes_[-1],
+                                       scores=self.scores, confusion_matrix_cells=self.confusion_matrix_cells,
+                                       response_method=response_method)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(scores={self.scores}, confusion_matrix_cells={self.confusion_matrix_cells})'
+
+
+THRESHOLD_SCORES = ['accuracy', 'balanced_accuracy', 'f1', 'precision', 'recall']
+
+
+def threshold_sweep(y_true, y_score, returns=None, positive_label=1) -> pd.DataFrame:
+    """
+    Evaluate every decision threshold of already computed (e.g. out-of-fold) scores of the positive class
+    without refitting the model: the scores are sorted once and the confusion matrix of each threshold is derived
+    from cumulative sums, so the sweep takes O(n log n) in total.
+
+    A threshold predicts the positive class for the scores >= the threshold (as FixedThresholdClassifier does),
+    the candidates are the distinct scores and +inf (nothing is predicted positive).
+
+    Args:
+        y_true (array-like): True labels.
+        y_score (array-like): Probabilities (or decision function values) of the positive class.
+        returns (array-like, optional): Returns of the rows; if given, 'pnl' is the sum of the returns of the rows
+            predicted positive (an investment of $1 per positive signal) and 'mean_return' is its mean per signal.
+        positive_label: The label of the positive class. Defaults to 1.
+
+    Returns:
+        pd.DataFrame: the confusion matrix cells (CONFUSION_MATRIX_CELLS), THRESHOLD_SCORES and the PnL
+        for each threshold, indexed by the thresholds in descending order.
+    """
+    y_true = (np.asarray(y_true) == positive_label).astype(np.int64)
+    y_score = np.asarray(y_score, dtype=np.float64)
+    order = np.argsort(y_score, kind='mergesort')[::-1]
+    threshold_idxs = np.r_[np.flatnonzero(np.diff(y_score[order])), y_true.size - 1]
+    tps = np.r_[0, np.cumsum(y_true[order])[threshold_idxs]]
+    fps = np.r_[0, 1 + threshold_idxs - tps[1:]]
+    n_positives, n_negatives = y_true.sum(), y_true.size - y_true.sum()
+
+    tp, fp = tps, fps
+    fn, tn = n_positives - tp, n_negatives - fp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recall = tp / n_positives
+        res = {
+            'tn': tn, 'fp': fp, 'fn': fn, 'tp': tp,
+            'accuracy': (tp + tn) / y_true.size,
+            'balanced_accuracy': (recall + tn / n_negatives) / 2,
+            'f1': np.where(tp + fp + fn > 0, 2 * tp / (2 * tp + fp + fn), 0.0),
+            'precision': np.where(tp + fp > 0, tp / (tp + fp), 0.0),
+            'recall': recall,
+        }
+        if returns is not None:
+            returns = np.asarray(returns, dtype=np.float64)
+            res['pnl'] = np.r_[0, np.cumsum(returns[order])[threshold_idxs]]
+            res['mean_return'] = np.where(tp + fp > 0, res['pnl'] / (tp + fp), np.nan)
+    thresholds = np.r_[np.inf, y_score[order][threshold_idxs]]
+    return pd.DataFrame(res, index=pd.Index(thresholds, name='threshold'))
+
+
+def best_threshold(y_true, y_score, score='balanced_accuracy', returns=None, positive_label=1) -> tuple[float, float]:
+    """
+    Return the decision threshold maximising `score` (one of THRESHOLD_SCORES, 'pnl' or 'mean_return' if `returns`
+    are given) of already computed scores, see `threshold_sweep`, and the score at it.
+    Of thresholds with the same score the largest one is chosen.
+
+    Usage
+    -----
+    >>> predictions = predictions_on_splits(model, cv, X, y)
+    >>> threshold, _ = best_threshold(predictions['y_true'], predictions['predicted_probabilities'][0])
+    >>> FixedThresholdClassifier(model, threshold=threshold)
+    """
+    sweep = threshold_sweep(y_true, y_score, returns=returns, positive_label=positive_label)
+    idx = np.nanargmax(sweep[score].to_numpy())
+    return float(sweep.index[idx]), float(sweep[score].iloc[idx])
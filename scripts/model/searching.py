@@ -0,0 +1,871 @@
+import math
+import time
+from traceback import format_exc
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.base import clone, is_classifier
+from sklearn.model_selection import GridSearchCV, ParameterGrid, check_cv
+from sklearn.model_selection._search import BaseSearchCV
+from sklearn.model_selection._validation import _insert_error_scores, _score, _warn_or_raise_about_fit_failures
+from sklearn.pipeline import Pipeline
+from sklearn.utils import _safe_indexing, indexable
+
+from consts import format
+from input_output_plot.printing import output_formatting as paint
+
+
+RESOURCE_TICKERS = 'tickers'
+# the smallest number of companies used by default, the size of the subset the early stages were run on by hand
+MIN_TICKERS = 40
+
+
+class TickerSubsetSplit:
+    """
+    Cross-validation splitter which restricts the folds of another splitter to the rows of the given tickers
+    (both train and test folds), so the folds keep their dates, but contain fewer companies.
+
+    Parameters
+    ----------
+    cv : cross-validation splitter
+        The splitter whose folds are restricted, e.g. MultiTimeSeriesSplit.
+    names : array-like
+        Ticker's name of each row of the data set which is split.
+    tickers : array-like
+        Tickers to keep.
+    """
+    def __init__(self, cv, names, tickers):
+        self.cv = cv
+        self.names = np.asarray(names)
+        self.tickers = tickers
+
+    def get_n_splits(self, X=None, y=None, groups=None):
+        return self.cv.get_n_splits(X, y, groups)
+
+    def split(self, X, y=None, groups=None):
+        mask = np.isin(self.names, self.tickers)
+        for train, test in self.cv.split(X, y, groups):
+            yield train[mask[train]], test[mask[test]]
+
+
+class TimeSeriesHalvingSearchCV(BaseSearchCV):
+    """
+    Successive halving search over a parameters grid for time series folds of several companies.
+
+    All candidates are evaluated with a small amount of the resource, only the best `1/factor` of them are evaluated
+    at the next iteration with `factor` times more resource, and so on until the last iteration, which uses
+    the whole resource. The best candidate is chosen among the candidates of the last iteration.
+
+    The resource is either
+    - 'tickers': the number of companies in the folds of `cv` (the folds keep their dates, see TickerSubsetSplit),
+      the companies of each iteration include the companies of the previous one;
+    - a parameter of the estimator, e.g. 'train_length' (the train size of WrapModelTrainSizeParam); a short name is
+      resolved to the parameter of the grid with this suffix, its values in the grid define the maximum resource.
+
+    Parameters
+    ----------
+    estimator : estimator object
+        The pipeline to search the parameters for.
+    param_grid : dict or list of dicts
+        The parameters grid, as for GridSearchCV.
+    resource : str, default='tickers'
+        The resource, see above.
+    factor : int, default=3
+        The proportion of candidates selected for the next iteration and the multiplier of the resource.
+    min_resources : int, optional
+        The resource of the first iteration. By default it is chosen so that the last iteration evaluates
+        about `factor` candidates with the whole resource, but not less than MIN_TICKERS companies.
+    max_resources : int, optional
+        The resource of the last iteration. By default all the companies, or the maximal value of the parameter in the grid.
+    random_state : int, optional
+        Seed of the random order in which the companies are added (the order of TickerSampler).
+    scoring, refit, cv, n_jobs, verbose, pre_dispatch, error_score, return_train_score :
+        As for GridSearchCV. The candidates are ranked by the `refit` score.
+
+    Attributes
+    ----------
+    halving_schedule_ : pd.DataFrame
+        For each iteration: the resource, the number of candidates, the wall time and the fit time (sum for all folds).
+    time_saved_ : dict
+        The estimated fit time of the exhaustive grid search with the whole resource, the fit time actually spent
+        and their difference (in seconds).
+    cv_results_, best_index_, best_params_, best_score_, best_estimator_ :
+        As for GridSearchCV; cv_results_ has the additional keys 'iter' and 'n_resources'.
+    """
+    def __init__(self, estimator, param_grid, *, resource=RESOURCE_TICKERS, factor=3, min_resources=None, max_resources=None,
+                 random_state=None, scoring=None, n_jobs=None, refit=True, cv=None, verbose=0, pre_dispatch='2*n_jobs',
+                 error_score=np.nan, return_train_score=True):
+        super().__init__(estimator=estimator, scoring=scoring, n_jobs=n_jobs, refit=refit, cv=cv, verbose=verbose,
+                         pre_dispatch=pre_dispatch, error_score=error_score, return_train_score=return_train_score)
+        self.param_grid = param_grid
+        self.resource = resource
+        self.factor = factor
+        self.min_resources = min_resources
+        self.max_resources = max_resources
+        self.random_state = random_state
+
+    def fit(self, X, y=None, **params):
+        self._checked_cv_orig = check_cv(self.cv, y, classifier=is_classifier(self.estimator))
+        if self.resource == RESOURCE_TICKERS:
+            self._names = np.asarray(X['Name'])
+        try:
+            return super().fit(X, y, **params)
+        finally:
+            self._names = None
+
+    def _resource_param(self, candidates):
+        """Return the name of the estimator's parameter used as the resource."""
+        names = {name for candidate in candidates for name in candidate}
+        if self.resource in names:
+            return self.resource
+        matches = [name for name in names if name.endswith(f'__{self.resource}')]
+        if len(matches) != 1:
+            raise ValueError(f'resource {self.resource!r} must be {RESOURCE_TICKERS!r} or a parameter of the grid, found: {matches}')
+        return matches[0]
+
+    def _schedule(self, n_candidates, max_resources):
+        """Return the resources of the iterations."""
+        n_required = math.ceil(math.log(n_candidates, self.factor)) if n_candidates > 1 else 0
+        min_resources = self.min_resources
+        if min_resources is None:
+            min_resources = max(1, max_resources // self.factor ** n_required)
+            if self.resource == RESOURCE_TICKERS:
+                min_resources = min(max_resources, max(MIN_TICKERS, min_resources))
+        n_possible = int(math.log(max_resources / min_resources, self.factor)) if max_resources > min_resources else 0
+        n_iterations = min(n_required, n_possible) + 1
+        resources = [min(max_resources, min_resources * self.factor ** i) for i in range(n_iterations)]
+        resources[-1] = max_resources
+        return resources
+
+    def _run_search(self, evaluate_candidates):
+        refit_metric = self.refit if isinstance(self.refit, str) else 'score'
+        candidates = list(ParameterGrid(self.param_grid))
+
+        if self.resource == RESOURCE_TICKERS:
+            from model.model_selection import TickerSampler
+            tickers = TickerSampler(random_state=self.random_state).fit(pd.DataFrame({'Name': self._names})).tickers_order_
+            max_resources = self.max_resources or len(tickers)
+        else:
+            resource_param = self._resource_param(candidates)
+            max_resources = self.max_resources or max(candidate[resource_param] for candidate in candidates)
+            # the resource is not a searched parameter anymore
+            unique_candidates = []
+            for candidate in candidates:
+                candidate = {k: v for k, v in candidate.items() if k != resource_param}
+                if candidate not in unique_candidates:
+                    unique_candidates.append(candidate)
+            candidates = unique_candidates
+        resources = self._schedule(len(candidates), max_resources)
+
+        schedule = []
+        for iteration, n_resources in enumerate(resources):
+            if self.resource == RESOURCE_TICKERS:
+                cv = TickerSubsetSplit(self._checked_cv_orig, self._names, tickers[:n_resources])
+                candidate_params = candidates
+            else:
+                cv = None
+                candidate_params = [{**candidate, resource_param: n_resources} for candidate in candidates]
+            n_candidates = len(candidate_params)
+
+            start_time = time.perf_counter()
+            results = evaluate_candidates(candidate_params, cv,
+                                          more_results={'iter': [iteration] * n_candidates, 'n_resources': [n_resources] * n_candidates})
+            iteration_fit_time = (results['mean_fit_time'][-n_candidates:] + results['mean_score_time'][-n_candidates:]).sum() \
+                * self._checked_cv_orig.get_n_splits()
+            schedule.append({'iter': iteration, 'n_resources': n_resources, 'n_candidates': n_candidates,
+                             'wall_time': time.perf_counter() - start_time, 'fit_time': iteration_fit_time})
+
+            if iteration == len(resources) - 1:
+                break
+            test_scores = np.nan_to_num(results[f'mean_test_{refit_metric}'][-n_candidates:], nan=-np.inf)
+            n_to_keep = math.ceil(n_candidates / self.factor)
+            best = np.argsort(-test_scores, kind='stable')[:n_to_keep]
+            candidates = [candidates[i] for i in best]
+
+        self.halving_schedule_ = pd.DataFrame(schedule).set_index('iter')
+        # the exhaustive search would evaluate all the initial candidates with the whole resource,
+        # the fit time of a candidate is estimated by the mean time of the last iteration's candidates
+        last = schedule[-1]
+        exhaustive_time = last['fit_time'] / last['n_candidates'] * schedule[0]['n_candidates']
+        spent_time = self.halving_schedule_['fit_time'].sum()
+        self.time_saved_ = {'exhaustive_fit_time': exhaustive_time, 'fit_time': spent_time, 'time_saved': exhaustive_time - spent_time}
+
+    @staticmethod
+    def _select_best_index(refit, refit_metric, results):
+        """Choose the best candidate among the candidates of the last iteration."""
+        if callable(refit):
+            return BaseSearchCV._select_best_index(refit, refit_metric, results)
+        last_iter_indices = np.flatnonzero(results['iter'] == np.max(results['iter']))
+        test_scores = results[f'mean_test_{refit_metric}'][last_iter_indices]
+        if np.isnan(test_scores).all():
+            return last_iter_indices[0]
+        return last_iter_indices[np.nanargmax(test_scores)]
+
+
+def print_halving_schedule(search) -> None:
+    """Print the elimination schedule of a successive halving search and the time it saved."""
+    print(paint('Halving schedule:', format))
+    print(search.halving_schedule_)
+    print(f"Fit time: {search.time_saved_['fit_time']/60:.2f} min, "
+          f"estimated for the exhaustive search: {search.time_saved_['exhaustive_fit_time']/60:.2f} min, "
+          f"saved: {paint(f'{search.time_saved_['time_saved']/60:.2f}', format)} min")
+
+
+class FoldGroupSearchCV(BaseSearchCV):
+    """
+    Base class of the searches which evaluate a group of candidates together on each fold instead of fitting
+    every candidate separately (e.g. the candidates which differ only in the number of trees share one fit).
+
+    Subclasses define
+    - `_group_candidates(candidates)`: the list of groups, each group is a list of indices of `candidates`;
+    - `_evaluate_group(estimator, X, y, train, test, candidates, scorers, fit_params)`: fits and scores the candidates
+      of a group on a fold and returns the result of each candidate as a dict with the keys 'fit_time', 'score_time',
+      'test_scores', 'train_scores' (if `return_train_score`), 'n_test_samples' and 'fit_error'.
+
+    The (group, fold) tasks run in parallel, the results are collected into a standard `cv_results_`,
+    the best candidate is chosen and refitted the same way as in GridSearchCV.
+
+    Attributes
+    ----------
+    n_fits_ : int
+        The number of (group, fold) tasks, GridSearchCV would run `n_candidates * n_splits` fits.
+    """
+    def __init__(self, estimator, param_grid, *, scoring=None, n_jobs=None, refit=True, cv=None, verbose=0,
+                 pre_dispatch='2*n_jobs', error_score=np.nan, return_train_score=True):
+        super().__init__(estimator=estimator, scoring=scoring, n_jobs=n_jobs, refit=refit, cv=cv, verbose=verbose,
+                         pre_dispatch=pre_dispatch, error_score=error_score, return_train_score=return_train_score)
+        self.param_grid = param_grid
+
+    def _group_candidates(self, candidates: list[dict]) -> list[list[int]]:
+        raise NotImplementedError
+
+    def _evaluate_group(self, estimator, X, y, train, test, candidates, scorers, fit_params) -> list[dict]:
+        raise NotImplementedError
+
+    def _refit(self, estimator, X, y, fit_params) -> None:
+        """Fit the best candidate on the whole train set."""
+        estimator.fit(X, y, **fit_params)
+
+    def _fit_failed(self, candidates, fit_time=0.0) -> list[dict]:
+        """Return the results of the candidates whose fit raised an error (the error is being handled)."""
+        if self.error_score == 'raise':
+            raise
+        fit_error = format_exc()
+        res = {'fit_time': fit_time, 'score_time': 0.0, 'test_scores': self.error_score, 'n_test_samples': 0, 'fit_error': fit_error}
+        if self.return_train_score:
+            res['train_scores'] = self.error_score
+        return [dict(res) for _ in candidates]
+
+    def _score_fitted(self, estimator, X_test, y_test, X_train, y_train, scorers) -> dict:
+        """Score a fitted estimator on the test (and train) part of a fold."""
+        start_time = time.perf_counter()
+        res = {'test_scores': _score(estimator, X_test, y_test, scorers, None, self.error_score)}
+        if self.return_train_score:
+            res['train_scores'] = _score(estimator, X_train, y_train, scorers, None, self.error_score)
+        res.update(score_time=time.perf_counter() - start_time, n_test_samples=len(X_test), fit_error=None)
+        return res
+
+    def fit(self, X, y=None, **params):
+        scorers, refit_metric = self._get_scorers()
+        X, y = indexable(X, y)
+        cv = check_cv(self.cv, y, classifier=is_classifier(self.estimator))
+        splits = list(cv.split(X, y))
+        n_splits = len(splits)
+        base_estimator = clone(self.estimator)
+
+        candidates = list(ParameterGrid(self.param_grid))
+        groups = self._group_candidates(candidates)
+        self.n_fits_ = len(groups) * n_splits
+        if self.verbose > 0:
+            print(f'Fitting {n_splits} folds for each of {len(groups)} groups of {len(candidates)} candidates, '
+                  f'totalling {self.n_fits_} fits')
+
+        parallel = Parallel(n_jobs=self.n_jobs, pre_dispatch=self.pre_dispatch, verbose=self.verbose)
+        group_outs = parallel(
+            delayed(self._evaluate_group)(clone(base_estimator), X, y, train, test,
+                                          [candidates[i] for i in group], scorers, params)
+            for group in groups for train, test in splits)
+
+        # candidate-major order expected by `_format_results`
+        out = [None] * (len(candidates) * n_splits)
+        for task, group_out in enumerate(group_outs):
+            group, split = groups[task // n_splits], task % n_splits
+            for candidate, res in zip(group, group_out):
+                out[candidate * n_splits + split] = res
+        _warn_or_raise_about_fit_failures(out, self.error_score)
+        if callable(self.scoring):
+            _insert_error_scores(out, self.error_score)
+        results = self._format_results(candidates, n_splits, out)
+
+        self.multimetric_ = isinstance(out[0]['test_scores'], dict)
+        if callable(self.scoring) and self.multimetric_:
+            self._check_refit_for_multimetric(out[0]['test_scores'])
+            refit_metric = self.refit
+
+        if self.refit or not self.multimetric_:
+            self.best_index_ = self._select_best_index(self.refit, refit_metric, results)
+            if not callable(self.refit):
+                self.best_score_ = results[f'mean_test_{refit_metric}'][self.best_index_]
+            self.best_params_ = results['params'][self.best_index_]
+
+        if self.refit:
+            self.best_estimator_ = clone(base_estimator).set_params(**clone(self.best_params_, safe=False))
+            refit_start_time = time.time()
+            self._refit(self.best_estimator_, X, y, params)
+            self.refit_time_ = time.time() - refit_start_time
+            if hasattr(self.best_estimator_, 'feature_names_in_'):
+                self.feature_names_in_ = self.best_estimator_.feature_names_in_
+
+        self.scorer_ = getattr(scorers, '_scorers', scorers)
+        self.cv_results_ = results
+        self.n_splits_ = n_splits
+        return self
+
+    def _run_search(self, evaluate_candidates):
+        # `fit` evaluates the candidates itself
+        raise NotImplementedError
+
+
+# parameters whose smaller values give a prefix of the stages of the model fitted with the largest value (for the same
+# random_state): {estimator class name: (parameter, attribute with the fitted stages, attribute with their number)}
+ADDITIVE_PARAMS = {
+    'RandomForestClassifier': ('n_estimators', 'estimators_', None),
+    'ExtraTreesClassifier': ('n_estimators', 'estimators_', None),
+    'GradientBoostingClassifier': ('n_estimators', 'estimators_', 'n_estimators_'),
+    'HistGradientBoostingClassifier': ('max_iter', '_predictors', None),
+}
+
+
+def _model_param(estimator, param_names, model_params: dict) -> str | None:
+    """
+    Return the name (as in the parameters grid) of the parameter `model_params[model class name]` of a model
+    of the estimator if it is among `param_names`, None otherwise.
+    """
+    estimator_params = estimator.get_params()
+    for name in param_names:
+        owner_name, _, param = name.rpartition('__')
+        owner = estimator_params.get(owner_name) if owner_name else estimator
+        owner = getattr(owner, 'model_instance', owner)  # WrapModelTrainSizeParam
+        if model_params.get(owner.__class__.__name__) == param:
+            return name
+    return None
+
+
+def additive_param(estimator, param_names) -> str | None:
+    """
+    Return the name (as in the parameters grid) of the additive parameter of the estimator (n_estimators of forests
+    and gradient boosting, max_iter of HistGradientBoosting) if it is among `param_names`, None otherwise.
+    """
+    return _model_param(estimator, param_names, {model: param for model, (param, *_) in ADDITIVE_PARAMS.items()})
+
+
+def group_candidates_by(candidates: list[dict], param: str | None) -> list[list[int]]:
+    """Group the indices of the candidates which differ only in the value of `param`."""
+    if param is None:
+        return [[i] for i in range(len(candidates))]
+    # parameters values may be unhashable
+    keys, groups = [], []
+    for i, candidate in enumerate(candidates):
+        key = {k: v for k, v in candidate.items() if k != param}
+        if key in keys:
+            groups[keys.index(key)].append(i)
+        else:
+            keys.append(key)
+            groups.append([i])
+    return groups
+
+
+def _ensemble(estimator):
+    """Return the model of the last step of a pipeline, unwrapping WrapModelTrainSizeParam."""
+    if isinstance(estimator, Pipeline):
+        estimator = estimator.steps[-1][1]
+    return getattr(estimator, 'model_instance', estimator)
+
+
+class PrefixEnsembleSearchCV(FoldGroupSearchCV):
+    """
+    Grid search which fits an ensemble with the largest number of trees (boosting iterations) of the grid once per fold
+    and scores the smaller numbers on the prefixes of its stages, instead of refitting the ensemble for every value.
+
+    The additive parameter (n_estimators of RandomForest, ExtraTrees, GradientBoosting, max_iter of
+    HistGradientBoosting) is detected in the grid, see ADDITIVE_PARAMS. The first k trees of a forest (k iterations of
+    boosting) fitted with the same random_state are the trees of the model fitted with k, so the scores are the same as
+    of GridSearchCV (boosting with early stopping stops at the same iteration). Grids without an additive parameter
+    are evaluated candidate by candidate.
+
+    cv_results_ has a row for each candidate. The fit time of a prefix is estimated as the fit time of the largest
+    ensemble multiplied by the share of its stages, the score time is measured.
+
+    Parameters
+    ----------
+    As for GridSearchCV.
+
+    Attributes
+    ----------
+    additive_param_ : str or None
+        The detected additive parameter.
+    n_fits_ : int
+        The number of ensembles fitted during the search (without refit).
+    cv_results_, best_index_, best_params_, best_score_, best_estimator_ :
+        As for GridSearchCV.
+    """
+    def _group_candidates(self, candidates):
+        self.additive_param_ = additive_param(self.estimator, {name for candidate in candidates for name in candidate})
+        return group_candidates_by(candidates, self.additive_param_)
+
+    def _evaluate_group(self, estimator, X, y, train, test, candidates, scorers, fit_params):
+        X_train, y_train = _safe_indexing(X, train), _safe_indexing(y, train)
+        X_test, y_test = _safe_indexing(X, test), _safe_indexing(y, test)
+        sizes = [candidate.get(self.additive_param_) for candidate in candidates]
+        largest = int(np.argmax(sizes)) if self.additive_param_ else 0
+
+        start_time = time.perf_counter()
+        try:
+            estimator.set_params(**clone(candidates[largest], safe=False))
+            estimator.fit(X_train, y_train, **fit_params)
+        except Exception:
+            return self._fit_failed(candidates, time.perf_counter() - start_time)
+        fit_time = time.perf_counter() - start_time
+        if self.additive_param_ is None:
+            return [{'fit_time': fit_time, **self._score_fitted(estimator, X_test, y_test, X_train, y_train, scorers)}]
+
+        model = _ensemble(estimator)
+        param, stages_attr, n_stages_attr = ADDITIVE_PARAMS[model.__class__.__name__]
+        stages = getattr(model, stages_attr)
+        n_stages = getattr(model, n_stages_attr) if n_stages_attr else len(stages)
+        results = []
+        try:
+            for size in sizes:
+                setattr(model, stages_attr, stages[:size])
+                setattr(model, param, size)
+                if n_stages_attr:
+                    setattr(model, n_stages_attr, min(size, n_stages))
+                res = self._score_fitted(estimator, X_test, y_test, X_train, y_train, scorers)
+                results.append({'fit_time': fit_time * min(size, n_stages) / n_stages, **res})
+        finally:
+            setattr(model, stages_attr, stages)
+            setattr(model, param, sizes[largest])
+            if n_stages_attr:
+                setattr(model, n_stages_attr, n_stages)
+        return results
+
+
+# regularisation parameters of linear models: {estimator class name: (parameter, True if the regularisation
+# weakens as the parameter grows)}, the path goes from the strongest regularisation to the weakest one
+PATH_PARAMS = {
+    'LogisticRegression': ('C', True),
+    'SGDClassifier': ('alpha', False),
+}
+
+
+class RegularisationPathSearchCV(FoldGroupSearchCV):
+    """
+    Grid search which walks the regularisation grid of a linear model (C of LogisticRegression, alpha of SGDClassifier)
+    in order on each fold, from the strongest regularisation to the weakest one, starting each fit from the coefficients
+    of the previous value (warm_start). The transformers of the pipeline are fitted once per fold and path.
+
+    By default the whole path is walked, so the results are those of GridSearchCV. If `patience` is given, the walk
+    on a fold stops when the `refit` score on the test fold has not improved by more than `tol` for `patience` values
+    in a row; the scores of the remaining values on this fold are NaN and their fit time is 0. The stop is decided
+    on each fold separately, so a value skipped on one fold has a NaN mean score and is ranked last even if it is
+    the best on the other folds: the search is faster but may choose another candidate than GridSearchCV.
+    Grids without a regularisation parameter are evaluated candidate by candidate.
+
+    The coefficients of a warm started LogisticRegression converge to the same optimum (up to the solver's `tol`,
+    liblinear ignores warm_start), SGDClassifier continues the stochastic optimisation, so its scores differ
+    from the fits from scratch.
+
+    Parameters
+    ----------
+    patience : int or None, default=None
+        The number of values without improvement after which the walk on a fold stops, None to evaluate the whole path.
+    tol : float, default=1e-4
+        The minimal improvement of the score.
+    estimator, param_grid, scoring, refit, cv, n_jobs, verbose, pre_dispatch, error_score, return_train_score :
+        As for GridSearchCV.
+
+    Attributes
+    ----------
+    path_param_ : str or None
+        The detected regularisation parameter.
+    n_fits_ : int
+        The number of paths walked during the search (number of groups * number of folds).
+    cv_results_, best_index_, best_params_, best_score_, best_estimator_ :
+        As for GridSearchCV.
+    """
+    def __init__(self, estimator, param_grid, *, patience=None, tol=1e-4, scoring=None, n_jobs=None, refit=True, cv=None,
+                 verbose=0, pre_dispatch='2*n_jobs', error_score=np.nan, return_train_score=True):
+        super().__init__(estimator, param_grid, scoring=scoring, n_jobs=n_jobs, refit=refit, cv=cv, verbose=verbose,
+                         pre_dispatch=pre_dispatch, error_score=error_score, return_train_score=return_train_score)
+        self.patience = patience
+        self.tol = tol
+
+    def _group_candidates(self, candidates):
+        self.path_param_ = _model_param(self.estimator, {name for candidate in candidates for name in candidate},
+                                        {model: param for model, (param, _) in PATH_PARAMS.items()})
+        return group_candidates_by(candidates, self.path_param_)
+
+    def _evaluate_group(self, estimator, X, y, train, test, candidates, scorers, fit_params):
+        X_train, y_train = _safe_indexing(X, train), _safe_indexing(y, train)
+        X_test, y_test = _safe_indexing(X, test), _safe_indexing(y, test)
+
+        start_time = time.perf_counter()
+        try:
+            estimator.set_params(**clone(candidates[0], safe=False))
+            if isinstance(estimator, Pipeline):
+                transformers, model = estimator[:-1], estimator.steps[-1][1]
+                Xt_train = transformers.fit_transform(X_train, y_train)
+                Xt_test = transformers.transform(X_test)
+            else:
+                Xt_train, Xt_test, model = X_train, X_test, estimator
+        except Exception:
+            return self._fit_failed(candidates, time.perf_counter() - start_time)
+        # the transformers' fit time is shared by the values of the path
+        transform_time = (time.perf_counter() - start_time) / len(candidates)
+
+        order = range(len(candidates))
+        if self.path_param_ is not None:
+            model.set_params(warm_start=True)
+            weakens_with_value = PATH_PARAMS[_ensemble(model).__class__.__name__][1]
+            order = sorted(order, key=lambda i: candidates[i][self.path_param_], reverse=not weakens_with_value)
+        refit_metric = self.refit if isinstance(self.refit, str) else 'score'
+
+        results = [None] * len(candidates)
+        best_score, n_without_improvement = -np.inf, 0
+        for step, i in enumerate(order):
+            start_time = time.perf_counter()
+            try:
+                if self.path_param_ is not None:
+                    estimator.set_params(**{self.path_param_: candidates[i][self.path_param_]})
+                model.fit(Xt_train, y_train, **fit_params)
+            except Exception:
+                # the rest of the path would start from a broken model
+                for j in order[step:]:
+                    results[j] = self._fit_failed([candidates[j]], transform_time)[0]
+                break
+            fit_time = transform_time + time.perf_counter() - start_time
+            results[i] = {'fit_time': fit_time, **self._score_fitted(model, Xt_test, y_test, Xt_train, y_train, scorers)}
+
+            test_scores = results[i]['test_scores']
+            score = test_scores[refit_metric] if isinstance(test_scores, dict) else test_scores
+            if score > best_score + self.tol:
+                best_score, n_without_improvement = score, 0
+            else:
+                n_without_improvement += 1
+            if self.patience is not None and n_without_improvement >= self.patience:
+                skipped = {k: np.nan for k in test_scores} if isinstance(test_scores, dict) else np.nan
+                for j in order[step + 1:]:
+                    results[j] = {'fit_time': 0.0, 'score_time': 0.0, 'test_scores': skipped, 'n_test_samples': len(test), 'fit_error': None}
+                    if self.return_train_score:
+                        results[j]['train_scores'] = skipped
+                break
+        return results
+
+
+def benchmark_searches(searches: dict, X, y) -> pd.DataFrame:
+    """
+    Fit the searches (e.g. GridSearchCV and one of SEARCH_MODES with the same estimator, grid and folds) and compare
+    their wall time, number of fits, best parameters and scores.
+
+    Args:
+        searches (dict): {name: search object}, the first one is the reference.
+        X, y: The train set, e.g. the full training set of the stages.
+
+    Returns:
+        pd.DataFrame: for each search the wall time (sec), the number of fits, the best score and parameters,
+            the largest absolute difference of `mean_test_<refit>` from the reference (NaN rows are skipped)
+            and the number of candidates which were not evaluated (NaN scores).
+    """
+    rows, reference = [], None
+    for name, search in searches.items():
+        start_time = time.perf_counter()
+        search.fit(X, y)
+        wall_time = time.perf_counter() - start_time
+        metric = search.refit if isinstance(search.refit, str) else 'score'
+        mean_test = np.asarray(search.cv_results_[f'mean_test_{metric}'], dtype=float)
+        if reference is None:
+            reference = mean_test
+        rows.append({'search': name, 'wall_time': wall_time,
+                     'n_fits': getattr(search, 'n_fits_', len(mean_test) * search.n_splits_),
+                     'best_score': search.best_score_, 'best_params': search.best_params_,
+                     'max_score_diff': np.nanmax(np.abs(mean_test - reference)) if not np.isnan(mean_test).all() else np.nan,
+                     'not_evaluated': int(np.isnan(mean_test).sum())})
+    return pd.DataFrame(rows).set_index('search')
+
+
+TRAIN_LENGTH = 'train_length'
+WINDOW_UNITS = ('dates', 'rows')
+
+
+def _row_dates(X) -> np.ndarray:
+    """Return the date of each row of a data set indexed by dates (or with the 'date' level of the index)."""
+    index = X.index
+    if isinstance(index, pd.MultiIndex):
+        index = index.get_level_values('date')
+    return np.asarray(index)
+
+
+def train_window(dates, train_length: int, unit: str = 'dates') -> np.ndarray:
+    """
+    Return the indices of the rows of the train window of the given length.
+
+    Args:
+        dates (array-like): The date of each row of the train set.
+        train_length (int): The maximal number of rows in the window.
+        unit (str): 'rows' to take the last `train_length` rows (as WrapModelTrainSizeParam does, the first date
+            of the window may be cut), 'dates' to take the most recent whole dates with at most `train_length`
+            rows in total (at least the last date).
+
+    Returns:
+        np.ndarray: Indices of the rows of the window.
+    """
+    dates = np.asarray(dates)
+    if unit == 'rows':
+        return np.arange(max(0, len(dates) - train_length), len(dates))
+    unique_dates, counts = np.unique(dates, return_counts=True)
+    rows_from_end = np.cumsum(counts[::-1])
+    n_dates = max(1, np.searchsorted(rows_from_end, train_length, side='right'))
+    return np.flatnonzero(dates >= unique_dates[-n_dates])
+
+
+class TrainWindowSearchCV(FoldGroupSearchCV):
+    """
+    Grid search over the train length of WrapModelTrainSizeParam which fits the transformers of the pipeline once
+    per fold and trains the classifier on sub-windows of the transformed fold, so each extra `train_length` value
+    costs only the classifier's fit.
+
+    The transformers are fitted on the whole train fold, as in GridSearchCV. With `unit='rows'` the window is the last
+    `train_length` rows, as WrapModelTrainSizeParam takes them, and the scores are the same as of GridSearchCV.
+    With `unit='dates'` (default) the window is the most recent whole dates with at most `train_length` rows, so
+    the companies of the first date of the window are not cut off; the best candidate is refitted on such a window too
+    (refitting `best_estimator_` by hand takes the last rows again).
+
+    Parameters
+    ----------
+    unit : str, default='dates'
+        'dates' or 'rows', see above.
+    estimator, param_grid, scoring, refit, cv, n_jobs, verbose, pre_dispatch, error_score, return_train_score :
+        As for GridSearchCV.
+
+    Attributes
+    ----------
+    train_length_param_ : str or None
+        The train length parameter of the grid.
+    n_fits_ : int
+        The number of transformers' fits during the search (number of groups * number of folds).
+    cv_results_, best_index_, best_params_, best_score_, best_estimator_ :
+        As for GridSearchCV.
+    """
+    def __init__(self, estimator, param_grid, *, unit='dates', scoring=None, n_jobs=None, refit=True, cv=None,
+                 verbose=0, pre_dispatch='2*n_jobs', error_score=np.nan, return_train_score=True):
+        super().__init__(estimator, param_grid, scoring=scoring, n_jobs=n_jobs, refit=refit, cv=cv, verbose=verbose,
+                         pre_dispatch=pre_dispatch, error_score=error_score, return_train_score=return_train_score)
+        self.unit = unit
+
+    def _group_candidates(self, candidates):
+        if self.unit not in WINDOW_UNITS:
+            raise ValueError(f'unit must be one of {WINDOW_UNITS}, got {self.unit!r}')
+        names = [name for name in {name for candidate in candidates for name in candidate}
+                 if name.rpartition('__')[2] == TRAIN_LENGTH]
+        self.train_length_param_ = names[0] if names else None
+        return group_candidates_by(candidates, self.train_length_param_)
+
+    def _transform(self, estimator, X_train, y_train, X_test=None):
+        """Fit the transformers of the pipeline on the train set and return the transformed sets and the final step."""
+        transformers, model = estimator[:-1], estimator.steps[-1][1]
+        Xt_train = transformers.fit_transform(X_train, y_train)
+        Xt_test = transformers.transform(X_test) if X_test is not None else None
+        return Xt_train, Xt_test, model
+
+    def _fit_window(self, model, Xt_train, y_train, dates, train_length, fit_params):
+        """Fit the classifier wrapped by WrapModelTrainSizeParam on the train window."""
+        window = train_window(dates, train_length, self.unit)
+        model.train_length = train_length
+        model.model_instance.fit(_safe_indexing(Xt_train, window), _safe_indexing(y_train, window), **fit_params)
+        model.classes_ = model.model_instance.classes_
+
+    def _evaluate_group(self, estimator, X, y, train, test, candidates, scorers, fit_params):
+        X_train, y_train = _safe_indexing(X, train), _safe_indexing(y, train)
+        X_test, y_test = _safe_indexing(X, test), _safe_indexing(y, test)
+        if self.train_length_param_ is None:
+            start_time = time.perf_counter()
+            try:
+                estimator.set_params(**clone(candidates[0], safe=False))
+                estimator.fit(X_train, y_train, **fit_params)
+            except Exception:
+                return self._fit_failed(candidates, time.perf_counter() - start_time)
+            fit_time = time.perf_counter() - start_time
+            return [{'fit_time': fit_time, **self._score_fitted(estimator, X_test, y_test, X_train, y_train, scorers)}]
+
+        start_time = time.perf_counter()
+        try:
+            estimator.set_params(**clone(candidates[0], safe=False))
+            Xt_train, Xt_test, model = self._transform(estimator, X_train, y_train, X_test)
+        except Exception:
+            return self._fit_failed(candidates, time.perf_counter() - start_time)
+        # the transformers' fit time is shared by the windows
+        transform_time = (time.perf_counter() - start_time) / len(candidates)
+        dates = _row_dates(X_train)
+
+        results = []
+        for candidate in candidates:
+            start_time = time.perf_counter()
+            try:
+                self._fit_window(model, Xt_train, y_train, dates, candidate[self.train_length_param_], fit_params)
+            except Exception:
+                results.extend(self._fit_failed([candidate], transform_time))
+                continue
+            fit_time = transform_time + time.perf_counter() - start_time
+            results.append({'fit_time': fit_time, **self._score_fitted(model, Xt_test, y_test, Xt_train, y_train, scorers)})
+        return results
+
+    def _refit(self, estimator, X, y, fit_params):
+        if self.train_length_param_ is None or self.unit == 'rows':
+            return super()._refit(estimator, X, y, fit_params)
+        Xt, _, model = self._transform(estimator, X, y)
+        self._fit_window(model, Xt, y, _row_dates(X), self.best_params_[self.train_length_param_], fit_params)
+
+
+BUDGET_TYPES = ('wall', 'cpu')
+
+
+def encode_candidates(candidates: list[dict]) -> np.ndarray:
+    """
+    Encode the candidates' parameters as a numeric matrix for a surrogate model: numeric values are kept,
+    other values (e.g. transformers) are replaced by the code of their `str`, missing parameters by -1.
+    """
+    names = list(dict.fromkeys(name for candidate in candidates for name in candidate))
+    features = np.full((len(candidates), len(names)), -1.0)
+    for j, name in enumerate(names):
+        present = np.array([name in candidate for candidate in candidates])
+        values = [candidate[name] for candidate in candidates if name in candidate]
+        if all(isinstance(value, (int, float, np.number)) and not isinstance(value, bool) for value in values):
+            features[present, j] = values
+        else:
+            features[present, j] = pd.factorize(np.array([str(value) for value in values], dtype=object))[0]
+    return features
+
+
+class BudgetedSearchCV(BaseSearchCV):
+    """
+    Search over a parameters grid limited by a time budget: the candidates are sampled in batches,
+    at random first, then by a surrogate model (a random forest regressor of the `refit` score on the encoded
+    parameters) which picks the candidates with the largest upper confidence bound `mean + kappa * std`
+    of the trees' predictions. The search stops when the budget is spent or all the candidates are evaluated.
+
+    Only the evaluated candidates are in cv_results_, the scoring and refit are the same as of GridSearchCV,
+    so the analyzing functions work on the results (the parameters' values which were not evaluated are missing).
+
+    Parameters
+    ----------
+    estimator, param_grid :
+        The pipeline and the parameters grid, as for GridSearchCV.
+    budget : float, default=600
+        The budget in seconds.
+    budget_type : str, default='wall'
+        'wall' for the wall-clock time of the search, 'cpu' for the sum of fit and score times of all the fits
+        (CPU-seconds spent by the workers).
+    n_initial : int, optional
+        The number of random candidates before the surrogate model is used, by default 2 batches.
+    batch_size : int, optional
+        The number of candidates evaluated together, by default the number of parallel jobs.
+        The last batch is shortened to the candidates which are expected to fit into the rest of the budget.
+    kappa : float, default=1.0
+        The exploration weight of the upper confidence bound.
+    random_state : int, optional
+        Seed of the random candidates and the surrogate model.
+    scoring, refit, cv, n_jobs, verbose, pre_dispatch, error_score, return_train_score :
+        As for GridSearchCV. The candidates are ranked by the `refit` score.
+
+    Attributes
+    ----------
+    search_history_ : pd.DataFrame
+        For each batch: the way the candidates were chosen, their number, the time spent and the best score so far.
+    budget_used_ : float
+        The spent budget in seconds.
+    cv_results_, best_index_, best_params_, best_score_, best_estimator_ :
+        As for GridSearchCV; cv_results_ has the additional keys 'iter' (the batch) and 'selection' ('random' or 'model').
+    """
+    def __init__(self, estimator, param_grid, *, budget=600, budget_type='wall', n_initial=None, batch_size=None, kappa=1.0,
+                 random_state=None, scoring=None, n_jobs=None, refit=True, cv=None, verbose=0, pre_dispatch='2*n_jobs',
+                 error_score=np.nan, return_train_score=True):
+        super().__init__(estimator=estimator, scoring=scoring, n_jobs=n_jobs, refit=refit, cv=cv, verbose=verbose,
+                         pre_dispatch=pre_dispatch, error_score=error_score, return_train_score=return_train_score)
+        self.param_grid = param_grid
+        self.budget = budget
+        self.budget_type = budget_type
+        self.n_initial = n_initial
+        self.batch_size = batch_size
+        self.kappa = kappa
+        self.random_state = random_state
+
+    def _propose(self, features, evaluated, scores, n, rng):
+        """Return the indices of the `n` not evaluated candidates with the largest upper confidence bound."""
+        from sklearn.ensemble import RandomForestRegressor
+
+        not_evaluated = np.flatnonzero(~evaluated)
+        scores = np.asarray(scores, dtype=float)
+        scores = np.where(np.isnan(scores), np.nanmin(scores) if not np.isnan(scores).all() else 0.0, scores)
+        surrogate = RandomForestRegressor(n_estimators=100, min_samples_leaf=1, random_state=rng.integers(2**31))
+        surrogate.fit(features[evaluated], scores)
+        predictions = np.stack([tree.predict(features[not_evaluated]) for tree in surrogate.estimators_])
+        upper_bound = predictions.mean(axis=0) + self.kappa * predictions.std(axis=0)
+        return not_evaluated[np.argsort(-upper_bound, kind='stable')[:n]]
+
+    def _run_search(self, evaluate_candidates):
+        if self.budget_type not in BUDGET_TYPES:
+            raise ValueError(f'budget_type must be one of {BUDGET_TYPES}, got {self.budget_type!r}')
+        refit_metric = self.refit if isinstance(self.refit, str) else 'score'
+        candidates = list(ParameterGrid(self.param_grid))
+        features = encode_candidates(candidates)
+        rng = np.random.default_rng(self.random_state)
+        batch_size = self.batch_size or effective_n_jobs(self.n_jobs)
+        n_initial = self.n_initial or 2 * batch_size
+
+        evaluated = np.zeros(len(candidates), dtype=bool)
+        scores = np.full(len(candidates), np.nan)
+        history = []
+        start_time = time.perf_counter()
+        used, n_evaluated = 0.0, 0
+        while not evaluated.all() and used < self.budget:
+            n = min(batch_size, int((~evaluated).sum()))
+            if n_evaluated:
+                # shorten the batch to the candidates which are expected to fit into the rest of the budget
+                time_per_candidate = max(used / n_evaluated, 1e-9)
+                n = max(1, min(n, math.ceil((self.budget - used) / time_per_candidate)))
+            if n_evaluated < n_initial:
+                selection = 'random'
+                batch = rng.choice(np.flatnonzero(~evaluated), size=min(n, n_initial - n_evaluated), replace=False)
+            else:
+                selection = 'model'
+                batch = self._propose(features, evaluated, scores[evaluated], n, rng)
+            results = evaluate_candidates([candidates[i] for i in batch],
+                                          more_results={'iter': [len(history)] * len(batch), 'selection': [selection] * len(batch)})
+            evaluated[batch] = True
+            scores[batch] = results[f'mean_test_{refit_metric}'][-len(batch):]
+            n_evaluated += len(batch)
+            if self.budget_type == 'wall':
+                used = time.perf_counter() - start_time
+            else:
+                n_splits = sum(1 for key in results if key.startswith('split') and key.endswith(f'_test_{refit_metric}'))
+                used = float(np.sum(results['mean_fit_time'] + results['mean_score_time'])) * n_splits
+            history.append({'iter': len(history), 'selection': selection, 'n_candidates': len(batch), 'budget_used': used,
+                            'best_score': np.nanmax(scores) if not np.isnan(scores).all() else np.nan})
+            if self.verbose > 0:
+                print(f'Batch {len(history) - 1} ({selection}): {len(batch)} candidates, '
+                      f'budget used {used:.0f}/{self.budget} sec, best score {history[-1]["best_score"]:.4f}')
+
+        self.search_history_ = pd.DataFrame(history).set_index('iter')
+        self.budget_used_ = used
+
+
+# search classes which can be chosen in `run_classifier_grid_search` by the `search` argument
+SEARCH_MODES = {
+    'grid': GridSearchCV,
+    'halving': TimeSeriesHalvingSearchCV,
+    'prefix': PrefixEnsembleSearchCV,
+    'path': RegularisationPathSearchCV,
+    'window': TrainWindowSearchCV,
+    'budget': BudgetedSearchCV,
+}
@@ -0,0 +1,562 @@
+import json
+import numbers
+import os
+import warnings
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+from consts import format
+from input_output_plot.printing import output_formatting as paint
+
+
+STAGE_INDEX_FILE = 'stage.json'
+STAGE_FORMAT_VERSION = 1
+# attributes of the search objects which are saved with the key results if they exist
+SEARCH_EXTRA_ATTRIBUTES = ['time_saved_', 'n_fits_', 'additive_param_', 'path_param_', 'train_length_param_']
+
+
+def _to_json_value(value):
+    """
+    Convert a parameter's value to a JSON value: numbers and strings are kept, numpy scalars are converted to python
+    ones, lists and dicts are converted recursively, other objects (e.g. transformers) are replaced by their `str`,
+    which is how the analyzing functions display them.
+    """
+    if value is None or isinstance(value, (str, bool)):
+        return value
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, numbers.Number):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_to_json_value(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _to_json_value(v) for k, v in value.items()}
+    return str(value)
+
+
+def _params_to_json(params):
+    """Convert a dict of parameters (or a list of such dicts, e.g. a param_grid) to JSON values."""
+    if isinstance(params, dict):
+        return {name: _to_json_value(value) for name, value in params.items()}
+    return [_params_to_json(params_) for params_ in params]
+
+
+def _file_name(name: str) -> str:
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+
+
+class StoredCvResults(Mapping):
+    """
+    Read-only `cv_results_` of a stored search: the score and time columns are read from the .npz file
+    on first access (one column at a time), 'params' and the 'param_<name>' columns are built from the stage index.
+    """
+    def __init__(self, path: str, params: list[dict]):
+        self._path = path
+        self._params = params
+        self._columns = {}
+        with np.load(path) as npz:
+            self._keys = list(npz.keys())
+
+    def _param_column(self, name):
+        values = np.empty(len(self._params), dtype=object)
+        mask = np.ones(len(self._params), dtype=bool)
+        for i, params in enumerate(self._params):
+            if name in params:
+                values[i] = params[name]
+                mask[i] = False
+        return np.ma.MaskedArray(values, mask=mask)
+
+    def _param_names(self):
+        return list(dict.fromkeys(name for params in self._params for name in params))
+
+    def __getitem__(self, key):
+        if key == 'params':
+            return self._params
+        if key not in self._columns:
+            if key.startswith('param_') and key[len('param_'):] in self._param_names():
+                self._columns[key] = self._param_column(key[len('param_'):])
+            elif key in self._keys:
+                with np.load(self._path) as npz:
+                    self._columns[key] = npz[key]
+            else:
+                raise KeyError(key)
+        return self._columns[key]
+
+    def __iter__(self):
+        yield from self._keys
+        yield from (f'param_{name}' for name in self._param_names())
+        yield 'params'
+
+    def __len__(self):
+        return len(self._keys) + len(self._param_names()) + 1
+
+
+class StoredSplits:
+    """Stand-in of the cross-validation splitter of a stored search, it only knows the number of splits."""
+    def __init__(self, n_splits: int):
+        self.n_splits = n_splits
+
+    def get_n_splits(self, X=None, y=None, groups=None):
+        return self.n_splits
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(n_splits={self.n_splits})'
+
+
+class StoredSearch:
+    """
+    A search loaded from a columnar stage store. It has the attributes of a fitted search which are used by
+    `model.analyzing` and `model.validating` (cv_results_, best_params_, best_index_, best_score_, param_grid,
+    cv.get_n_splits()); cv_results_ columns are read lazily. `best_estimator_` is unpickled on first access if it was saved.
+
+    Parameters whose values are not numbers or strings (e.g. transformers) are stored as their `str`.
+    """
+    def __init__(self, folder: str, entry: dict):
+        self._folder = folder
+        self._entry = entry
+        self.search_class = entry['search_class']
+        self.best_params_ = entry['best_params']
+        self.best_index_ = entry['best_index']
+        self.best_score_ = entry['best_score']
+        self.param_grid = entry['param_grid']
+        self.refit = entry['refit']
+        self.n_splits_ = entry['n_splits']
+        self.cv = StoredSplits(entry['n_splits'])
+        self.cv_results_ = StoredCvResults(os.path.join(folder, entry['cv_results_file']), entry['params'])
+        for attribute, value in entry.get('extra', {}).items():
+            setattr(self, attribute, value)
+        if 'halving_schedule' in entry:
+            self.halving_schedule_ = pd.DataFrame(entry['halving_schedule']).set_index('iter')
+
+    @property
+    def best_estimator_(self):
+        if self._entry.get('estimator_file') is None:
+            raise AttributeError('the best estimator of this search was not saved')
+        if not hasattr(self, '_best_estimator'):
+            import joblib
+            self._best_estimator = joblib.load(os.path.join(self._folder, self._entry['estimator_file']))
+        return self._best_estimator
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.search_class}, {len(self.cv_results_["params"])} candidates)'
+
+
+def save_stage(grid_search_results: list[dict], folder: str, save_estimators: bool = False) -> None:
+    """
+    Save the results of a stage (the list returned by `train_classifiers`) as a columnar store in `folder`:
+
+    - stage.json: for each search its name, search time, best parameters, index and score, parameters grid,
+      candidates' parameters, number of splits and other key results;
+    - <name>.cv_results.npz: the numeric columns of cv_results_ (scores, ranks, times), one array per column;
+    - <name>.estimator.pkl: the refitted best estimator, only if `save_estimators` is True;
+    - <name>.result.npz: the numeric arrays of the other keys of the results (e.g. 'predict', 'predict_prob');
+    - <name>.result.pkl: the frames and the other arrays of the other keys (e.g. 'profile').
+
+    The other keys of the results (e.g. 'cpu_budget', the test scores) are saved in stage.json, converted
+    by `_to_json_value`. A warning names each key which cannot be saved.
+    """
+    import joblib
+
+    os.makedirs(folder, exist_ok=True)
+    entries = []
+    for grid_search_result in grid_search_results:
+        grid_search = grid_search_result['grid_search']
+        file_name = _file_name(grid_search_result['name'])
+        cv_results = grid_search.cv_results_
+        columns = {key: np.asarray(value) for key, value in cv_results.items()
+                   if key != 'params' and not key.startswith('param_')}
+        np.savez_compressed(os.path.join(folder, f'{file_name}.cv_results.npz'), **columns)
+
+        entry = {
+            'name': grid_search_result['name'],
+            'search_time': grid_search_result['search_time'],
+            'search_class': grid_search.__class__.__name__,
+            'best_params': _params_to_json(grid_search.best_params_),
+            'best_index': int(grid_search.best_index_),
+            'best_score': float(grid_search.best_score_),
+            'param_grid': _params_to_json(grid_search.param_grid),
+            'refit': _to_json_value(grid_search.refit),
+            'n_splits': int(grid_search.n_splits_),
+            'params': _params_to_json(list(cv_results['params'])),
+            'cv_results_file': f'{file_name}.cv_results.npz',
+            'estimator_file': None,
+            'result_arrays_file': None,
+            'result_objects_file': None,
+            'extra': {attribute: _to_json_value(getattr(grid_search, attribute))
+                      for attribute in SEARCH_EXTRA_ATTRIBUTES if hasattr(grid_search, attribute)},
+            'result': {},
+        }
+        if hasattr(grid_search, 'halving_schedule_'):
+            entry['halving_schedule'] = grid_search.halving_schedule_.reset_index().to_dict(orient='list')
+        arrays, objects = {}, {}
+        for key, value in grid_search_result.items():
+            if key in ('name', 'search_time', 'grid_search'):
+                continue
+            if isinstance(value, np.ndarray) and value.dtype != object:
+                arrays[key] = value
+            elif isinstance(value, (np.ndarray, pd.DataFrame, pd.Series)):
+                objects[key] = value
+            else:
+                try:
+                    json.dumps(value, default=_to_json_value)
+                except (TypeError, ValueError):
+                    warnings.warn(f"the result '{key}' of {grid_search_result['name']} is not saved, it cannot be converted to JSON")
+                    continue
+                entry['result'][key] = value
+        if arrays:
+            entry['result_arrays_file'] = f'{file_name}.result.npz'
+            np.savez_compressed(os.path.join(folder, entry['result_arrays_file']), **arrays)
+        if objects:
+            entry['result_objects_file'] = f'{file_name}.result.pkl'
+            joblib.dump(objects, os.path.join(folder, entry['result_objects_file']))
+        if save_estimators and hasattr(grid_search, 'best_estimator_'):
+            entry['estimator_file'] = f'{file_name}.estimator.pkl'
+            joblib.dump(grid_search.best_estimator_, os.path.join(folder, entry['estimator_file']))
+        entries.append(entry)
+
+    with open(os.path.join(folder, STAGE_INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'format_version': STAGE_FORMAT_VERSION, 'searches': entries}, f, indent=1, default=_to_json_value)
+
+
+def is_stage_store(path: str) -> bool:
+    """Check if `path` is a folder with a columnar stage store."""
+    return os.path.isfile(os.path.join(path, STAGE_INDEX_FILE))
+
+
+def load_stage(folder: str) -> list[dict]:
+    """
+    Load the results of a stage saved by `save_stage`. Returns a list of dicts as `train_classifiers` does:
+    {'name', 'search_time', 'grid_search': StoredSearch, other saved keys}.
+    """
+    import joblib
+
+    with open(os.path.join(folder, STAGE_INDEX_FILE), encoding='utf-8') as f:
+        index = json.load(f)
+    if index['format_version'] != STAGE_FORMAT_VERSION:
+        raise ValueError(f"unsupported stage store format {index['format_version']} in {folder}")
+    grid_search_results = []
+    for entry in index['searches']:
+        result = {'name': entry['name'], 'search_time': entry['search_time'], 'grid_search': StoredSearch(folder, entry),
+                  **entry['result']}
+        if entry.get('result_arrays_file') is not None:
+            with np.load(os.path.join(folder, entry['result_arrays_file'])) as npz:
+                result.update({key: npz[key] for key in npz.files})
+        if entry.get('result_objects_file') is not None:
+            result.update(joblib.load(os.path.join(folder, entry['result_objects_file'])))
+        grid_search_results.append(result)
+    return grid_search_results
+
+
+def convert_stage(pickle_file: str, folder: str, save_estimators: bool = False) -> list[dict]:
+    """Convert the pickled results of a stage to a columnar stage store and return the loaded store."""
+    from pickle import load as pkl_load
+
+    with open(pickle_file, 'rb') as f:
+        grid_search_results = pkl_load(f)
+    save_stage(grid_search_results, folder, save_estimators=save_estimators)
+    size = sum(os.path.getsize(os.path.join(folder, file)) for file in os.listdir(folder))
+    print(f'{pickle_file} ({os.path.getsize(pickle_file)/2**20:.1f} MB) is converted to '
+          f'{paint(folder, format)} ({size/2**20:.1f} MB)')
+    return load_stage(folder)
+
+
+
+STAGES_INDEX_FORMAT_VERSION = 1
+
+
+def _file_signature(results_file: str) -> list:
+    """The modification time and size of a pickled stage or of the index of a stage store, to detect changed stages."""
+    stat = os.stat(os.path.join(results_file, STAGE_INDEX_FILE) if is_stage_store(results_file) else results_file)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _index_entry(grid_search_result: dict) -> dict:
+    """Key results of a search for the stages index: best parameters and scores, timings and the parameters grid."""
+    from helpers import flatten_list_of_dicts
+
+    grid_search = grid_search_result['grid_search']
+    cv_results = grid_search.cv_results_
+    best_index = int(grid_search.best_index_)
+    # flatten_list_of_dicts extends the lists of the first grid, it gets copies of them
+    param_grid = grid_search.param_grid
+    param_grid = {name: list(values) for name, values in param_grid.items()} if isinstance(param_grid, dict) else \
+        [{name: list(values) for name, values in grid.items()} for grid in param_grid]
+    scores = {key[len('mean_'):]: float(cv_results[key][best_index]) for key in cv_results
+              if key.startswith(('mean_test_', 'mean_train_')) or key in ('mean_fit_time', 'mean_score_time')}
+    scores.update({key[len('std_'):] + '_std': float(cv_results[key][best_index]) for key in cv_results
+                   if key.startswith('std_test_')})
+    return {
+        'name': grid_search_result['name'],
+        'search_time': grid_search_result['search_time'],
+        'search_class': getattr(grid_search, 'search_class', grid_search.__class__.__name__),
+        'best_params': _params_to_json(grid_search.best_params_),
+        'best_index': best_index,
+        'best_score': float(grid_search.best_score_),
+        'refit': _to_json_value(grid_search.refit),
+        'param_grid': _params_to_json(grid_search.param_grid),
+        # the parameters as `model.validating.create_comparation_table` displays them, objects in lists are shown by their repr
+        'best_params_str': {name: str(value) for name, value in grid_search.best_params_.items()},
+        'param_grid_str': {name: str(values) for name, values in flatten_list_of_dicts(param_grid).items()},
+        'n_candidates': len(cv_results['params']),
+        'n_splits': int(grid_search.n_splits_),
+        'best_candidate': scores,
+    }
+
+
+class StageIndex:
+    """
+    Read-only index of the key results of saved grid search stages (pickled by `train_classifiers` or stage stores):
+    for each search of each stage its best parameters, best score, the mean scores and times of the best candidate,
+    the search time and the parameters grid, kept in one small JSON file.
+
+    A stage is read (a pickle is unpickled, of a stage store only stage.json is read) when it is added or its file
+    has changed since, cross-stage tables are built from the index without loading any search or estimator.
+
+    Usage
+    -----
+    >>> index = StageIndex('results/stages_index.json')
+    >>> index.add('preselecting', 'results/preselecting.pkl')
+    >>> index.add('train_len', 'results/train_len')  # a stage store
+    >>> create_comparation_table(index.stage_results(), index.stages, ['randomforestclassifier'], ['score', 'max_depth'])
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._stages = {}
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                index = json.load(f)
+            if index['format_version'] != STAGES_INDEX_FORMAT_VERSION:
+                raise ValueError(f"unsupported stages index format {index['format_version']} in {path}")
+            self._stages = index['stages']
+
+    @property
+    def stages(self) -> list[str]:
+        return list(self._stages)
+
+    def _save(self) -> None:
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'format_version': STAGES_INDEX_FORMAT_VERSION, 'stages': self._stages}, f, indent=1,
+                      default=_to_json_value)
+        os.replace(tmp_path, self.path)
+
+    def add(self, stage: str, results_file: str, grid_search_results: list[dict] | None = None) -> None:
+        """
+        Add (or update) the stage saved in `results_file`. Its results are read only if they are not given
+        as `grid_search_results` (e.g. by `train_classifiers` which has them in memory) and the stage is not indexed
+        with the current version of the file.
+        """
+        signature = _file_signature(results_file)
+        indexed = self._stages.get(stage)
+        if grid_search_results is None and indexed is not None and indexed['file'] == results_file and indexed['signature'] == signature:
+            return
+        if grid_search_results is None:
+            grid_search_results = load_stage(results_file) if is_stage_store(results_file) else self._unpickle(results_file)
+        self._stages[stage] = {'file': results_file, 'signature': signature,
+                               'searches': [_index_entry(grid_search_result) for grid_search_result in grid_search_results]}
+        self._save()
+
+    @staticmethod
+    def _unpickle(results_file: str) -> list[dict]:
+        from pickle import load as pkl_load
+
+        print(f'load trained models from {paint(results_file, format)} to index them')
+        with open(results_file, 'rb') as f:
+            return pkl_load(f)
+
+    def refresh(self) -> list[str]:
+        """Re-read the indexed stages whose files have changed, return their names."""
+        changed = [stage for stage, indexed in self._stages.items()
+                   if os.path.exists(indexed['file']) and _file_signature(indexed['file']) != indexed['signature']]
+        for stage in changed:
+            self.add(stage, self._stages[stage]['file'])
+        return changed
+
+    def searches(self, stage: str) -> list[dict]:
+        """Return the indexed key results of the searches of the stage."""
+        return self._stages[stage]['searches']
+
+    def stage_results(self, stages: list[str] | None = None) -> list[list[dict]]:
+        """
+        Return for each stage (all of them by default) the list of its searches as `model.analyzing.add_grid_search_key_results`
+        leaves them: {'name', 'search_time', 'key_results'}, so `model.validating.create_comparation_table` can compare them.
+        The parameters in 'key_results' are the strings the comparison table shows.
+        """
+        return [[{'name': search['name'], 'search_time': search['search_time'],
+                  'key_results': pd.Series([search['param_grid_str'], search['best_params_str'], search['best_score'],
+                                            search['search_time'] / 60],
+                                           index=['Parameters grid', 'Best parameters', 'Best scores', 'Search time(min)'])}
+                 for search in self.searches(stage)]
+                for stage in (self.stages if stages is None else stages)]
+
+    def best_scores_table(self, stages: list[str] | None = None) -> pd.DataFrame:
+        """
+        Return a table with a row for each (stage, search): the search time in minutes, the number of candidates,
+        the best score, the mean scores and times of the best candidate and its parameters.
+        """
+        rows = []
+        for stage in (self.stages if stages is None else stages):
+            for search in self.searches(stage):
+                rows.append({'stage': stage, 'model': search['name'], 'search_time(min)': search['search_time'] / 60,
+                             'n_candidates': search['n_candidates'], 'best_score': search['best_score'],
+                             **search['best_candidate'], 'best_params': str(search['best_params'])})
+        return pd.DataFrame(rows).set_index(['stage', 'model'])
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path!r}, stages={self.stages})'
+
+
+FOREST_INDEX_FILE = 'forest.json'
+FOREST_NODES_FILE = 'nodes.npz'
+FOREST_TRANSFORMERS_FILE = 'transformers.pkl'
+# node arrays of the forest artifact and their dtypes: the thresholds are compared with float32 features as sklearn does
+FOREST_NODE_ARRAYS = {'children_left': np.int32, 'children_right': np.int32, 'feature': np.int32,
+                      'threshold': np.float64, 'value': np.float64, 'missing_go_to_left': np.uint8}
+# node arrays which artifacts saved by older versions do not have, with their values for these artifacts
+FOREST_OPTIONAL_NODE_ARRAYS = {'missing_go_to_left': 0}
+FOREST_CLASSES = {'RandomForestClassifier', 'ExtraTreesClassifier'}
+
+
+class MappedForestClassifier:
+    """
+    Inference-only random forest whose nodes are read from the arrays of a forest artifact (see `save_forest_artifact`).
+
+    The node arrays of all the trees are concatenated and memory-mapped (if the artifact is not compressed),
+    so the processes which load the same artifact share one copy of the pages. The trees are traversed level by level
+    for all the samples and trees at once, only the pairs which have not reached a leaf go to the next level. `predict_proba` gives the same probabilities as the original forest,
+    but is slower than sklearn's compiled traversal: the artifact trades prediction speed for load time and shared memory.
+    It is pickled as the path of the artifact.
+    """
+    def __init__(self, folder: str, chunk_size: int = 2**14):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        with open(os.path.join(folder, FOREST_INDEX_FILE), encoding='utf-8') as f:
+            self.meta_ = json.load(f)
+        self.classes_ = np.asarray(self.meta_['classes'])
+        self.n_classes_ = len(self.classes_)
+        self.n_features_in_ = self.meta_['n_features_in']
+        if self.meta_['feature_names_in'] is not None:
+            self.feature_names_in_ = np.asarray(self.meta_['feature_names_in'], dtype=object)
+        self.roots_ = np.asarray(self.meta_['roots'], dtype=np.int64)
+        if self.meta_['compressed']:
+            with np.load(os.path.join(folder, FOREST_NODES_FILE)) as npz:
+                nodes = {name: npz[name] for name in FOREST_NODE_ARRAYS if name in npz.files}
+        else:
+            nodes = {name: np.load(os.path.join(folder, f'{name}.npy'), mmap_mode='r') for name in FOREST_NODE_ARRAYS
+                     if os.path.exists(os.path.join(folder, f'{name}.npy'))}
+        for name, value in FOREST_OPTIONAL_NODE_ARRAYS.items():
+            if name not in nodes:
+                nodes[name] = np.full(len(nodes['feature']), value, dtype=FOREST_NODE_ARRAYS[name])
+        for name, array in nodes.items():
+            setattr(self, f'{name}_', array)
+
+    def __reduce__(self):
+        return self.__class__, (self.folder, self.chunk_size)
+
+    def _leaves(self, X: np.ndarray) -> np.ndarray:
+        """Return the leaf of each tree for each sample, shape (n_samples, n_trees)."""
+        n_trees = len(self.roots_)
+        nodes = np.tile(self.roots_, len(X))
+        samples = np.repeat(np.arange(len(X)), n_trees)
+        # (sample, tree) pairs which have not reached a leaf yet
+        active = np.flatnonzero(self.feature_[nodes] >= 0)
+        while active.size:
+            active_nodes = nodes[active]
+            values = X[samples[active], self.feature_[active_nodes]]
+            # missing values go to the side chosen during the fit, as in sklearn's trees
+            go_left = np.where(np.isnan(values), self.missing_go_to_left_[active_nodes].astype(bool),
+                               values <= self.threshold_[active_nodes])
+            nodes[active] = np.where(go_left, self.children_left_[active_nodes], self.children_right_[active_nodes])
+            active = active[self.feature_[nodes[active]] >= 0]
+        return nodes.reshape(len(X), n_trees)
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        proba = np.zeros((len(X), self.n_classes_), dtype=np.float64)
+        for start in range(0, len(X), self.chunk_size):
+            leaves = self._leaves(X[start:start + self.chunk_size])
+            for tree in range(leaves.shape[1]):
+                proba[start:start + self.chunk_size] += self.value_[leaves[:, tree]]
+        return proba / len(self.roots_)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.folder!r}, n_trees={len(self.roots_)})"
+
+
+def save_forest_artifact(pipeline, folder: str, compress: bool = False) -> None:
+    """
+    Save a fitted pipeline whose last step is a random forest (optionally wrapped by WrapModelTrainSizeParam)
+    as a compact artifact in `folder`:
+
+    - transformers.pkl: the fitted steps of the pipeline before the forest;
+    - forest.json: classes, number of features, roots of the trees in the node arrays;
+    - children_left.npy, children_right.npy, feature.npy, threshold.npy, value.npy, missing_go_to_left.npy: the nodes
+      of all the trees concatenated (the children are indices in the concatenated arrays, value holds the class
+      probabilities, missing_go_to_left the side of the missing values),
+      or nodes.npz with the same arrays if `compress` is True (smaller, but loaded into memory instead of memory-mapped).
+    """
+    import joblib
+
+    step_name, forest = pipeline.steps[-1]
+    forest = getattr(forest, 'model_instance', forest)  # WrapModelTrainSizeParam
+    if forest.__class__.__name__ not in FOREST_CLASSES or forest.n_outputs_ != 1:
+        raise ValueError(f'the last step of the pipeline must be a single output random forest, got {forest.__class__.__name__}')
+
+    nodes = {name: [] for name in FOREST_NODE_ARRAYS}
+    roots, offset = [], 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        roots.append(offset)
+        for name in ('children_left', 'children_right'):
+            children = getattr(tree, name)
+            nodes[name].append(np.where(children >= 0, children + offset, -1))
+        nodes['feature'].append(tree.feature)
+        nodes['threshold'].append(tree.threshold)
+        nodes['missing_go_to_left'].append(tree.missing_go_to_left)
+        value = tree.value[:, 0, :forest.n_classes_]
+        normalizer = value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        nodes['value'].append(value / normalizer)
+        offset += tree.node_count
+    nodes = {name: np.concatenate(arrays).astype(FOREST_NODE_ARRAYS[name]) for name, arrays in nodes.items()}
+
+    os.makedirs(folder, exist_ok=True)
+    if compress:
+        np.savez_compressed(os.path.join(folder, FOREST_NODES_FILE), **nodes)
+    else:
+        for name, array in nodes.items():
+            np.save(os.path.join(folder, f'{name}.npy'), array, allow_pickle=False)
+    joblib.dump(pipeline[:-1], os.path.join(folder, FOREST_TRANSFORMERS_FILE))
+    feature_names = getattr(forest, 'feature_names_in_', None)
+    meta = {'step_name': step_name, 'forest_class': forest.__class__.__name__, 'classes': forest.classes_.tolist(),
+            'n_features_in': int(forest.n_features_in_),
+            'feature_names_in': None if feature_names is None else [str(name) for name in feature_names],
+            'roots': roots, 'compressed': compress}
+    with open(os.path.join(folder, FOREST_INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=1, default=_to_json_value)
+
+
+def load_forest_artifact(folder: str, verbose: bool = True):
+    """
+    Load a forest artifact saved by `save_forest_artifact` as a pipeline: the fitted transformers and
+    a MappedForestClassifier. Prints the cold load time (and the size of the artifact) if `verbose` is True.
+    """
+    import time
+    import joblib
+    from sklearn.pipeline import Pipeline
+
+    start_time = time.perf_counter()
+    transformers = joblib.load(os.path.join(folder, FOREST_TRANSFORMERS_FILE))
+    forest = MappedForestClassifier(folder)
+    pipeline = Pipeline([*transformers.steps, (forest.meta_['step_name'], forest)])
+    load_time = time.perf_counter() - start_time
+    if verbose:
+        size = sum(os.path.getsize(os.path.join(folder, file)) for file in os.listdir(folder))
+        print(f'Forest artifact {paint(folder, format)} ({size/2**20:.1f} MB, {len(forest.roots_)} trees) '
+              f'is loaded in {paint(f"{load_time:.3f}", format)} sec')
+    return pipeline
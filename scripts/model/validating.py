@@ -1,12 +1,99 @@
 from typing import Iterable, Protocol
+import os
 import warnings
 
 
+import numpy as np
 import pandas as pd
-from sklearn.base import BaseEstimator
+from sklearn.base import BaseEstimator, clone
+from sklearn.pipeline import Pipeline
 
-from helpers import isnumber, is_iterable, is_subdict
+from consts import format
+from helpers import isnumber, is_iterable
 from helpers import ProgressdownDecorator
+from input_output_plot.printing import output_formatting as paint
+
+
+class ParamIndex:
+    """
+    Indexed view of the candidates' parameters of cv_results_ (`cv_results_['params']`).
+
+    Each parameter is stored as the codes of its distinct values (-1 for the candidates without it) and the candidates
+    are grouped by the codes of the parameters of a query once for each set of parameters' names, so finding the
+    candidates which have given values of some parameters ("vary one parameter, fix the rest") is a lookup
+    instead of a scan of all the candidates. Values are compared by == as in `helpers.is_subdict`,
+    unhashable values (e.g. lists) are looked up among the distinct values of the parameter.
+    """
+    def __init__(self, fits_params: list[dict]):
+        self.n_candidates = len(fits_params)
+        self.names = list(dict.fromkeys(name for candidate in fits_params for name in candidate))
+        self.values = {name: [] for name in self.names}
+        self.codes = {name: np.full(self.n_candidates, -1, dtype=np.int32) for name in self.names}
+        self._hashed_codes = {name: {} for name in self.names}
+        self._groups = {}
+        for row, candidate in enumerate(fits_params):
+            for name, value in candidate.items():
+                self.codes[name][row] = self._code(name, value, add=True)
+
+    def _code(self, name: str, value, add: bool = False) -> int:
+        hashed_codes = self._hashed_codes[name]
+        try:
+            code = hashed_codes.get(value, -1)
+            hashable = True
+        except TypeError:
+            code = next((code for code, known in enumerate(self.values[name]) if known == value), -1)
+            hashable = False
+        if code == -1 and add:
+            code = len(self.values[name])
+            self.values[name].append(value)
+            if hashable:
+                hashed_codes[value] = code
+        return code
+
+    def _group(self, names: tuple[str, ...]) -> dict[tuple, np.ndarray]:
+        if not names:
+            return {(): np.arange(self.n_candidates)}
+        codes = np.column_stack([self.codes[name] for name in names])
+        keys, inverse = np.unique(codes, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        rows = np.argsort(inverse, kind='stable')
+        bounds = np.r_[0, np.cumsum(np.bincount(inverse, minlength=len(keys)))]
+        return {tuple(key.tolist()): rows[bounds[i]:bounds[i + 1]] for i, key in enumerate(keys)}
+
+    def rows(self, fixed: dict) -> np.ndarray:
+        """Return the rows (ascending) of the candidates which have all the parameters of `fixed` with the same values."""
+        names = tuple(sorted(fixed))
+        if any(name not in self.codes for name in names):
+            return np.arange(0)
+        key = tuple(self._code(name, fixed[name]) for name in names)
+        if -1 in key:
+            return np.arange(0)
+        if names not in self._groups:
+            self._groups[names] = self._group(names)
+        return self._groups[names].get(key, np.arange(0))
+
+    def rows_varying(self, par_names: str | list[str], params: dict) -> np.ndarray:
+        """Return the rows of the candidates which have the values of `params` except the parameters `par_names`."""
+        par_names = [par_names] if isinstance(par_names, str) else par_names
+        return self.rows({key: val for key, val in params.items() if key not in par_names})
+
+
+# indexes of the latest cv_results_, by the id of their 'params' list (which they keep alive)
+_PARAM_INDEXES = {}
+_PARAM_INDEXES_SIZE = 16
+
+
+def param_index(cv_results) -> ParamIndex:
+    """Return the ParamIndex of cv_results_, building it once for the latest `_PARAM_INDEXES_SIZE` cv_results_."""
+    fits_params = cv_results['params']
+    cached = _PARAM_INDEXES.get(id(fits_params))
+    if cached is not None and cached[0] is fits_params:
+        return cached[1]
+    if len(_PARAM_INDEXES) >= _PARAM_INDEXES_SIZE:
+        del _PARAM_INDEXES[next(iter(_PARAM_INDEXES))]
+    index = ParamIndex(fits_params)
+    _PARAM_INDEXES[id(fits_params)] = (fits_params, index)
+    return index
 
 
 def cv_scores(grid_search, par_names=None, score='score'):
@@ -67,25 +154,24 @@ def cv_scores_per_param(best_params, cv_results, par_name, score='score'):
         A DataFrame containing the mean training and testing scores for the specified 
         hyperparameter values. The index of the DataFrame corresponds to the hyperparameter values.
     """
-    fixed = {key: val for key, val in best_params.items() if key != par_name}
     train_scores = []
     test_scores = []
     par_values = []
-    for idx, candidate in enumerate(cv_results['params']):
-        if is_subdict(fixed, candidate):
-            try:
-                if not isnumber(candidate[par_name]) and not isinstance(candidate[par_name], str):
-                    par_value = str(candidate[par_name])
-                else:
-                    par_value = candidate[par_name]
-                try:    
-                    train_scores.append(cv_results[f'mean_train_{score}'][idx])
-                except KeyError:
-                    continue
-                test_scores.append(cv_results[f'mean_test_{score}'][idx])
-                par_values.append(par_value)
+    for idx in param_index(cv_results).rows_varying(par_name, best_params):
+        candidate = cv_results['params'][idx]
+        try:
+            if not isnumber(candidate[par_name]) and not isinstance(candidate[par_name], str):
+                par_value = str(candidate[par_name])
+            else:
+                par_value = candidate[par_name]
+            try:    
+                train_scores.append(cv_results[f'mean_train_{score}'][idx])
             except KeyError:
                 continue
+            test_scores.append(cv_results[f'mean_test_{score}'][idx])
+            par_values.append(par_value)
+        except KeyError:
+            continue
     if len(train_scores)>0:
         return pd.DataFrame({'train': train_scores, 'test': test_scores}, index=par_values)
     else:
@@ -105,20 +191,19 @@ def cv_scores_per_params(grid_search, par_names, score='score'):
 
     import warnings
     best_params, cv_results = grid_search.best_params_, grid_search.cv_results_
-    fixed = {key: val for key, val in best_params.items() if key not in par_names}
 
     sets = ['train', 'test']
     mean_scores = pd.DataFrame(index=pd.MultiIndex.from_product([[]]*len(par_names), names=par_names), columns=sets)
 
     with warnings.catch_warnings():
-        for idx, candidate in enumerate(cv_results['params']):
-            if is_subdict(fixed, candidate):
-                par_values = _extract_parameter_values(par_names, candidate)
-                for set_ in sets:
-                    try:
-                        mean_scores.loc[tuple(par_values), set_] = cv_results[f'mean_{set_}_{score}'][idx]
-                    except KeyError:
-                        continue
+        for idx in param_index(cv_results).rows_varying(par_names, best_params):
+            candidate = cv_results['params'][idx]
+            par_values = _extract_parameter_values(par_names, candidate)
+            for set_ in sets:
+                try:
+                    mean_scores.loc[tuple(par_values), set_] = cv_results[f'mean_{set_}_{score}'][idx]
+                except KeyError:
+                    continue
     return mean_scores
 
 def _extract_parameter_values(params_names, candidate):
@@ -165,7 +250,6 @@ def cv_scores_on_splits_per_param(grid_search, par_name, splits, scores='roc_auc
 
     
     best_params, cv_results = grid_search.best_params_, grid_search.cv_results_
-    fixed = {key: val for key, val in best_params.items() if key != par_name}
     splits_names = [f'split{i:d}' for i in splits]
     sets = ['train', 'test']
     scores_matrix = pd.DataFrame(index=pd.MultiIndex.from_product([splits_names, sets], names=['split', 'set']), 
@@ -173,16 +257,16 @@ def cv_scores_on_splits_per_param(grid_search, par_name, splits, scores='roc_auc
     
     with warnings.catch_warnings():
         warnings.simplefilter('ignore', category=pd.errors.PerformanceWarning) 
-        for idx, candidate in enumerate(cv_results['params']):
-            if is_subdict(fixed, candidate):
-                par_value = _extract_parameter_values([par_name], candidate)[0]
-                for set_ in sets:
-                    for split in splits_names:
-                        for score in scores:
-                            try:
-                                scores_matrix.loc[(split, set_), (par_value, score)] = cv_results[f'{split}_{set_}_{score}'][idx]
-                            except KeyError:
-                                continue
+        for idx in param_index(cv_results).rows_varying(par_name, best_params):
+            candidate = cv_results['params'][idx]
+            par_value = _extract_parameter_values([par_name], candidate)[0]
+            for set_ in sets:
+                for split in splits_names:
+                    for score in scores:
+                        try:
+                            scores_matrix.loc[(split, set_), (par_value, score)] = cv_results[f'{split}_{set_}_{score}'][idx]
+                        except KeyError:
+                            continue
     scores_matrix = scores_matrix.astype(float)\
         .sort_index(level='split', key=lambda x: x.map(lambda x: int(x.split('split')[-1])), sort_remaining=True)\
         .sort_index(axis=1, level='param_value', sort_remaining=True)
@@ -209,7 +293,6 @@ def cv_scores_on_splits(grid_search, n=3, scores:Iterable|str|None=None, confusi
         A DataFrame containing the top scores for each split and set (train/test).
     """
 
-    import warnings
     from collections.abc import Iterable
 
     if scores is None:
@@ -239,47 +322,92 @@ def cv_scores_on_splits(grid_search, n=3, scores:Iterable|str|None=None, confusi
 
     splits = [f'split{i:d}' for i in range(n_splits)]
     sets = ['train', 'test']
+    metrics = [*scores, *confusion_matrix_cells]
 
-    top_scores_matrix = pd.DataFrame(index=pd.MultiIndex.from_product([splits, sets, *[[]]*len(params_names)], names=['split', 'set', *column_names]), columns=[*scores, *confusion_matrix_cells])
-    best_estimator_scores = pd.DataFrame(index=pd.MultiIndex.from_product([splits, sets], names=['split', 'set']), columns=[*scores, *confusion_matrix_cells])
+    tensor, available = _cv_results_tensor(cv_results, splits, sets, metrics)
+    n_scores = len(scores)
 
-    with warnings.catch_warnings():
-        warnings.simplefilter('ignore', category=pd.errors.PerformanceWarning) 
-        for split in splits:
-            for set_ in sets:
-                for score in scores:
-                    try:
-                        fit_scores = cv_results[f'{split}_{set_}_{score}'] # scores for all candidates
-                    except KeyError:
-                        continue
-                    _extract_top_fit_scores(top_scores_matrix, n, cv_results, fit_scores, params_names, confusion_matrix_cells, score, split, set_)
-                    best_estimator_scores.loc[(split, set_), score] = fit_scores[grid_search.best_index_]
-                for cm_cell in confusion_matrix_cells:
-                    best_estimator_scores.loc[(split, set_), cm_cell] = cv_results[f'{split}_{set_}_{cm_cell}'][grid_search.best_index_]
-                
+    # rows of the top scores in the order they are found: (split, set, *parameters' values) -> row
+    rows = {}
+    values = []
+    candidates_values = None
+    for split_idx, split in enumerate(splits):
+        for set_idx, set_ in enumerate(sets):
+            for score_idx, score in enumerate(scores):
+                if not available[split_idx, set_idx, score_idx]:
+                    continue
+                missing_cells = [cell for cell_idx, cell in enumerate(confusion_matrix_cells)
+                                 if not available[split_idx, set_idx, n_scores + cell_idx]]
+                if missing_cells:
+                    # as cv_results[key] does for the confusion matrix cells of a set with scores
+                    raise KeyError(f'{split}_{set_}_{missing_cells[0]}')
+                if candidates_values is None:
+                    candidates_values = _candidates_parameter_values(cv_results['params'], params_names)
+                for idx in _top_indexes(tensor[:, split_idx, set_idx, score_idx], n):
+                    key = (split, set_, *candidates_values[idx])
+                    row = rows.setdefault(key, len(rows))
+                    if row == len(values):
+                        values.append(np.full(len(metrics), np.nan))
+                    values[row][score_idx] = tensor[idx, split_idx, set_idx, score_idx]
+                    values[row][n_scores:] = tensor[idx, split_idx, set_idx, n_scores:]
+
+    index_names = ['split', 'set', *column_names]
+    if rows:
+        top_scores_matrix = pd.DataFrame(np.array(values), index=pd.MultiIndex.from_tuples(list(rows), names=index_names), columns=metrics)
+    else:
+        top_scores_matrix = pd.DataFrame(index=pd.MultiIndex.from_product([splits, sets, *[[]]*len(params_names)], names=index_names), columns=metrics)
+
+    best_values = tensor[grid_search.best_index_].reshape(len(splits) * len(sets), len(metrics))
+    best_estimator_scores = pd.DataFrame(best_values, index=pd.MultiIndex.from_product([splits, sets], names=['split', 'set']), columns=metrics)
 
     top_scores_matrix = top_scores_matrix.astype(float).sort_index(level='split', key=lambda x: x.map(lambda x: int(x.split('split')[-1])), sort_remaining=True)
     best_estimator_scores = best_estimator_scores.astype(float)
     return top_scores_matrix, best_estimator_scores
 
-def _extract_top_fit_scores(res, n, cv_results, fit_scores, params_names, confusion_matrix_cells, score, split, set_):
-    import heapq
-    fits_params = cv_results['params']
-    n_fits =  len(fits_params)
+
+def _cv_results_tensor(cv_results, splits, sets, metrics) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the scores of cv_results_ as a (candidate x split x set x metric) tensor and the (split x set x metric)
+    mask of the scores present in cv_results_ (the missing ones are NaN in the tensor).
+    """
+    n_candidates = len(cv_results['params'])
+    tensor = np.full((n_candidates, len(splits), len(sets), len(metrics)), np.nan)
+    available = np.zeros((len(splits), len(sets), len(metrics)), dtype=bool)
+    for split_idx, split in enumerate(splits):
+        for set_idx, set_ in enumerate(sets):
+            for metric_idx, metric in enumerate(metrics):
+                key = f'{split}_{set_}_{metric}'
+                if key in cv_results:
+                    tensor[:, split_idx, set_idx, metric_idx] = cv_results[key]
+                    available[split_idx, set_idx, metric_idx] = True
+    return tensor, available
+
+
+def _candidates_parameter_values(fits_params, params_names) -> list[tuple]:
+    """Return the values of the parameters of each candidate as strings, '-' for the parameters the candidate does not have."""
+    return [tuple(str(candidate[param_name]) if param_name in candidate else '-' for param_name in params_names)
+            for candidate in fits_params]
+
+
+def _top_indexes(fit_scores: np.ndarray, n: int | None) -> np.ndarray:
+    """
+    Return the indexes of the `n` largest scores (all the indexes if `n` is None) in the order of heapq.nlargest:
+    descending scores, the smaller index first on ties. Scores with NaN are ordered by heapq.nlargest itself,
+    as NaN does not compare.
+    """
     if n is None:
-        largest_indexes = range(n_fits)
-    else:
-        largest_indexes = heapq.nlargest(n, range(n_fits), key=fit_scores.__getitem__)
-    for idx in largest_indexes:
-        fit_params_values = []
-        for param_name in params_names:
-            try:
-                fit_params_values.append(str(fits_params[idx][param_name]))
-            except KeyError:
-                fit_params_values.append('-')
-        res.loc[(split, set_, *fit_params_values), score] = fit_scores[idx]
-        for cm_cell in confusion_matrix_cells:
-            res.loc[(split, set_, *fit_params_values), cm_cell] = cv_results[f'{split}_{set_}_{cm_cell}'][idx]
+        return np.arange(fit_scores.size)
+    n = min(n, fit_scores.size)
+    if n <= 0:
+        return np.arange(0)
+    if np.isnan(fit_scores).any():
+        import heapq
+        return np.array(heapq.nlargest(n, range(fit_scores.size), key=fit_scores.__getitem__))
+    kth = np.partition(fit_scores, fit_scores.size - n)[fit_scores.size - n]
+    above = np.flatnonzero(fit_scores > kth)
+    ties = np.flatnonzero(fit_scores == kth)[:n - above.size]
+    indexes = np.r_[above, ties]
+    return indexes[np.lexsort((indexes, -fit_scores[indexes]))]
 
 
 def create_comparation_table(stages_grid_search_results, stages_names, models_to_compare, params_to_compare):
@@ -338,21 +466,20 @@ def cv_scores_on_splits_by_param(grid_search, param_name:str, score:str='roc_auc
                 param_grid = param_grid_elm[param_name]
                 break
                     
-    fixed = {key: val for key, val in best_params.items() if key != param_name}
 
     splits = [f'split{i:d}' for i in range(n_splits)]
     sets = ['train', 'test']
     score_matrix = pd.DataFrame(index=pd.MultiIndex.from_product([splits, sets], names=['split', 'set']), columns=param_grid)
 
     with warnings.catch_warnings():
-        for idx, candidate in enumerate(cv_results['params']):
-            if is_subdict(fixed, candidate):
-                for split in splits:
-                    for set_ in sets:
-                        try:
-                            score_matrix.loc[(split, set_), candidate[param_name]] = cv_results[f'{split}_{set_}_{score}'][idx]
-                        except KeyError:
-                            continue
+        for idx in param_index(cv_results).rows_varying(param_name, best_params):
+            candidate = cv_results['params'][idx]
+            for split in splits:
+                for set_ in sets:
+                    try:
+                        score_matrix.loc[(split, set_), candidate[param_name]] = cv_results[f'{split}_{set_}_{score}'][idx]
+                    except KeyError:
+                        continue
 
     return score_matrix
 
@@ -367,12 +494,87 @@ def custom_warning_handler(ws, shown_warnings):
                 shown_warnings.add(w_id)
                 print(f"\nWarning: {w_id}: {w.category.__name__}: {w.message}")
                 
+class PreparedFold:
+    """
+    The train and test sets of a fold for a model. If the model is a Pipeline, the steps before its final estimator
+    (an unfitted clone of them, see `clone_transformers`) are fitted on the train set (with `fit_transform`
+    as Pipeline.fit does) and both sets are transformed, so only the final estimator is left to fit.
+    """
+    def __init__(self, transformers, X_train, y_train, X_test, y_test):
+        self.transformers = transformers
+        self.test_index = X_test.index
+        if transformers is not None:
+            X_train = transformers.fit_transform(X_train, y_train)
+            X_test = transformers.transform(X_test)
+        self.X_train, self.y_train, self.X_test, self.y_test = X_train, y_train, X_test, y_test
+
+    def estimator(self, model):
+        """Return the estimator to fit on `X_train`: the final estimator of a pipeline, the model itself otherwise."""
+        return model if self.transformers is None else model.steps[-1][1]
+
+    def attach(self, model) -> None:
+        """Put the fitted steps into (a new list of the steps of) the pipeline, so it is fitted on the fold as by `model.fit`."""
+        if self.transformers is not None:
+            model.steps = [*self.transformers.steps, model.steps[-1]]
+
+
+def clone_transformers(model):
+    """Return an unfitted clone of the steps of a pipeline before its final estimator, None for other models."""
+    if isinstance(model, Pipeline) and len(model.steps) > 1:
+        return clone(model[:-1])
+    return None
+
+
+def prefetch_folds(models: list[BaseEstimator], cv: Cv_splitter, X: pd.DataFrame, y: pd.Series, prefetch: int = 1, skip=()):
+    """
+    Yield (split number, list of PreparedFold, one for each model) for the splits of `cv`, preparing the next
+    `prefetch` folds (slicing, fitting and applying the steps before the final estimators) in a background thread
+    while the caller trains the final estimators on the current fold, so a walk-forward evaluation takes about
+    the time of its slowest stage instead of the sum of the stages. `prefetch`=0 prepares each fold when it is needed.
+
+    The folds are prepared one by one, so the memory of `prefetch`+1 prepared folds is held at a time.
+    The splits whose numbers are in `skip` are not prepared nor yielded.
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    # the steps are cloned for all the folds before the thread starts: the caller puts fitted steps into the models
+    # (PreparedFold.attach) while the thread prepares the next folds, so the thread must not read the models
+    transformers = {split_num: [clone_transformers(model) for model in models]
+                    for split_num in range(cv.get_n_splits(X, y)) if split_num not in skip}
+
+    def prepare(split_num, train_index, test_index):
+        X_train, X_test = X.iloc[train_index], X.iloc[test_index]
+        y_train, y_test = y.iloc[train_index], y.iloc[test_index]
+        return [PreparedFold(fold_transformers, X_train, y_train, X_test, y_test) for fold_transformers in transformers.pop(split_num)]
+
+    splits = ((split_num, train_index, test_index) for split_num, (train_index, test_index) in enumerate(cv.split(X))
+              if split_num not in skip)
+    if prefetch == 0:
+        for split_num, train_index, test_index in splits:
+            yield split_num, prepare(split_num, train_index, test_index)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = deque()
+        for split_num, train_index, test_index in splits:
+            pending.append((split_num, executor.submit(prepare, split_num, train_index, test_index)))
+            if len(pending) > prefetch:
+                split_num, future = pending.popleft()
+                yield split_num, future.result()
+        while pending:
+            split_num, future = pending.popleft()
+            yield split_num, future.result()
+
+
 def compare_scores_on_splits(model_tuples:tuple[str,BaseEstimator]|list[tuple[str,BaseEstimator]],
                              cv:Cv_splitter,
                              X:pd.DataFrame,
                              y:pd.Series,
                              score_names:str|list[str]=['accuracy', 'roc_auc'],
-                             verbose=True) -> pd.DataFrame: 
+                             verbose=True,
+                             prefetch:int=1,
+                             n_jobs:int|None=1) -> pd.DataFrame: 
     """
     Evaluates multiple machine learning models across different data splits using cross-validation.
 
@@ -393,6 +595,15 @@ def compare_scores_on_splits(model_tuples:tuple[str,BaseEstimator]|list[tuple[st
     y : pd.Series, optional
         Target values corresponding to X (default: y_train).
 
+    prefetch : int, optional
+        The number of folds prepared ahead in a background thread while the models train on the current fold
+        (default: 1, 0 to prepare each fold when it is needed), see `prefetch_folds`.
+
+    n_jobs : int or None, optional
+        The number of processes fitting the (split, model) pairs in parallel (default: 1, -1 for all the CPUs).
+        The data and the folds are published once into memory-mapped files the workers attach to
+        (see `model.resources.SharedDataset`).
+
     Returns:
     -------
     scores : pd.DataFrame
@@ -402,7 +613,10 @@ def compare_scores_on_splits(model_tuples:tuple[str,BaseEstimator]|list[tuple[st
     Notes:
     ------
     - Models are fitted on the training indices provided by the cross-validation splitter.
-    - Scores are calculated for each test split using a predefined scoring function.
+      The steps of pipelines before the final estimator are fitted while the previous fold trains,
+      the models are left fitted on the last fold. With `n_jobs` other than 1 clones of the models are fitted
+      in the workers and the models are left as they are.
+    - Scores are calculated for each test split from one prediction of the model (see `fold_scores`).
 
     Example:
     --------
@@ -410,8 +624,6 @@ def compare_scores_on_splits(model_tuples:tuple[str,BaseEstimator]|list[tuple[st
     >>> cv = TimeSeriesSplit(n_splits=5)
     >>> compare_scores_on_splits(models, cv, ['accuracy', 'f1'], X_train, y_train)
     """
-    from sklearn.metrics import get_scorer
-
     if isinstance(score_names, str) :
         score_names = [score_names]
 
@@ -420,6 +632,27 @@ def compare_scores_on_splits(model_tuples:tuple[str,BaseEstimator]|list[tuple[st
     
     model_names = [model_tuple[0] if isinstance(model_tuple, tuple) else str(model_tuple) for model_tuple in model_tuples ]
     
+    scores = pd.DataFrame(columns=pd.MultiIndex.from_product([model_names, score_names]), index=pd.Index(range(cv.get_n_splits(X, y)), name='splits'))
+    shown_warnings = set()
+    if n_jobs != 1:
+        from joblib import Parallel, delayed
+        from model.resources import SharedDataset
+
+        if verbose:
+            print(f'Comparing scores on splits with {len(model_tuples)} models: \"{"\", \"".join(model_names)}\" in parallel.')
+        with SharedDataset(X, y, cv) as shared:
+            tasks = [(i, model_name, train_index, test_index, model)
+                     for i, (train_index, test_index) in enumerate(shared.cv.split())
+                     for model_name, model in model_tuples]
+            out = Parallel(n_jobs=n_jobs, verbose=10 if verbose else 0)(
+                delayed(_fit_and_score_fold)(clone(model), shared.X, shared.y, train_index, test_index, score_names)
+                for _, _, train_index, test_index, model in tasks)
+        for (i, model_name, *_), (fold_scores_, ws) in zip(tasks, out):
+            custom_warning_handler(ws, shown_warnings)
+            for score_name in score_names:
+                scores.loc[i, (model_name, score_name)] = fold_scores_[score_name]
+        return scores
+
     if verbose:
         print(f'Comparing scores on splits with {len(model_tuples)} models: \"{"\", \"".join(model_names)}\".')
         progressdown_decorator = ProgressdownDecorator(len(model_tuples), lambda model, X, y: f'\nfit the models on {len(X)} samples .')
@@ -429,64 +662,462 @@ def compare_scores_on_splits(model_tuples:tuple[str,BaseEstimator]|list[tuple[st
     @progressdown_decorator
     def fit(model, X, y): model.fit(X, y) 
     
-    scores = pd.DataFrame(columns=pd.MultiIndex.from_product([model_names, score_names]), index=pd.Index(range(11), name='splits'))
-    scorers = {score_name: get_scorer(score_name) for score_name in score_names}
-    i = 0
-    shown_warnings = set()
-    for tr_idx, ts_idx in cv.split(X):
-        for model_name, model in model_tuples:
+    models = [model for _, model in model_tuples]
+    for i, prepared_folds in prefetch_folds(models, cv, X, y, prefetch):
+        for (model_name, model), fold in zip(model_tuples, prepared_folds):
+            estimator = fold.estimator(model)
             with warnings.catch_warnings(record=True) as w:
-                fit(model, X.iloc[tr_idx], y.iloc[tr_idx])
+                fit(estimator, fold.X_train, fold.y_train)
                 custom_warning_handler(w, shown_warnings)
 
+            fold_scores_ = fold_scores(estimator, fold.X_test, fold.y_test, score_names)
             for score_name in score_names:
-                scores.loc[i, (model_name, score_name)] = scorers[score_name](model, X.iloc[ts_idx], y.iloc[ts_idx])
-        i += 1
+                scores.loc[i, (model_name, score_name)] = fold_scores_[score_name]
+            fold.attach(model)
     return scores
 
+
+def fold_scores(estimator, X_test, y_test, score_names: list[str]) -> dict:
+    """
+    Return the scores of a fitted estimator on a test set from one inference: the scores of `model.scoring.SCORES`
+    are derived from the probabilities (see `model.scoring.predict_once`), other scores use their sklearn scorers.
+    """
+    from sklearn.metrics import get_scorer
+    from model.scoring import SCORES, predict_once, scores_from_predictions
+
+    res = {}
+    derived = [score_name for score_name in score_names if score_name in SCORES]
+    if derived:
+        y_score, y_pred, response_method = predict_once(estimator, X_test)
+        res.update(scores_from_predictions(y_test, y_score, y_pred, positive_label=estimator.classes_[-1],
+                                           scores=derived, confusion_matrix_cells=[], response_method=response_method))
+    for score_name in score_names:
+        if score_name not in res:
+            res[score_name] = get_scorer(score_name)(estimator, X_test, y_test)
+    return res
+
+
+def _fit_and_score_fold(model, X, y, train_index, test_index, score_names):
+    """Fit the model on a fold in a worker process, return its scores and the warnings of the fit."""
+    with warnings.catch_warnings(record=True) as ws:
+        model.fit(X.iloc[train_index], y.iloc[train_index])
+    return fold_scores(model, X.iloc[test_index], y.iloc[test_index], score_names), ws
+
+
+PREDICTIONS_META_FILE = 'predictions.json'
+
+
+def _fold_predictions_file(folder: str, split_num: int) -> str:
+    return os.path.join(folder, f'fold_{split_num:03d}.npz')
+
+
+def _save_fold_predictions(folder: str, split_num: int, predictions: dict) -> None:
+    """Write the predictions of a fold into its own file, through a temporary file so an interrupted write leaves no file."""
+    path = _fold_predictions_file(folder, split_num)
+    temporary_path = f'{path[:-len(".npz")]}.tmp.npz'
+    np.savez(temporary_path, **predictions)
+    os.replace(temporary_path, path)
+
+
+def _predictions_meta(folder: str, meta: dict) -> None:
+    """Write the description of a run into `folder` or check that the predictions in it were made by the same run."""
+    import json
+    path = os.path.join(folder, PREDICTIONS_META_FILE)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved != meta:
+            raise ValueError(f'{folder} contains predictions of another run: {saved}, expected {meta}')
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+
+def _predict_fold(models, X_train, y_train, X_test, y_test, split_num, folder=None):
+    """
+    Fit the models on a fold (in a worker process if called by joblib) and predict the test set once per model,
+    deriving the labels from the probabilities. Return the split number, the predictions (None if they are written
+    into `folder`) and the warnings of the fits.
+    """
+    from model.scoring import predict_once
+
+    predictions = {'index': X_test.index.to_numpy(), 'y': y_test.to_numpy()}
+    with warnings.catch_warnings(record=True) as ws:
+        for i, model in enumerate(models):
+            model.fit(X_train, y_train)
+            predictions[f'proba_{i}'], predictions[f'label_{i}'], _ = predict_once(model, X_test)
+    if folder is None:
+        return split_num, predictions, ws
+    _save_fold_predictions(folder, split_num, predictions)
+    return split_num, None, ws
+
+
+def _predict_shared_fold(models, X, y, train_index, test_index, split_num, folder=None):
+    return _predict_fold(models, X.iloc[train_index], y.iloc[train_index], X.iloc[test_index], y.iloc[test_index], split_num, folder)
+
+
+def load_predictions(folder: str) -> dict[list, list]:
+    """
+    Return the predictions written by `predictions_on_splits` into `folder` in the format of its result.
+    Raises FileNotFoundError if some folds are not predicted yet.
+    """
+    import json
+    with open(os.path.join(folder, PREDICTIONS_META_FILE), encoding='utf-8') as f:
+        meta = json.load(f)
+    folds = []
+    for split_num in range(meta['n_splits']):
+        with np.load(_fold_predictions_file(folder, split_num), allow_pickle=True) as fold:
+            folds.append({key: fold[key] for key in fold.files})
+    return _concat_fold_predictions(folds, meta['n_models'], meta['index_name'])
+
+
+def _concat_fold_predictions(folds: list[dict], num_models: int, index_name) -> dict[list, list]:
+    predicted_probabilities = []
+    predicted = []
+    for i in range(num_models):
+        predicted_probabilities.append(pd.concat([pd.Series(fold[f'proba_{i}'], index=pd.Index(fold['index'], name=index_name)) for fold in folds]))
+        predicted.append(pd.concat([pd.Series(fold[f'label_{i}'], index=pd.Index(fold['index'], name=index_name)) for fold in folds]))
+    res = {
+        'predicted_probabilities': predicted_probabilities,
+        'predicted': predicted,
+    }
+    if all('y' in fold for fold in folds):
+        res['y_true'] = pd.concat([pd.Series(fold['y'], index=pd.Index(fold['index'], name=index_name)) for fold in folds])
+    return res
+
+
 def predictions_on_splits(models:list[BaseEstimator]|BaseEstimator, 
                           cv:Cv_splitter,
                           X:pd.DataFrame,
                           y:pd.Series,
-                          verbose=True)->dict[list, list]:
-    
+                          verbose=True,
+                          prefetch:int=1,
+                          n_jobs:int|None=1,
+                          folder:str|None=None)->dict[list, list]:
+    """
+    Fit the models on the train set of each split of `cv` and predict the test set, returning for each model
+    the predicted probabilities of the positive class and the predicted labels of all the test sets,
+    and the true labels of the test sets ('y_true', e.g. for `model.scoring.best_threshold`).
+    Each model predicts once per fold, the labels are derived from the probabilities (see `model.scoring.predict_once`).
+
+    If `n_jobs` is 1, the next `prefetch` folds are sliced and transformed by the steps of the pipelines
+    in a background thread while the models train on the current fold (see `prefetch_folds`),
+    the models are left fitted on the last fold. Otherwise the folds are fitted on clones of the models
+    by `n_jobs` processes attached to the data published once into memory-mapped files (see `model.resources.SharedDataset`).
+
+    If `folder` is given, the predictions of each fold are written into their own file in it as soon as the fold
+    is predicted instead of being kept in memory, and the folds which are already in the folder are not fitted again,
+    so an interrupted run resumes where it stopped. The result is read from the folder at the end (see `load_predictions`).
+    """
     if isinstance(models, BaseEstimator):
         models = [models]
     num_models = len(models)
+    n_splits = cv.get_n_splits(X, y)
 
-    predictions_proba = [[] for _ in range(num_models)]
-    predictions = [[] for _ in range(num_models)]
-    predicted_probabilities = []
-    predicted = [] 
+    done = set()
+    if folder is not None:
+        os.makedirs(folder, exist_ok=True)
+        _predictions_meta(folder, {'n_splits': n_splits, 'n_models': num_models, 'index_name': X.index.name,
+                                   'models': [_model_name(model) for model in models]})
+        done = {split_num for split_num in range(n_splits) if os.path.exists(_fold_predictions_file(folder, split_num))}
+        if verbose and done:
+            print(f'{len(done)} of {n_splits} splits are already predicted in {folder}.')
+    folds = {}
 
-    if verbose:
-        print(f'Predicting on splits with {num_models} models.')
-        progressdown_decorator = ProgressdownDecorator(num_models, lambda model, X, y, split_num: f'\nSplit {split_num+1}: fit and predict on the models on {len(X)} samples .')
+    shown_warnings = set()
+    if n_jobs != 1:
+        from joblib import Parallel, delayed
+        from model.resources import SharedDataset
+
+        if verbose:
+            print(f'Predicting on splits with {num_models} models in parallel.')
+        with SharedDataset(X, y, cv) as shared:
+            out = Parallel(n_jobs=n_jobs, return_as='generator_unordered', verbose=10 if verbose else 0)(
+                delayed(_predict_shared_fold)([clone(model) for model in models], shared.X, shared.y, train_index, test_index, split_num, folder)
+                for split_num, (train_index, test_index) in enumerate(shared.cv.split()) if split_num not in done)
+            for split_num, predictions, ws in out:
+                custom_warning_handler(ws, shown_warnings)
+                if predictions is not None:
+                    folds[split_num] = predictions
     else:
-        progressdown_decorator = lambda f: f
+        if verbose:
+            print(f'Predicting on splits with {num_models} models.')
+            progressdown_decorator = ProgressdownDecorator(num_models, lambda model, X, y, split_num: f'\nSplit {split_num+1}: fit and predict on the models on {len(X)} samples .')
+        else:
+            progressdown_decorator = lambda f: f
     
-    @progressdown_decorator
-    def fit(model, X, y, split_num): model.fit(X, y) 
+        @progressdown_decorator
+        def fit(model, X, y, split_num): model.fit(X, y) 
+
+        from model.scoring import predict_once
+
+        for split_num, prepared_folds in prefetch_folds(models, cv, X, y, prefetch, skip=done):
+            predictions = {'index': prepared_folds[0].test_index.to_numpy(), 'y': prepared_folds[0].y_test.to_numpy()}
+            for i, (model, fold) in enumerate(zip(models, prepared_folds)):
+                estimator = fold.estimator(model)
+                with warnings.catch_warnings(record=True) as w:
+                    fit(estimator, fold.X_train, fold.y_train, split_num)
+                    custom_warning_handler(w, shown_warnings)
+    
+                predictions[f'proba_{i}'], predictions[f'label_{i}'], _ = predict_once(estimator, fold.X_test)
+                fold.attach(model)
+            if folder is None:
+                folds[split_num] = predictions
+            else:
+                _save_fold_predictions(folder, split_num, predictions)
+
+    if folder is not None:
+        return load_predictions(folder)
+    return _concat_fold_predictions([folds[split_num] for split_num in sorted(folds)], num_models, X.index.name)
+
+
+def _model_name(model) -> str:
+    """Return the class of the model, with the class of the final step for pipelines."""
+    from model.scoring import _final_estimator
+    name = model.__class__.__name__
+    final_name = _final_estimator(model).__class__.__name__
+    return name if name == final_name else f'{name}({final_name})'
+
 
+def _partial_fit_transformer(transformer, X, y) -> list[str]:
+    """
+    Update the statistics of a fitted transformer with new rows: transformers with `partial_fit` (e.g. StandardScaler,
+    MinMaxScaler) are updated, ColumnTransformers, pipelines and wrappers (NamedTransformer) update their parts,
+    other transformers (e.g. TargetEncoder, QuantileTransformer) keep their statistics.
+    Return the names of the updated transformers.
+    """
+    from sklearn.compose import ColumnTransformer
+    from sklearn.utils import _safe_indexing
+
+    if transformer is None or isinstance(transformer, str):
+        return []
+    if hasattr(transformer, 'partial_fit'):
+        transformer.partial_fit(X, y)
+        return [transformer.__class__.__name__]
+    if isinstance(transformer, Pipeline):
+        updated = []
+        for _, _, step in transformer._iter(with_final=False):
+            updated += _partial_fit_transformer(step, X, y)
+            X = step.transform(X)
+        return updated + _partial_fit_transformer(transformer.steps[-1][1], X, y)
+    if isinstance(transformer, ColumnTransformer):
+        updated = []
+        for _, sub_transformer, columns in transformer.transformers_:
+            if not isinstance(sub_transformer, str):
+                updated += _partial_fit_transformer(sub_transformer, _safe_indexing(X, columns, axis=1), y)
+        return updated
+    if isinstance(getattr(transformer, 'transformer', None), BaseEstimator):  # NamedTransformer
+        return _partial_fit_transformer(transformer.transformer, X, y)
+    return []
+
+
+def _renew_forest(forest, X, y, n_new_trees: int, seed_offset: int) -> None:
+    """Add `n_new_trees` trees fitted on (X, y) to a fitted forest with warm start and retire its oldest trees."""
+    import numbers
+    n_trees, random_state = len(forest.estimators_), forest.random_state
+    forest.set_params(warm_start=True, n_estimators=n_trees + n_new_trees)
+    if isinstance(random_state, numbers.Integral):
+        # new seeds of the trees for each step, warm start draws the same seeds for the same number of trees
+        forest.set_params(random_state=random_state + seed_offset)
+    forest.fit(X, y)
+    forest.estimators_ = forest.estimators_[n_new_trees:]
+    forest.set_params(warm_start=False, n_estimators=n_trees, random_state=random_state)
+
+
+def _update_incrementally(model, X_new, y_new, X_window, y_window, n_new_trees, renew_on, split_num) -> tuple[str, list[str]]:
+    """
+    Update a model fitted on the previous train window to the current window, see `incremental_walk_forward`.
+    Return how the final estimator was updated and the names of the updated transformers.
+    """
+    from sklearn.ensemble._forest import BaseForest
+
+    updated = []
+    estimator = model
+    if isinstance(model, Pipeline):
+        for _, _, step in model._iter(with_final=False):
+            updated += _partial_fit_transformer(step, X_new, y_new)
+            X_new = step.transform(X_new)
+        estimator = model.steps[-1][1]
+
+    def last_rows(X, y):
+        train_length = getattr(estimator, 'train_length', None)  # WrapModelTrainSizeParam
+        if train_length is None:
+            return X, y
+        return X[-train_length:], y[-train_length:]
+
+    def transformed_window():
+        return last_rows(model[:-1].transform(X_window) if isinstance(model, Pipeline) else X_window, y_window)
+
+    inner_estimator = estimator.model_instance if getattr(estimator, 'model_instance', None) is not None else estimator  # WrapModelTrainSizeParam
+    if hasattr(inner_estimator, 'partial_fit'):
+        inner_estimator.partial_fit(X_new, y_new)
+        return 'partial_fit', updated
+    if isinstance(inner_estimator, BaseForest):
+        # the new trees must see all the classes of the forest, otherwise they are fitted on the window
+        if renew_on == 'new' and np.isin(inner_estimator.classes_, np.asarray(y_new)).all():
+            X, y = last_rows(X_new, y_new)
+        else:
+            X, y = transformed_window()
+        if n_new_trees is None:
+            n_new_trees = max(1, round(len(inner_estimator.estimators_) * len(y_new) / len(y_window)))
+        _renew_forest(inner_estimator, X, y, n_new_trees, split_num)
+        return f'renew {n_new_trees} trees', updated
+    estimator.fit(*transformed_window())
+    return 'refit', updated
+
+
+def incremental_walk_forward(model: BaseEstimator,
+                             cv: Cv_splitter,
+                             X: pd.DataFrame,
+                             y: pd.Series,
+                             score_names: str | list[str] = ['accuracy', 'roc_auc'],
+                             n_new_trees: int | None = None,
+                             renew_on: str = 'new',
+                             compare: bool = True,
+                             verbose: bool = True) -> pd.DataFrame:
+    """
+    Walk forward through the splits of `cv` updating the model fitted on the first split with the rows new
+    in each train window instead of refitting it on the whole window:
+
+    - estimators with `partial_fit` (SGDClassifier, GaussianNB, ...) are updated with the new rows only,
+    - random forests (RandomForestClassifier, ExtraTreesClassifier) fit `n_new_trees` new trees with warm start and
+      retire their oldest trees, keeping the number of trees (by default the number of new trees is proportional
+      to the share of the new rows in the window). With `renew_on='new'` the new trees are fitted on the new rows
+      only, so an update costs a fit of a few trees on a few rows and the forest is a mix of trees fitted on
+      the successive steps. Such trees are fitted on fewer rows than the trees of a refit, so they are deeper
+      relative to the data and noisier; `renew_on='window'` fits them on the whole window, each one is then as good
+      as a tree of a refit at the cost of a fit of the new trees on the window. If the new rows lack a class
+      of the forest, the new trees are fitted on the window,
+    - the steps of a pipeline with `partial_fit` (e.g. StandardScaler, also inside ColumnTransformers) update their
+      statistics with the new rows, the other steps keep the statistics of the first split,
+    - other estimators are refitted on the window (after the incremental update of the transformers).
+
+    The rows which leave the window are not unlearned by `partial_fit` estimators and transformers.
+    WrapModelTrainSizeParam is unwrapped, its forest is renewed on the last `train_length` (new) rows.
+
+    If `compare` is True, a clone of the model is refitted on each split as well.
+
+    Returns:
+        pd.DataFrame: scores on the test set of each split and the fit (or update) time for 'incremental'
+        and 'refit' (if `compare` is True) modes, and how the incremental model was updated, indexed by split.
+        The names of the updated transformers are in the `attrs['updated_transformers']` of the frame.
+    """
+    import time
+
+    if isinstance(score_names, str):
+        score_names = [score_names]
+    if renew_on not in ('new', 'window'):
+        raise ValueError(f"renew_on must be 'new' or 'window', got {renew_on!r}")
+    modes = ['incremental', 'refit'] if compare else ['incremental']
+    refit_model = clone(model) if compare else None
+    rows = {}
+    updated_transformers = set()
     shown_warnings = set()
+    previous_train = None
     for split_num, (train_index, test_index) in enumerate(cv.split(X)):
-        X_train_fold, X_val_fold = X.iloc[train_index], X.iloc[test_index]
-        y_train_fold, y_val_fold = y.iloc[train_index], y.iloc[test_index]
-        for i, model in enumerate(models):
-            with warnings.catch_warnings(record=True) as w:
-                fit(model, X_train_fold, y_train_fold, split_num)
-                custom_warning_handler(w, shown_warnings)
-    
-            res = model.predict_proba(X_val_fold)
-            predictions_proba[i].append(pd.Series(res[:, 1], index=X_val_fold.index))
-            res = model.predict(X_val_fold)
-            predictions[i].append(pd.Series(res, index=X_val_fold.index))
+        X_window, y_window = X.iloc[train_index], y.iloc[train_index]
+        X_test, y_test = X.iloc[test_index], y.iloc[test_index]
+        row = {}
+        with warnings.catch_warnings(record=True) as w:
+            start_time = time.perf_counter()
+            if previous_train is None:
+                model.fit(X_window, y_window)
+                update = 'fit'
+            else:
+                new_rows = np.setdiff1d(train_index, previous_train, assume_unique=True)
+                update, updated = _update_incrementally(model, X.iloc[new_rows], y.iloc[new_rows], X_window, y_window, n_new_trees, renew_on, split_num)
+                updated_transformers.update(updated)
+            row[('incremental', 'fit_time')] = time.perf_counter() - start_time
+            if compare:
+                start_time = time.perf_counter()
+                refit_model.fit(X_window, y_window)
+                row[('refit', 'fit_time')] = time.perf_counter() - start_time
+            custom_warning_handler(w, shown_warnings)
+        row[('incremental', 'update')] = update
+        for mode, fitted in zip(modes, [model, refit_model]):
+            for score_name, score in fold_scores(fitted, X_test, y_test, score_names).items():
+                row[(mode, score_name)] = score
+        rows[split_num] = row
+        previous_train = train_index
+        if verbose:
+            print(f'Split {split_num + 1}: {update} on {len(train_index)} rows in {row[("incremental", "fit_time")]:.2f} sec', end='')
+            print(f', refit in {row[("refit", "fit_time")]:.2f} sec' if compare else '')
+
+    columns = pd.MultiIndex.from_tuples([(mode, measure) for mode in modes for measure in [*score_names, 'fit_time']]
+                                        + [('incremental', 'update')], names=['mode', 'measure'])
+    scores = pd.DataFrame.from_dict(rows, orient='index').reindex(columns=columns).rename_axis('split')
+    scores.attrs['updated_transformers'] = sorted(updated_transformers)
+    if verbose:
+        summary = scores.drop(columns=('incremental', 'update')).iloc[1:].astype(float).agg(['mean', 'sum'])
+        print(paint('Incremental walk-forward vs refits (splits after the first one):', format))
+        print(pd.DataFrame({measure: summary.loc['sum' if measure == 'fit_time' else 'mean', (slice(None), measure)].droplevel('measure')
+                            for measure in [*score_names, 'fit_time']}))
+        print('Updated transformers:', ', '.join(scores.attrs['updated_transformers']) or '-')
+    return scores
 
 
-    for i in range(num_models):
-        predicted_probabilities.append(pd.concat(predictions_proba[i]))
-        predicted.append(pd.concat(predictions[i]))
-    return {
-        'predicted_probabilities': predicted_probabilities,
-        'predicted': predicted,
-    }
+def _learning_curves_data_digest(X, y, folds, train_sizes, scoring) -> str:
+    """Return a hash of the data, the folds, the train sizes and the scoring, shared by the learning curves of a call."""
+    import joblib
+    data = (pd.util.hash_pandas_object(X, index=True).to_numpy(), pd.util.hash_pandas_object(y, index=True).to_numpy(), list(X.columns))
+    return joblib.hash((data, folds, np.asarray(train_sizes), scoring))
+
+
+def _learning_curve_key(estimator, data_digest: str) -> str:
+    """Return the cache key of a learning curve: a hash of the estimator's parameters and the digest of the data and folds."""
+    import joblib
+    return joblib.hash((clone(estimator), data_digest))
+
+
+def learning_curves(X: pd.DataFrame,
+                    y: pd.Series,
+                    estimators: dict[str, BaseEstimator],
+                    cv: Cv_splitter,
+                    train_sizes=np.linspace(0.1, 1.0, 5),
+                    scoring: str = 'roc_auc',
+                    n_jobs: int | None = -1,
+                    cache_folder: str | None = None,
+                    verbose: bool = True) -> dict[str, dict]:
+    """
+    Compute the learning curves of the estimators (see `sklearn.model_selection.learning_curve`):
+    the (train size x fold) fits of each estimator run in `n_jobs` parallel processes attached to the data
+    and the folds published once into memory-mapped files (see `model.resources.SharedDataset`).
+
+    If `cache_folder` is given, each curve is saved into it by a hash of the estimator's parameters, the data,
+    the folds, the train sizes and the scoring, and loaded instead of being computed again.
+
+    Returns:
+        dict: {estimator name: {'train_sizes': absolute train sizes, 'train_scores', 'test_scores': (size x fold) arrays}},
+        ready for `input_output_plot.plotting.plot_learning_curves`.
+    """
+    from sklearn.model_selection import learning_curve
+    from model.resources import SharedDataset
+
+    folds = [(np.asarray(train_index), np.asarray(test_index)) for train_index, test_index in cv.split(X, y)]
+    curves, to_compute = {}, {}
+    data_digest = None if cache_folder is None else _learning_curves_data_digest(X, y, folds, train_sizes, scoring)
+    for name, estimator in estimators.items():
+        path = None
+        if cache_folder is not None:
+            os.makedirs(cache_folder, exist_ok=True)
+            path = os.path.join(cache_folder, f'learning_curve_{_learning_curve_key(estimator, data_digest)}.npz')
+            if os.path.exists(path):
+                with np.load(path) as curve:
+                    curves[name] = {key: curve[key] for key in curve.files}
+                if verbose:
+                    print(f'Learning curve of {name} is loaded from {path}')
+                continue
+        to_compute[name] = (estimator, path)
+
+    if to_compute:
+        with SharedDataset(X, y, cv) as shared:
+            shared_folds = list(shared.cv.split())
+            for name, (estimator, path) in to_compute.items():
+                if verbose:
+                    print(f'Computing learning curve of {name}')
+                sizes, train_scores, test_scores = learning_curve(estimator, shared.X, shared.y, train_sizes=train_sizes, cv=shared_folds,
+                                                                  scoring=scoring, n_jobs=n_jobs)
+                curves[name] = {'train_sizes': sizes, 'train_scores': train_scores, 'test_scores': test_scores}
+                if path is not None:
+                    np.savez(path, **curves[name])
+    return {name: curves[name] for name in estimators}